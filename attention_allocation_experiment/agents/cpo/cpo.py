@@ -30,6 +30,14 @@ def compute_advs(actual_vals, exp_vals, discount_term, bias_red_param):
 
     return advs
 
+def compute_vine_advs(branch_vals, discount_term):
+    # Advantage of the first action of each branch started from a same state: its return minus the mean of the returns
+    # of the branches (Schulman et al., 2015)
+    returns = torch.stack([discount(vals, discount_term)[0] for vals in branch_vals])
+    advs = returns - returns.mean()
+
+    return advs
+
 
 class CPO:
     @autoassign
@@ -77,7 +85,8 @@ class CPO:
             trajectory_limits = torch.cat([torch.tensor([0]), torch.cumsum(trajectory_sizes, dim=-1)])
             N = np.sum([len(trajectory) for trajectory in memory])
             T = self.simulator.trajectory_len
-            time = torch.cat([torch.arange(size).float() for size in trajectory_sizes])
+            time = torch.cat([torch.arange(trajectory.start_timestep, trajectory.start_timestep + len(trajectory)).float()
+                              for trajectory in memory])
             time = torch.unsqueeze(time, dim=1) / T
             states_w_time = torch.cat([observations, time], dim=1)
 
@@ -102,11 +111,28 @@ class CPO:
                                                     self.discount_cost,
                                                     self.bias_red_cost)
 
+            if memory.branches:
+                # VineSimulator: the policy is updated at the states branched from, with the vine advantages of the
+                # first action of every branch (the trunks still fit the value and cost functions)
+                observations = torch.stack([branch.observations[0] for siblings in memory.branches for branch in siblings])
+                actions = torch.stack([branch.actions[0] for siblings in memory.branches for branch in siblings])
+                reward_advs = torch.cat([compute_vine_advs([torch.tensor(branch.rewards) for branch in siblings],
+                                                           self.discount_val)
+                                         for siblings in memory.branches])
+                cost_advs = torch.cat([compute_vine_advs([torch.tensor(branch.costs) for branch in siblings],
+                                                         self.discount_cost)
+                                       for siblings in memory.branches])
+
             reward_advs -= reward_advs.mean()
             reward_advs /= reward_advs.std()
             cost_advs -= reward_advs.mean()
             cost_advs /= cost_advs.std()
 
+            if memory.branches:
+                # update_policy() sums the cost advantages over the samples: each branch stands for N / len(cost_advs)
+                # timesteps of the trunks, so that the constraint gradient keeps the scale of the single path one
+                cost_advs *= N / len(cost_advs)
+
             if states_w_time_prev is not None:
                 states_w_time_train = torch.cat([states_w_time, states_w_time_prev])
                 disc_rewards_train = torch.cat([disc_rewards, disc_rewards_prev])
@@ -1,3 +1,5 @@
+import copy
+
 import gym
 import numpy as np
 import torch
@@ -7,6 +9,9 @@ from attention_allocation_experiment.config import EP_TIMESTEPS, OBS_HIST_LEN, Z
 
 
 class CPOEnvWrapper(gym.Wrapper):
+  # Episode statistics of the wrapper, saved by snapshot() along with the env
+  SNAPSHOT_VARS = ('timestep', 'ep_incidents_seen', 'ep_incidents_occurred', 'observation_history', 'delta', 'delta_delta')
+
   def __init__(self,
                env,
                reward_fn,
@@ -56,6 +61,18 @@ class CPOEnvWrapper(gym.Wrapper):
 
     return self.observation_history.flatten()
 
+  def snapshot(self):
+    """
+    Mutable state of the wrapper and of the env (see core.FairnessEnv.snapshot), to be passed to restore()
+    """
+    return self.env.snapshot(), {name: copy.deepcopy(getattr(self, name)) for name in self.SNAPSHOT_VARS}
+
+  def restore(self, snapshot):
+    env_snapshot, wrapper_vars = snapshot
+    self.env.restore(env_snapshot)
+    for name, value in wrapper_vars.items():
+      setattr(self, name, copy.deepcopy(value))
+
   def step(self, action):
     """
     :param action: ([float] or int) Action taken by the agent
@@ -0,0 +1,180 @@
+'''
+VecEnv running n_envs attention allocation environments as one BatchedLocationAllocation,
+instead of n_envs (LocationAllocationEnv + PPOEnvWrapper_fair + Monitor_fair) stepped one after the other.
+
+Observations, rewards [r, [r_U_0,..],[r_B_0,..]], infos ('delta', 'delta_delta', and 'episode' at the end of an episode)
+are the ones of PPOEnvWrapper_fair + Monitor_fair; all the envs start and end their episodes at the same steps.
+'''
+import os
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import gym
+import numpy as np
+import pandas as pd
+from gym import spaces
+from stable_baselines3.common.vec_env import VecEnv
+from stable_baselines3.common.vec_env.base_vec_env import VecEnvIndices, VecEnvObs
+
+from attention_allocation_experiment.agents.ppo.ppo_wrapper_env_fair import OBS_HIST_LEN, allocate_attention
+from attention_allocation_experiment.environments.batched_attention_allocation import BatchedLocationAllocation
+from attention_allocation_experiment.environments.rewards import OMEGA
+from sb3_ppo_fair.buffers_fair import unpack_fairness
+
+
+class BatchedVecEnv_fair(VecEnv):
+    '''
+    :param env: LocationAllocationEnv or GeneralLocationAllocationEnv whose initial params are used by every env
+    :param n_envs: number of envs
+    :param env_param_dict: same as for PPOEnvWrapper_fair (include_delta, ep_timesteps, zeta_0, zeta_1, zeta_2)
+    :param packed_rewards: whether step_wait() returns the packed (n_envs, 1 + 2M) array instead of a "fairness list"
+        (see DummyVecEnv_fair)
+    :param seed: seed of the random number generator shared by the envs
+    :param episode_log_paths: if not None, one csv file per env where one row per episode is appended,
+        as with Monitor_fair(episode_log_path=...) (return "r", length "l", time "t", and the totals "U_g", "B_g" of each group)
+    :param log_flush_episodes: number of episodes between two writes of the episode logs
+    '''
+    def __init__(self, env: gym.Env, n_envs: int, env_param_dict: Dict[str, Any], packed_rewards: bool = False,
+                 seed: Optional[int] = None, episode_log_paths: Optional[Sequence[str]] = None, log_flush_episodes: int = 100):
+        self.worlds = BatchedLocationAllocation(env, n_envs, seed=seed)
+        n_locations = self.worlds.n_locations
+
+        self.include_delta = env_param_dict['include_delta']
+        self.ep_timesteps = env_param_dict['ep_timesteps']
+        self.zeta_0 = env_param_dict['zeta_0']
+        self.zeta_1 = env_param_dict['zeta_1']
+        self.zeta_2 = env_param_dict['zeta_2']
+        self.num_groups = n_locations
+        self.packed_rewards = packed_rewards
+
+        num_features = (4 if self.include_delta else 3) * n_locations
+        observation_space = spaces.Box(low=-np.inf, high=np.inf, shape=(num_features * OBS_HIST_LEN,), dtype=np.float32)
+        action_space = spaces.Box(low=-3, high=3, shape=(n_locations,), dtype=np.float64)
+        super().__init__(n_envs, observation_space, action_space)
+
+        self.observation_history = np.zeros((n_envs, OBS_HIST_LEN, num_features))
+        # running sums of the episode, in place of PPOEnvWrapper_fair.ep_incidents_seen / ep_incidents_occurred
+        self.ep_seen_sum = np.zeros((n_envs, n_locations))
+        self.ep_occurred_sum = np.zeros((n_envs, n_locations))
+        self.ep_rewards = np.zeros(n_envs)
+        self.delta = np.zeros(n_envs)
+        self.timestep = 0
+        self.t_start = time.time()
+
+        self.buf_rews = np.zeros((n_envs, 1 + 2 * n_locations), dtype=np.float32)
+        self.buf_rews_list = unpack_fairness(self.buf_rews, n_locations)
+        self.actions = None
+
+        if episode_log_paths is not None:
+            assert len(episode_log_paths) == n_envs, 'episode_log_paths needs one path per env'
+        self.episode_log_paths = episode_log_paths
+        self.log_flush_episodes = log_flush_episodes
+        self.episode_logs = [self._empty_episode_log() for _ in range(n_envs)]
+        self.num_logged_episodes = 0 # episodes kept in self.episode_logs (the same for all the envs)
+
+    def _empty_episode_log(self) -> Dict[str, List[float]]:
+        columns = ["r", "l", "t"] + ["U_{}".format(g) for g in range(self.num_groups)] + ["B_{}".format(g) for g in range(self.num_groups)]
+        return {column: [] for column in columns}
+
+    def _log_episodes(self, ep_time: float) -> None:
+        for i, episode_log in enumerate(self.episode_logs):
+            episode_log["r"].append(self.ep_rewards[i])
+            episode_log["l"].append(self.timestep)
+            episode_log["t"].append(ep_time)
+            for g in range(self.num_groups):
+                episode_log["U_{}".format(g)].append(self.ep_seen_sum[i, g])
+                episode_log["B_{}".format(g)].append(self.ep_occurred_sum[i, g])
+        self.num_logged_episodes += 1
+        if self.num_logged_episodes >= self.log_flush_episodes:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Write the episodes logged since the last flush
+        """
+        if self.episode_log_paths is None or self.num_logged_episodes == 0:
+            return
+        for path, episode_log in zip(self.episode_log_paths, self.episode_logs):
+            pd.DataFrame(episode_log).to_csv(path, mode='a', index=False, header=not os.path.exists(path))
+        self.episode_logs = [self._empty_episode_log() for _ in range(self.num_envs)]
+        self.num_logged_episodes = 0
+
+    def reset(self) -> VecEnvObs:
+        self.worlds.reset()
+        self.observation_history[:] = 0
+        self.ep_seen_sum[:] = 0
+        self.ep_occurred_sum[:] = 0
+        self.ep_rewards[:] = 0
+        self.delta[:] = 0
+        self.timestep = 0
+        return self.observation_history.reshape(self.num_envs, -1).astype(np.float32)
+
+    def step_async(self, actions: np.ndarray) -> None:
+        self.actions = actions
+
+    def step_wait(self) -> Tuple[VecEnvObs, Union[np.ndarray, List[np.ndarray]], np.ndarray, List[Dict]]:
+        worlds = self.worlds
+        attention = allocate_attention(self.actions, worlds.n_attention_units)
+        worlds.step(attention)
+        seen, occurred = worlds.incidents_seen, worlds.incidents_occurred
+
+        self.ep_seen_sum += seen
+        self.ep_occurred_sum += occurred
+        self.timestep += 1
+        done = self.timestep >= self.ep_timesteps
+
+        # observation history: pop the oldest and append the current observation
+        deltas = self.ep_seen_sum / (self.ep_occurred_sum + 1)
+        current_obs = [seen, occurred, attention, deltas] if self.include_delta else [seen, occurred, attention]
+        self.observation_history[:, :-1] = self.observation_history[:, 1:]
+        self.observation_history[:, -1] = np.concatenate(current_obs, axis=1)
+        obs = self.observation_history.reshape(self.num_envs, -1).astype(np.float32)
+
+        # AttentionAllocationReward, with delta = max_k,k' |deltas_k - deltas_k'| (AttentionAllocationReward.calc_delta)
+        old_delta = self.delta
+        self.delta = np.ptp(deltas, axis=1) if self.num_groups > 1 else np.full(self.num_envs, -np.inf)
+        rewards = self.zeta_0 * seen.sum(axis=1) - self.zeta_1 * (occurred - seen).sum(axis=1) \
+            + self.zeta_2 * np.minimum(0, -self.delta + OMEGA)
+        delta_delta = self.delta - old_delta
+
+        M = self.num_groups
+        self.buf_rews[:, 0] = rewards
+        self.buf_rews[:, 1:1 + M] = seen
+        self.buf_rews[:, 1 + M:] = occurred
+        self.ep_rewards += rewards
+
+        infos = [{'delta': self.delta[i], 'delta_delta': delta_delta[i]} for i in range(self.num_envs)]
+        if done:
+            ep_time = time.time() - self.t_start
+            for i, info in enumerate(infos):
+                info['terminal_observation'] = obs[i]
+                info['episode'] = {'r': round(self.ep_rewards[i], 6), 'l': self.timestep, 't': round(ep_time, 6)}
+            if self.episode_log_paths is not None:
+                self._log_episodes(ep_time)
+            obs = self.reset()
+
+        rews = self.buf_rews if self.packed_rewards else self.buf_rews_list
+        return obs, rews, np.full(self.num_envs, done), infos
+
+    def close(self) -> None:
+        self.flush()
+
+    def seed(self, seed: Optional[int] = None) -> List[Union[None, int]]:
+        self.worlds.seed(seed)
+        return [seed] * self.num_envs
+
+    def _indices_len(self, indices: VecEnvIndices) -> int:
+        return len(self._get_indices(indices))
+
+    def get_attr(self, attr_name: str, indices: VecEnvIndices = None) -> List[Any]:
+        # the attributes are shared by all the envs (e.g. 'ep_timesteps')
+        return [getattr(self, attr_name)] * self._indices_len(indices)
+
+    def set_attr(self, attr_name: str, value: Any, indices: VecEnvIndices = None) -> None:
+        setattr(self, attr_name, value)
+
+    def env_method(self, method_name: str, *method_args, indices: VecEnvIndices = None, **method_kwargs) -> List[Any]:
+        return [getattr(self, method_name)(*method_args, **method_kwargs)] * self._indices_len(indices)
+
+    def env_is_wrapped(self, wrapper_class: type, indices: VecEnvIndices = None) -> List[bool]:
+        return [False] * self._indices_len(indices)
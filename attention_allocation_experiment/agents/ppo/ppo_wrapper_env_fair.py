@@ -1,6 +1,5 @@
 import gym
 import numpy as np
-import torch
 from gym import spaces
 
 # the following should be in the env_param_dict
@@ -8,6 +7,32 @@ from gym import spaces
 
 OBS_HIST_LEN = 8 # Number of timesteps remembered in observation history
 
+def allocate_attention(logits, n_attention_units):
+  """
+  Softmax of the logits, then the greedy allocation of PPOEnvWrapper_fair.process_action
+  (each unit goes to the location with the largest probability left, minus 1 / n_attention_units per unit given),
+  computed as a largest-remainder allocation: each location gets floor(n_attention_units * prob) units, and the units
+  left go to the locations with the largest remainders, lower index first on ties.
+
+  Both give the same allocations, except when two remainders are exactly equal with different probabilities, where
+  the choice of the greedy loop depends on the float rounding of its decrements.
+
+  Args:
+    logits: (..., n_locations) array of logits, e.g. (n_envs, n_locations) for a batch of envs
+
+  Returns: (..., n_locations) integer array of allocations
+  """
+  logits = np.asarray(logits, dtype=np.float64)
+  probs = np.exp(logits - logits.max(axis=-1, keepdims=True))
+  probs /= probs.sum(axis=-1, keepdims=True)
+  quotas = probs * n_attention_units
+  allocs = np.floor(quotas).astype(np.int64)
+  n_left = n_attention_units - allocs.sum(axis=-1, keepdims=True)
+  # rank of each location by decreasing remainder (stable sort: lower index first on ties)
+  order = np.argsort(allocs - quotas, axis=-1, kind='stable')
+  ranks = np.argsort(order, axis=-1, kind='stable')
+  return allocs + (ranks < n_left)
+
 class PPOEnvWrapper_fair(gym.Wrapper):
   '''
   Observation space: Observation history (of length OBS_HIST_LEN) of incidents seen, occurred, attention allocated per site
@@ -121,6 +146,9 @@ class PPOEnvWrapper_fair(gym.Wrapper):
     old_delta = self.delta
     self.delta = self.reward_fn.calc_delta(self.ep_incidents_seen, self.ep_incidents_occurred)
     self.delta_delta = self.delta - old_delta
+    # report them in the step result, so that vectorized envs do not need get_attr('delta')
+    info['delta'] = self.delta
+    info['delta_delta'] = self.delta_delta
     
     # Fairness signals r_U and r_B (type: numpy.ndarray of shape = (num_groups,))
     r_U = self.env.state.incidents_seen
@@ -139,15 +167,4 @@ class PPOEnvWrapper_fair(gym.Wrapper):
 
     Returns: n_locations vector of allocations
     """
-    action = torch.tensor(action)
-    probs = torch.nn.functional.softmax(action, dim=-1)
-    allocs = [0 for _ in range(self.env.state.params.n_locations)]
-    n_left = self.env.state.params.n_attention_units
-    while n_left > 0:
-      ind = np.argmax(probs)
-      allocs[ind] += 1
-      n_left -= 1
-      probs[ind] -= 1 / self.env.state.params.n_attention_units
-
-    action = np.array(allocs)
-    return action
+    return allocate_attention(action, self.env.state.params.n_attention_units)
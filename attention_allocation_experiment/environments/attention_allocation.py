@@ -137,36 +137,126 @@ def _sample_incidents(rng, params):
     return incidents_occurred.flatten(), reported_incidents.flatten()
 
 
-def _get_location_features(params, rng, incidents_occurred):
-    """Returns a matrix of float features for each location.
+class LocationFeatureSampler(object):
+    """Draws the location features of each step.
 
-    Calculates new feature means based on incidents occurred and draws features
-    from a multivariate gaussian distribution using the parameter defined means
-    and covariances.
+    The features of each location are gaussian, with means
+    params.feature_means shifted by params.feature_coefficients times the
+    incidents that occurred there, and covariances params.feature_covariances.
+    The factorization of the covariances is computed once, and the gaussian
+    noise is drawn `block_size` steps at a time instead of at every step.
 
-    Args:
-      params: A Params instance for this environment.
-      rng: A numpy RandomState() object acting as a random number generator.
-      incidents_occurred: A list of integers of number of incidents for each
-        location that occurred.
-
-    Returns:
-      A numpy array of n_locations by number of features.
+    A block drawn from one rng should not be used after the rng is replaced
+    (e.g. by env.seed): call clear() to drop it.
     """
-    # Move feature means based on incidents that occurred to make m by k matrix
-    # where each row is the means for the features for location k at this step.
-    shifted_feature_means = params.feature_means + np.outer(
-        incidents_occurred, params.feature_coefficients)
 
-    feature_noise = rng.multivariate_normal(
-        np.zeros_like(params.feature_means),
-        params.feature_covariances,
-        size=params.n_locations)
+    def __init__(self, params, block_size=256):
+        self.feature_means = np.asarray(params.feature_means, dtype=np.float64)
+        self.feature_coefficients = np.asarray(params.feature_coefficients,
+                                               dtype=np.float64)
+        self.n_locations = params.n_locations
+        self.block_size = block_size
+        # noise = standard_normal @ factor has covariance factor.T @ factor.
+        covariances = np.asarray(params.feature_covariances, dtype=np.float64)
+        try:
+            self.factor = np.linalg.cholesky(covariances).T
+        except np.linalg.LinAlgError:
+            # Singular (positive semi-definite) covariances, handled like
+            # rng.multivariate_normal does.
+            _, s, vh = np.linalg.svd(covariances)
+            self.factor = np.sqrt(s)[:, None] * vh
+        self.clear()
+
+    def clear(self):
+        """Drops the noise left in the current block."""
+        self._noise_block = None
+        self._block_ind = 0
+
+    def get_state(self):
+        """Returns the current block and position (the block is never mutated)."""
+        return self._noise_block, self._block_ind
+
+    def set_state(self, state):
+        """Restores a state returned by get_state."""
+        self._noise_block, self._block_ind = state
+
+    def sample(self, rng, incidents_occurred):
+        """Returns a numpy array of n_locations by number of features.
 
-    return shifted_feature_means + feature_noise
+        Args:
+          rng: A numpy RandomState() object acting as a random number generator.
+          incidents_occurred: A list of integers of number of incidents for each
+            location that occurred.
+        """
+        if self._noise_block is None or self._block_ind >= self.block_size:
+            standard_noise = rng.standard_normal(
+                (self.block_size, self.n_locations, len(self.feature_means)))
+            self._noise_block = standard_noise @ self.factor
+            self._block_ind = 0
+        feature_noise = self._noise_block[self._block_ind]
+        self._block_ind += 1
+
+        shifted_feature_means = self.feature_means + np.outer(
+            incidents_occurred, self.feature_coefficients)
+        return shifted_feature_means + feature_noise
+
+
+def _discover_incidents(rng, incidents_occurred, action, miss_incident_prob,
+                        extra_incident_prob):
+    """Simulates attention discovering incidents, without attention replacement.
+
+    Each incident is discovered with probability 1 - miss_incident_prob **
+    (unused attention), a discovery uses up one unit, and after each incident
+    every unit left reports a false incident with probability
+    extra_incident_prob. The draws are made for all the locations (and any
+    leading batch dimensions) at once, with the same distribution as the
+    per-incident loop of tests/test_discover_incidents.py:
+    - the uniforms deciding whether each incident is discovered (with
+      probability 1 - miss_incident_prob ** unused attention) are drawn in one
+      call, and the loop runs over the incident index instead of the locations.
+    - the false incidents, one Bernoulli(extra_incident_prob) per unit left
+      after each incident, are summed into a single binomial draw per location
+      whose number of trials is the total of the units left.
 
+    Args:
+      rng: A numpy RandomState() object acting as a random number generator.
+      incidents_occurred: (..., n_locations) integer counts of incidents.
+      action: (..., n_locations) integer counts of attention allocated.
+      miss_incident_prob: (n_locations,) probabilities of missing an incident.
+      extra_incident_prob: (n_locations,) probabilities of a false incident.
 
-def _update_state(state, incidents_occurred, incidents_reported, action):
+    Returns:
+      (..., n_locations) integer counts of incidents seen.
+    """
+    incidents_occurred = np.asarray(incidents_occurred, dtype=np.int64)
+    shape = incidents_occurred.shape
+    unused_attention = np.array(np.broadcast_to(action, shape), dtype=np.int64)
+    miss_incident_prob = np.broadcast_to(
+        np.asarray(miss_incident_prob, dtype=np.float64), shape)
+    extra_incident_prob = np.broadcast_to(
+        np.asarray(extra_incident_prob, dtype=np.float64), shape)
+
+    n_incidents = int(np.max(incidents_occurred, initial=0))
+    uniforms = rng.random_sample((n_incidents,) + shape)
+    incidents_discovered = np.zeros(shape, dtype=np.int64)
+    # Number of (unit, incident) pairs that can generate a false incident.
+    extra_trials = np.zeros(shape, dtype=np.int64)
+    for incident_ind in range(n_incidents):
+        active = (incident_ind < incidents_occurred) & (unused_attention > 0)
+        if not active.any():
+            # Terminate early because there are no attention or incidents left.
+            break
+        discovered = active & (
+            uniforms[incident_ind] < 1 - np.power(miss_incident_prob,
+                                                  unused_attention))
+        unused_attention -= discovered
+        incidents_discovered += discovered
+        extra_trials += np.where(active, unused_attention, 0)
+    return incidents_discovered + rng.binomial(extra_trials, extra_incident_prob)
+
+
+def _update_state(state, incidents_occurred, incidents_reported, action,
+                  feature_sampler=None):
     """Updates the state given the human_designed_policies' action.
 
     This function simulates attention discovering incidents in order to determine
@@ -181,6 +271,8 @@ def _update_state(state, incidents_occurred, incidents_reported, action):
         location.
       action: an action in the action space of LocationAllocationEnv that is a
         vector of integer counts of attention allocated to each location.
+      feature_sampler: a LocationFeatureSampler drawing the location features, or
+        None to leave state.location_features unchanged.
     """
     params = state.params
     if params.attention_replacement:
@@ -192,23 +284,9 @@ def _update_state(state, incidents_occurred, incidents_reported, action):
     else:
         # Attention units are without replacement, so each units can only catch 1
         # crime.
-        incidents_seen = [0] * params.n_locations
-        for location_ind in range(params.n_locations):
-            unused_attention = action[location_ind]
-            # Iterate over crime incidents and determine if each one is "caught".
-            for _ in range(incidents_occurred[location_ind]):
-                incidents_discovered = state.rng.binomial(
-                    1, 1 - (np.power(params.miss_incident_prob[location_ind],
-                                     unused_attention)))
-                unused_attention -= incidents_discovered
-                incidents_seen[location_ind] += incidents_discovered
-                if unused_attention <= 0:
-                    # Terminate for loop early because there are no attention left.
-                    break
-                # If there are unused individuals have them generate false incidents.
-                for _ in range(unused_attention):
-                    incidents_seen[location_ind] += state.rng.binomial(
-                        1, params.extra_incident_prob[location_ind])
+        incidents_seen = _discover_incidents(state.rng, incidents_occurred, action,
+                                             params.miss_incident_prob,
+                                             params.extra_incident_prob)
 
     # Handle dynamics.
     for location_ind in range(params.n_locations):
@@ -220,14 +298,71 @@ def _update_state(state, incidents_occurred, incidents_reported, action):
                 0.0, params.incident_rates[location_ind] -
                      (params.dynamic_rate * attention))
 
-    state.location_features = _get_location_features(params, state.rng,
-                                                     incidents_occurred).astype(np.float32)
+    if feature_sampler is not None:
+        state.location_features = feature_sampler.sample(
+            state.rng, incidents_occurred).astype(np.float32)
     state.incidents_occurred = np.asarray(incidents_occurred)
     state.incidents_seen = np.asarray(incidents_seen)
     state.incidents_reported = np.asarray(incidents_reported)
 
 
-class LocationAllocationEnv(core.FairnessEnv):
+class LocationFeaturesMixin(object):
+    """Location features of LocationAllocationEnv and GeneralLocationAllocationEnv.
+
+    Holds the LocationFeatureSampler of the env, which _state_init creates with
+    _init_feature_sampler, and keeps its buffered noise in step with the rng of
+    the env on seed, snapshot and restore. Must come before core.FairnessEnv in
+    the bases of the env.
+    """
+
+    # Whether steps draw state.location_features. Agents that do not read them
+    # (e.g. PPOEnvWrapper_fair) can turn them off with set_location_features,
+    # then the features stay at zero.
+    location_features_enabled = True  # type: bool
+    # Number of steps of feature noise drawn at once (see LocationFeatureSampler).
+    feature_block_size = 256  # type: int
+    _feature_sampler = None  # type: Optional[LocationFeatureSampler]
+
+    def set_location_features(self, enabled, block_size = None):
+        """Sets whether steps draw the location features.
+
+        Args:
+          enabled: if False, state.location_features stay at zero.
+          block_size: number of steps of feature noise drawn at once.
+        """
+        self.location_features_enabled = enabled
+        if block_size is not None:
+            self.feature_block_size = block_size
+        self._init_feature_sampler()
+
+    def _init_feature_sampler(self):
+        self._feature_sampler = None
+        if self.location_features_enabled:
+            self._feature_sampler = LocationFeatureSampler(
+                self.initial_params, self.feature_block_size)
+
+    def seed(self, seed = None):
+        """See core.FairnessEnv.seed."""
+        if self._feature_sampler is not None:
+            self._feature_sampler.clear()
+        return super(LocationFeaturesMixin, self).seed(seed)
+
+    def snapshot(self):
+        """See core.FairnessEnv.snapshot."""
+        snapshot = super(LocationFeaturesMixin, self).snapshot()
+        if self._feature_sampler is not None:
+            snapshot.extra['feature_sampler'] = self._feature_sampler.get_state()
+        return snapshot
+
+    def restore(self, snapshot):
+        """See core.FairnessEnv.restore."""
+        super(LocationFeaturesMixin, self).restore(snapshot)
+        if self._feature_sampler is not None:
+            self._feature_sampler.set_state(
+                snapshot.extra.get('feature_sampler', (None, 0)))
+
+
+class LocationAllocationEnv(LocationFeaturesMixin, core.FairnessEnv):
     """Location based allocation environment.
 
     In each step, agent allocates attention across locations. Environment then
@@ -281,6 +416,7 @@ class LocationAllocationEnv(core.FairnessEnv):
         self._state_init()
 
     def _state_init(self, rng=None):
+        self._init_feature_sampler()
         n_locations = self.initial_params.n_locations
         self.state = State(
             rng=rng or np.random.RandomState(),
@@ -316,5 +452,6 @@ class LocationAllocationEnv(core.FairnessEnv):
         """
         incidents_occurred, reported_incidents = _sample_incidents(
             state.rng, state.params)
-        _update_state(state, incidents_occurred, reported_incidents, action)
+        _update_state(state, incidents_occurred, reported_incidents, action,
+                      self._feature_sampler)
         return state
@@ -0,0 +1,109 @@
+"""Batched attention allocation simulator.
+
+Holds N independent worlds of LocationAllocationEnv (or of the harder
+GeneralLocationAllocationEnv) as (N, n_locations) arrays and steps them all in
+one vectorized call. Used by agents/ppo/batched_vec_env_fair.py to run many
+training environments in one process.
+"""
+
+import numpy as np
+
+from attention_allocation_experiment.environments.attention_allocation import _discover_incidents
+
+
+class BatchedLocationAllocation(object):
+    """N independent attention allocation worlds stepped together.
+
+    The worlds follow the dynamics of the environment `env` they are built from
+    (LocationAllocationEnv, or GeneralLocationAllocationEnv if its params have
+    alpha and theta), with their own incident rates. Location features are not
+    simulated: the PPO observations do not use them.
+
+    All the random draws come from self.rng, including the theta draws of the
+    harder env (which uses the global numpy RNG).
+
+    Attributes:
+      incident_rates: (N, n_locations) float array.
+      incidents_seen, incidents_occurred, incidents_reported: (N, n_locations)
+        integer arrays of the last step.
+    """
+
+    def __init__(self, env, num_worlds, seed=None):
+        params = env.initial_params
+        self.num_worlds = num_worlds
+        self.n_locations = params.n_locations
+        self.n_attention_units = params.n_attention_units
+        self.general = hasattr(params, 'alpha')
+
+        self.initial_incident_rates = np.asarray(params.incident_rates, dtype=np.float64)
+        self.discovered_incident_weight = params.discovered_incident_weight
+        self.reported_incident_weight = params.reported_incident_weight
+        self.attention_replacement = params.attention_replacement
+        self.miss_incident_prob = np.asarray(params.miss_incident_prob, dtype=np.float64)
+        self.extra_incident_prob = np.asarray(params.extra_incident_prob, dtype=np.float64)
+        if self.general:
+            self.dynamic_rate = np.asarray(params.dynamic_rate, dtype=np.float64)  # (2, n_locations)
+            self.alpha = params.alpha
+            self.theta = params.theta
+        else:
+            self.dynamic_rate = params.dynamic_rate
+
+        self.rng = np.random.RandomState(seed)
+        shape = (num_worlds, self.n_locations)
+        self.incident_rates = np.zeros(shape)
+        self.incidents_seen = np.zeros(shape, dtype=np.int64)
+        self.incidents_occurred = np.zeros(shape, dtype=np.int64)
+        self.incidents_reported = np.zeros(shape, dtype=np.int64)
+        self.reset()
+
+    def seed(self, seed=None):
+        self.rng = np.random.RandomState(seed)
+
+    def reset(self, world_indices=None):
+        """Resets the given worlds (all of them if None)."""
+        if world_indices is None:
+            world_indices = slice(None)
+        self.incident_rates[world_indices] = self.initial_incident_rates
+        self.incidents_seen[world_indices] = 0
+        self.incidents_occurred[world_indices] = 0
+        self.incidents_reported[world_indices] = 0
+
+    def step(self, attention):
+        """Runs one timestep of every world.
+
+        Args:
+          attention: (N, n_locations) integer counts of attention allocated, one
+            row per world.
+        """
+        attention = np.asarray(attention)
+
+        incidents_occurred = self.rng.poisson(self.incident_rates * self.discovered_incident_weight)
+        incidents_reported = self.rng.poisson(self.incident_rates * self.reported_incident_weight)
+
+        if self.attention_replacement:
+            discover_probability = 1 - np.power(self.miss_incident_prob, attention)
+            incidents_seen = self.rng.binomial(incidents_occurred, discover_probability)
+        else:
+            incidents_seen = _discover_incidents(
+                self.rng, incidents_occurred, attention, self.miss_incident_prob,
+                self.extra_incident_prob)
+
+        # Handle dynamics.
+        no_attention = attention == 0
+        if self.general:
+            decay = np.exp(-self.alpha * self.incident_rates)
+            revive = no_attention & (self.incident_rates <= 0.00001)
+            self.incident_rates += revive * self.rng.binomial(1, self.theta, size=revive.shape)
+            self.incident_rates = np.where(
+                no_attention,
+                self.incident_rates + self.dynamic_rate[0] * decay,
+                np.maximum(0.0, self.incident_rates - self.dynamic_rate[1] * attention * decay))
+        else:
+            self.incident_rates = np.where(
+                no_attention,
+                self.incident_rates + self.dynamic_rate,
+                np.maximum(0.0, self.incident_rates - self.dynamic_rate * attention))
+
+        self.incidents_occurred = incidents_occurred
+        self.incidents_seen = incidents_seen
+        self.incidents_reported = incidents_reported
@@ -6,6 +6,7 @@ New Attention Allocation Env with the following modification from APPO's code
 '''
 
 from attention_allocation_experiment.environments.attention_allocation import *
+from attention_allocation_experiment.environments.attention_allocation import _discover_incidents, LocationFeaturesMixin
 
 ############################ new env Parameters ############################
 N_LOCATIONS_1 = 5
@@ -95,36 +96,8 @@ def _sample_incidents(rng, params):
     return incidents_occurred.flatten(), reported_incidents.flatten()
 
 
-def _get_location_features(params, rng, incidents_occurred):
-    """Returns a matrix of float features for each location.
-
-    Calculates new feature means based on incidents occurred and draws features
-    from a multivariate gaussian distribution using the parameter defined means
-    and covariances.
-
-    Args:
-      params: A Params instance for this environment.
-      rng: A numpy RandomState() object acting as a random number generator.
-      incidents_occurred: A list of integers of number of incidents for each
-        location that occurred.
-
-    Returns:
-      A numpy array of n_locations by number of features.
-    """
-    # Move feature means based on incidents that occurred to make m by k matrix
-    # where each row is the means for the features for location k at this step.
-    shifted_feature_means = params.feature_means + np.outer(
-        incidents_occurred, params.feature_coefficients)
-
-    feature_noise = rng.multivariate_normal(
-        np.zeros_like(params.feature_means),
-        params.feature_covariances,
-        size=params.n_locations)
-
-    return shifted_feature_means + feature_noise
-
-
-def _general_update_state(state, incidents_occurred, incidents_reported, action, alpha=0.0, theta=0.0):
+def _general_update_state(state, incidents_occurred, incidents_reported, action, alpha=0.0, theta=0.0,
+                          feature_sampler=None):
     """Updates the state given the human_designed_policies' action.
 
     This function simulates attention discovering incidents in order to determine
@@ -139,6 +112,8 @@ def _general_update_state(state, incidents_occurred, incidents_reported, action,
         location.
       action: an action in the action space of LocationAllocationEnv that is a
         vector of integer counts of attention allocated to each location.
+      feature_sampler: a LocationFeatureSampler drawing the location features, or
+        None to leave state.location_features unchanged.
     """
     params = state.params
     if params.attention_replacement:
@@ -150,23 +125,9 @@ def _general_update_state(state, incidents_occurred, incidents_reported, action,
     else:
         # Attention units are without replacement, so each units can only catch 1
         # crime.
-        incidents_seen = [0] * params.n_locations
-        for location_ind in range(params.n_locations):
-            unused_attention = action[location_ind]
-            # Iterate over crime incidents and determine if each one is "caught".
-            for _ in range(incidents_occurred[location_ind]):
-                incidents_discovered = state.rng.binomial(
-                    1, 1 - (np.power(params.miss_incident_prob[location_ind],
-                                     unused_attention)))
-                unused_attention -= incidents_discovered
-                incidents_seen[location_ind] += incidents_discovered
-                if unused_attention <= 0:
-                    # Terminate for loop early because there are no attention left.
-                    break
-                # If there are unused individuals have them generate false incidents.
-                for _ in range(unused_attention):
-                    incidents_seen[location_ind] += state.rng.binomial(
-                        1, params.extra_incident_prob[location_ind])
+        incidents_seen = _discover_incidents(state.rng, incidents_occurred, action,
+                                             params.miss_incident_prob,
+                                             params.extra_incident_prob)
 
     # Handle dynamics.
     for location_ind in range(params.n_locations):
@@ -174,21 +135,22 @@ def _general_update_state(state, incidents_occurred, incidents_reported, action,
         attention = action[location_ind]
         if attention == 0:
             if params.incident_rates[location_ind] <= 0.00001:
-                params.incident_rates[location_ind] += 1*np.random.binomial(1, theta)
+                params.incident_rates[location_ind] += 1*state.rng.binomial(1, theta)
             params.incident_rates[location_ind] += params.dynamic_rate[0][location_ind] * np.exp(factor)
         else:
             params.incident_rates[location_ind] = max(
                 0.0, params.incident_rates[location_ind] -
                      (params.dynamic_rate[1][location_ind] * attention * np.exp(factor)))
 
-    state.location_features = _get_location_features(params, state.rng,
-                                                     incidents_occurred).astype(np.float32)
+    if feature_sampler is not None:
+        state.location_features = feature_sampler.sample(
+            state.rng, incidents_occurred).astype(np.float32)
     state.incidents_occurred = np.asarray(incidents_occurred)
     state.incidents_seen = np.asarray(incidents_seen)
     state.incidents_reported = np.asarray(incidents_reported)
 
 
-class GeneralLocationAllocationEnv(core.FairnessEnv):
+class GeneralLocationAllocationEnv(LocationFeaturesMixin, core.FairnessEnv):
     """Location based allocation environment.
 
     In each step, agent allocates attention across locations. Environment then
@@ -248,6 +210,7 @@ class GeneralLocationAllocationEnv(core.FairnessEnv):
         self._state_init()
 
     def _state_init(self, rng=None):
+        self._init_feature_sampler()
         n_locations = self.initial_params.n_locations
         self.state = State(
             rng=rng or np.random.RandomState(),
@@ -283,7 +246,8 @@ class GeneralLocationAllocationEnv(core.FairnessEnv):
         """
         incidents_occurred, reported_incidents = _sample_incidents(
             state.rng, state.params)
-        _general_update_state(state, incidents_occurred, reported_incidents, action, self.alpha, self.theta)
+        _general_update_state(state, incidents_occurred, reported_incidents, action, self.alpha, self.theta,
+                              self._feature_sampler)
         return state
 ############################ new env Ends ############################
 
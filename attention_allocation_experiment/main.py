@@ -23,6 +23,7 @@ from attention_allocation_experiment.config import  EXP_DIR, POLICY_KWARGS_fair,
 from attention_allocation_experiment.environments.attention_allocation import LocationAllocationEnv, Params
 from attention_allocation_experiment.environments.rewards import AttentionAllocationReward
 from attention_allocation_experiment.agents.ppo.ppo_wrapper_env_fair import PPOEnvWrapper_fair
+from attention_allocation_experiment.agents.ppo.batched_vec_env_fair import BatchedVecEnv_fair
 # plot evaluation
 from attention_allocation_experiment.plot import plot_return_bias
 # harder env
@@ -31,7 +32,7 @@ from attention_allocation_experiment.harder_env import create_GeneralLocationAll
 ### general to all environment (sb3)
 from sb3_ppo_fair.ppo_fair import PPO_fair
 from sb3_ppo_fair.policies_fair import ActorCriticPolicy_fair
-from sb3_ppo_fair.utils_fair import DummyVecEnv_fair, Monitor_fair
+from sb3_ppo_fair.utils_fair import DummyVecEnv_fair, SubprocVecEnv_fair, Monitor_fair
 
 
 
@@ -55,9 +56,27 @@ def parser_train():
     parser.add_argument('--lr', type=float, default=1e-5) 
     parser.add_argument('--train_timesteps', type=int, default=5e6) 
     parser.add_argument('--buffer_size_training', type=int, default=4096)  # only for training; for evaluation, the buffer_size = env.ep_timesteps, the number of steps in one episode
+    parser.add_argument('--rollout_buffer', type=str, default='list', choices=['list','packed','device']) # storage layout of the rollout buffer ('packed': one (n_steps, n_envs, 1+2M) array per quantity, 'device': packed torch tensors on the policy device)
+    parser.add_argument('--fused_critic', action='store_true') # evaluate the 2M+1 value networks with one batched matmul per layer
+    parser.add_argument('--vec_env', type=str, default='dummy', choices=['dummy','subproc','batched']) # 'subproc': step the training env(s) in worker processes (SubprocVecEnv_fair); 'batched': step all of them as arrays (BatchedVecEnv_fair)
+    parser.add_argument('--n_envs', type=int, default=1) # number of training envs stepped in parallel; each rollout takes buffer_size_training // n_envs steps per env
+    parser.add_argument('--episode_log', action='store_true') # write the return, length and per-group supply/demand totals of every training episode to episodes_<env rank>.csv
+    parser.add_argument('--async_rollouts', action='store_true') # collect the next rollout in the background while training (best with --vec_env subproc)
+    parser.add_argument('--max_policy_lag', type=int, default=1) # with --async_rollouts: max number of policy updates between collecting a rollout and training on it
+    parser.add_argument('--eval_async', action='store_true') # run the periodic evaluations in a background process (rows are still appended to eval.csv in order)
+    parser.add_argument('--eval_batched', action='store_true') # play the evaluation episodes in lockstep, with one policy forward per timestep
+    parser.add_argument('--eval_streaming', action='store_true') # evaluation keeps running sums instead of the rewards of every step
+    parser.add_argument('--eval_episode_totals', action='store_true') # with --eval_streaming: also write standard errors across evaluation episodes
+    parser.add_argument('--eval_columnar', action='store_true') # buffer the evaluation results and write them as npz chunks (eval.csv is exported at the end)
+    parser.add_argument('--eval_flush_every', type=int, default=10) # with --eval_columnar: number of evaluations per chunk
     parser.add_argument('--exp_index', type=int, default=0)
     # base env param
     parser.add_argument('--harderEnv', action='store_true') # If True, use harder env
+    parser.add_argument('--history', type=str, default='off', choices=['off','ring','deltas','full']) # what the env records in env.history (only read by Metric and render)
+    parser.add_argument('--history_len', type=int, default=None) # with --history ring: number of steps kept
+    parser.add_argument('--validate', type=str, default='first', choices=['always','first','every','never']) # when the env checks actions/observations against their spaces
+    parser.add_argument('--validate_steps', type=int, default=1000) # with --validate first: number of checked steps; with --validate every: period
+    parser.add_argument('--location_features', action='store_true') # If True, the env draws state.location_features (not read by the PPO agents)
     parser.add_argument('--n_locations', type=int, default=5)
     parser.add_argument('--incident_rates','--list', nargs='+', default=[8, 6, 4, 3, 1.5]) # python main.py --incident_rates 8 6 4 3 1.5
     parser.add_argument('--dynamic_rate', type=float, default=0.1) 
@@ -120,12 +139,17 @@ def organize_param(args):
                       'ep_timesteps':EP_TIMESTEPS_EVAL}
     
     # training param
-    training_params = {'lr': args.lr, 'train_timesteps':args.train_timesteps, 'buffer_size_training':args.buffer_size_training}
+    training_params = {'lr': args.lr, 'train_timesteps':args.train_timesteps, 'buffer_size_training':args.buffer_size_training,\
+                       'rollout_buffer':args.rollout_buffer, 'fused_critic':args.fused_critic,\
+                       'vec_env':args.vec_env, 'n_envs':args.n_envs, 'episode_log':args.episode_log,\
+                       'async_rollouts':args.async_rollouts, 'max_policy_lag':args.max_policy_lag}
 
     # evaluation param
     exp_dir  = get_dir(args)
     eval_kwargs = {'eval_write_path': exp_dir, \
-                   'eval_interval':EVAL_INTERVAL, 'num_eps_eval':EVAL_NUM_EPS}
+                   'eval_interval':EVAL_INTERVAL, 'num_eps_eval':EVAL_NUM_EPS, 'eval_async':args.eval_async,\
+                   'eval_batched':args.eval_batched, 'eval_streaming':args.eval_streaming, 'eval_episode_totals':args.eval_episode_totals,
+                   'eval_columnar':args.eval_columnar, 'eval_flush_every':args.eval_flush_every}
     
     if args.harderEnv:
         env_param_base_save = {'harderEnv':True}
@@ -178,18 +202,44 @@ def get_dir(args):
 
 def train(env, mitigation_params, baselines_params, env_param_dict_train, env_param_dict_eval, training_params, eval_kwargs):
 
-    env_train = PPOEnvWrapper_fair(env=copy.deepcopy(env), reward_fn=AttentionAllocationReward, env_param_dict = env_param_dict_train)
-    env_train = Monitor_fair(env_train)
-    env_train = DummyVecEnv_fair([lambda: env_train]) 
-
+    def make_env_train(rank):
+        env_rank = copy.deepcopy(env)
+        if rank > 0:
+            env_rank.seed() # deepcopy also copies the random state, so the other envs need their own
+        env_rank = PPOEnvWrapper_fair(env=env_rank, reward_fn=AttentionAllocationReward, env_param_dict = env_param_dict_train)
+        episode_log_path = os.path.join(eval_kwargs['eval_write_path'], 'episodes_{}.csv'.format(rank)) if training_params['episode_log'] else None
+        return Monitor_fair(env_rank, episode_log_path=episode_log_path)
+
+    n_envs = training_params['n_envs']
+    assert training_params['buffer_size_training'] % n_envs == 0, 'buffer_size_training must be a multiple of n_envs'
+    # collect_rollouts() resets the envs at the start of every rollout: a rollout shorter than a whole number of
+    # episodes would cut the last one and count it as a complete episode in the fairness estimates
+    assert (training_params['buffer_size_training'] // n_envs) % env_param_dict_train['ep_timesteps'] == 0, \
+        'buffer_size_training // n_envs ({}) must be a multiple of the episode length ({})'.format(
+            training_params['buffer_size_training'] // n_envs, env_param_dict_train['ep_timesteps'])
     env_eval = PPOEnvWrapper_fair(env=copy.deepcopy(env), reward_fn=AttentionAllocationReward, env_param_dict = env_param_dict_eval)
     eval_kwargs['env_eval'] = env_eval
+
+    if training_params['vec_env'] == 'batched':
+        # no Monitor_fair: the episode infos and logs come from BatchedVecEnv_fair
+        episode_log_paths = [os.path.join(eval_kwargs['eval_write_path'], 'episodes_{}.csv'.format(rank)) for rank in range(n_envs)] \
+            if training_params['episode_log'] else None
+        env_train = BatchedVecEnv_fair(env, n_envs, env_param_dict_train, packed_rewards=True, episode_log_paths=episode_log_paths)
+    elif training_params['vec_env'] == 'subproc':
+        # the training envs have the groups of env_eval: the parent process does not build one to count them
+        env_train = SubprocVecEnv_fair([lambda rank=rank: make_env_train(rank) for rank in range(n_envs)], env_eval.num_groups,
+                                       packed_rewards=True)
+    else:
+        env_train = DummyVecEnv_fair([lambda rank=rank: make_env_train(rank) for rank in range(n_envs)], packed_rewards=True)
    
     model = PPO_fair(ActorCriticPolicy_fair, env_train,
-                policy_kwargs=POLICY_KWARGS_fair,
+                policy_kwargs=dict(POLICY_KWARGS_fair, fused_critic=training_params['fused_critic']),
                 verbose=1,
                 learning_rate = training_params['lr'],
-                n_steps = training_params['buffer_size_training'], 
+                n_steps = training_params['buffer_size_training'] // n_envs, 
+                rollout_buffer_class = training_params['rollout_buffer'],
+                async_rollouts = training_params['async_rollouts'],
+                max_policy_lag = training_params['max_policy_lag'],
                 device=device,
 
                 mitigation_params = mitigation_params,
@@ -206,6 +256,7 @@ def train(env, mitigation_params, baselines_params, env_param_dict_train, env_pa
 
     model.learn(total_timesteps=training_params['train_timesteps'], callback=checkpoint_callback) # actual training
     model.save(save_dir + '/final_model')
+    env_train.close()
 
 
 def main():
@@ -229,6 +280,10 @@ def main():
         print('main.py: Using the harder env')
         env = create_GeneralLocationAllocationEnv()
 
+    env.set_history_mode(args.history, args.history_len)
+    env.set_validation_mode(args.validate, args.validate_steps)
+    env.set_location_features(args.location_features)
+
     train(env = env, mitigation_params = mitigation_params, baselines_params = baselines_params, env_param_dict_train = env_param_dict_train, \
           env_param_dict_eval = env_param_dict_eval, training_params = training_params, eval_kwargs = eval_kwargs)
 
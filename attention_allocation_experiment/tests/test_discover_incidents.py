@@ -0,0 +1,103 @@
+"""Statistical equivalence of attention_allocation._discover_incidents with the
+per-incident loop it replaced.
+
+Run from the repository root with `python -m pytest`.
+"""
+
+import numpy as np
+import pytest
+from scipy import stats
+
+from attention_allocation_experiment.environments.attention_allocation import _discover_incidents
+
+N_SAMPLES = 20000
+# p-values below this are a failure (the samples are drawn with fixed seeds, so the tests are deterministic)
+P_VALUE_THRESHOLD = 1e-3
+
+# (incidents_occurred, action, miss_incident_prob, extra_incident_prob)
+PARAMS = [
+    ([30, 25, 20, 15, 10], [6, 6, 6, 6, 6], [.2] * 5, [.05] * 5),
+    ([8, 6, 4, 3, 1], [2, 1, 3, 0, 0], [0.] * 5, [0.] * 5),
+    ([10, 3, 0, 7, 12], [5, 5, 5, 5, 10], [.5, .1, .3, .9, .0], [.2, .0, .1, .3, .05]),
+    ([20, 20], [30, 30], [.3, .6], [.1, .02]),
+]
+
+
+def _discover_incidents_sequential(rng, incidents_occurred, action,
+                                   miss_incident_prob, extra_incident_prob):
+    """Reference: the loop formerly in attention_allocation._update_state, with
+    one random draw per incident and per false incident."""
+    incidents_seen = [0] * len(incidents_occurred)
+    for location_ind in range(len(incidents_occurred)):
+        unused_attention = action[location_ind]
+        # Iterate over crime incidents and determine if each one is "caught".
+        for _ in range(incidents_occurred[location_ind]):
+            incidents_discovered = rng.binomial(
+                1, 1 - (np.power(miss_incident_prob[location_ind],
+                                 unused_attention)))
+            unused_attention -= incidents_discovered
+            incidents_seen[location_ind] += incidents_discovered
+            if unused_attention <= 0:
+                # Terminate for loop early because there are no attention left.
+                break
+            # If there are unused individuals have them generate false incidents.
+            for _ in range(unused_attention):
+                incidents_seen[location_ind] += rng.binomial(
+                    1, extra_incident_prob[location_ind])
+    return incidents_seen
+
+
+def _homogeneity_p_values(incidents_occurred, action, miss_incident_prob, extra_incident_prob,
+                          vectorized_extra_incident_prob=None, seed=0):
+    """
+    Draws N_SAMPLES incidents seen with each implementation and returns, for each location,
+    the p-value of a chi-square test of homogeneity of the two samples
+    """
+    if vectorized_extra_incident_prob is None:
+        vectorized_extra_incident_prob = extra_incident_prob
+    rng = np.random.RandomState(seed)
+    sequential = np.asarray([
+        _discover_incidents_sequential(rng, incidents_occurred, action,
+                                       miss_incident_prob, extra_incident_prob)
+        for _ in range(N_SAMPLES)
+    ])
+    vectorized = _discover_incidents(
+        rng, np.tile(incidents_occurred, (N_SAMPLES, 1)), action,
+        miss_incident_prob, vectorized_extra_incident_prob)
+
+    p_values = []
+    for location_ind in range(len(incidents_occurred)):
+        samples = [sequential[:, location_ind], vectorized[:, location_ind]]
+        # Pool the rare values in the tails so that all the expected counts are
+        # large enough for the chi-square approximation.
+        low, high = np.percentile(np.concatenate(samples), [0.1, 99.9])
+        samples = [np.clip(sample, low, high) for sample in samples]
+        values = np.unique(np.concatenate(samples))
+        if len(values) == 1:
+            p_values.append(1.)
+            continue
+        table = [[np.sum(sample == value) for value in values] for sample in samples]
+        p_values.append(stats.chi2_contingency(table)[1])
+    return np.asarray(p_values)
+
+
+@pytest.mark.parametrize('incidents_occurred, action, miss_incident_prob, extra_incident_prob', PARAMS)
+def test_same_distribution_as_sequential_loop(incidents_occurred, action, miss_incident_prob, extra_incident_prob):
+    p_values = _homogeneity_p_values(incidents_occurred, action, miss_incident_prob, extra_incident_prob)
+    assert (p_values > P_VALUE_THRESHOLD).all(), p_values
+
+
+def test_detects_perturbed_extra_incident_prob():
+    incidents_occurred, action, miss_incident_prob, extra_incident_prob = PARAMS[2]
+    p_values = _homogeneity_p_values(incidents_occurred, action, miss_incident_prob, extra_incident_prob,
+                                     vectorized_extra_incident_prob=np.asarray(extra_incident_prob) * 0.8)
+    assert p_values.min() < 1e-6, p_values
+
+
+def test_batch_dimensions():
+    rng = np.random.RandomState(0)
+    incidents_occurred = rng.poisson(10, size=(4, 3, 5))
+    incidents_seen = _discover_incidents(rng, incidents_occurred, [2, 0, 5, 1, 3], [.2] * 5, [0.] * 5)
+    assert incidents_seen.shape == (4, 3, 5)
+    # without false incidents, a location sees at most its incidents and its attention
+    assert (incidents_seen <= np.minimum(incidents_occurred, [2, 0, 5, 1, 3])).all()
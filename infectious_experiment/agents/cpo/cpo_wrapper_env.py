@@ -11,6 +11,10 @@ from infectious_experiment.config import EP_TIMESTEPS, ZETA_1, ZETA_0
 
 
 class CPOEnvWrapper(gym.Wrapper):
+    # Episode statistics of the wrapper, saved by snapshot() along with the env
+    SNAPSHOT_VARS = ('timestep', 'num_vaccines_per_community', 'prev_health_states', 'num_newly_infected_per_community',
+                     'delta', 'delta_delta')
+
     def __init__(self,
                  env,
                  reward_fn,
@@ -96,6 +100,18 @@ class CPOEnvWrapper(gym.Wrapper):
 
         return self.format_observation(self.env.reset())
 
+    def snapshot(self):
+        """
+        Mutable state of the wrapper and of the env (see core.FairnessEnv.snapshot), to be passed to restore()
+        """
+        return self.env.snapshot(), {name: copy.deepcopy(getattr(self, name)) for name in self.SNAPSHOT_VARS}
+
+    def restore(self, snapshot):
+        env_snapshot, wrapper_vars = snapshot
+        self.env.restore(env_snapshot)
+        for name, value in wrapper_vars.items():
+            setattr(self, name, copy.deepcopy(value))
+
     def step(self, action):
 
         self.prev_health_states = copy.deepcopy(self.env.state.health_states)
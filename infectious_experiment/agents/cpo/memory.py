@@ -3,7 +3,8 @@ import torch
 
 
 class Trajectory:
-    def __init__(self):
+    def __init__(self, start_timestep=0):
+        self.start_timestep = start_timestep # > 0 for the branches of VineSimulator
         self.observations = []
         self.actions = []
         self.rewards = []
@@ -15,8 +16,10 @@ class Trajectory:
 
 
 class Memory:
-    def __init__(self, trajectories):
+    def __init__(self, trajectories, branches=None):
         self.trajectories = trajectories
+        # VineSimulator: for every state branched from, the list of branches started from it
+        self.branches = branches if branches is not None else []
 
     def sample(self):
         observations = torch.cat([torch.stack(trajectory.observations) for trajectory in self.trajectories])
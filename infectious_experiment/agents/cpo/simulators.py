@@ -78,3 +78,106 @@ class SinglePathSimulator:
         memory = Memory(trajectories)
 
         return memory
+
+
+class VineSimulator:
+    """
+    Vine sampling (Schulman et al., 2015): n_trajectories trunk trajectories as in SinglePathSimulator, plus
+    n_branches rollouts from each of n_rollout_states states sampled along every trunk. The branches are started
+    from env.snapshot() / env.restore() (see core.FairnessEnv.snapshot) rather than from deep copies of the env,
+    and are run in batches of len(env_list) envs. The branches from a same state also share its env rng state,
+    so their returns only differ by the actions of the policy.
+
+    The memory holds the trunks as trajectories and the branches grouped by state in Memory.branches: CPO updates
+    the policy at the branched states only, with the return of each branch minus the mean return of its group as
+    the advantage of its first action (see cpo.compute_vine_advs).
+    """
+    def __init__(self, env_list, policy, n_trajectories, trajectory_len, state_filter=None,
+                 n_rollout_states=4, n_branches=4, **env_args):
+        Simulator.__init__(self, env_list, policy, n_trajectories, trajectory_len, state_filter,
+                           **env_args)
+        if n_branches < 2:
+            raise Exception('VineSimulator needs n_branches >= 2 to estimate advantages, got {}'.format(n_branches))
+        self.n_rollout_states = n_rollout_states
+        self.n_branches = n_branches
+
+    def run_sim(self):
+        self.policy.eval()
+
+        with torch.no_grad():
+            trunks = np.asarray([Trajectory() for i in range(self.n_trajectories)])
+            for env, trajectory in zip(self.env, trunks):
+                obs = torch.tensor(env.reset()).float()
+                if self.obs_filter:
+                    obs = self.obs_filter(obs)
+                trajectory.observations.append(obs)
+
+            snapshot_times = [set(np.random.choice(self.trajectory_len, size=self.n_rollout_states, replace=False))
+                              for _ in range(self.n_trajectories)]
+            rollout_states = self._run_trajectories(self.env, trunks, snapshot_times)
+
+            branches = []
+            rollout_states = [rollout_state for rollout_state in rollout_states for _ in range(self.n_branches)]
+            for batch_start in range(0, len(rollout_states), len(self.env)):
+                batch = rollout_states[batch_start:batch_start + len(self.env)]
+                envs = self.env[:len(batch)]
+                trajectories = np.asarray([Trajectory(start_timestep=timestep) for timestep, _, _ in batch])
+                for env, trajectory, (_, snapshot, obs) in zip(envs, trajectories, batch):
+                    env.restore(snapshot)
+                    trajectory.observations.append(obs)
+                self._run_trajectories(envs, trajectories)
+                branches.extend(trajectories)
+
+        # rollout_states repeats every state n_branches times in a row
+        memory = Memory(trunks, branches=[branches[i:i + self.n_branches]
+                                          for i in range(0, len(branches), self.n_branches)])
+
+        return memory
+
+    def _run_trajectories(self, envs, trajectories, snapshot_times=None):
+        """
+        Step envs with the policy until all the trajectories are done.
+        If snapshot_times is given, envs[i] is snapshotted before acting at each timestep of snapshot_times[i];
+        returns the list of (timestep, snapshot, observation) taken
+        """
+        rollout_states = []
+        continue_mask = np.ones(len(trajectories))
+
+        while np.any(continue_mask):
+            continue_indices = np.where(continue_mask)[0]
+            trajs_to_update = trajectories[continue_indices]
+            continuing_envs = envs[continue_indices]
+
+            if snapshot_times is not None:
+                for i, env, trajectory in zip(continue_indices, continuing_envs, trajs_to_update):
+                    timestep = trajectory.start_timestep + len(trajectory.actions)
+                    if timestep in snapshot_times[i]:
+                        rollout_states.append((timestep, env.snapshot(), trajectory.observations[-1]))
+
+            policy_input = torch.stack([torch.tensor(trajectory.observations[-1]).to(self.device)
+                                        for trajectory in trajs_to_update])
+
+            action_dists = self.policy(policy_input)
+            actions = action_dists.sample()
+            actions = actions.cpu()
+
+            for env, action, trajectory in zip(continuing_envs, actions, trajs_to_update):
+                obs, reward, trajectory.done, info = env.step(action.numpy())
+
+                obs = torch.tensor(obs).float()
+                reward = torch.tensor(reward, dtype=torch.float)
+                cost = torch.tensor(info['constraint_cost'], dtype=torch.float)
+
+                if self.obs_filter:
+                    obs = self.obs_filter(obs)
+
+                trajectory.actions.append(action)
+                trajectory.rewards.append(reward)
+                trajectory.costs.append(cost)
+
+                if not trajectory.done:
+                    trajectory.observations.append(obs)
+
+            continue_mask = np.asarray([1 - trajectory.done for trajectory in trajectories])
+
+        return rollout_states
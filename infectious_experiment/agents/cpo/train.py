@@ -7,7 +7,7 @@ from yaml import load, full_load
 from agents.cpo import CPO
 from memory import Memory
 from models import build_diag_gauss_policy, build_mlp, build_categorical_policy
-from simulators import SinglePathSimulator
+from simulators import SinglePathSimulator, VineSimulator
 from torch_utils.torch_utils import get_device
 
 from environments.attention_allocation import Params
@@ -46,6 +46,9 @@ vf_dims = config['vf_hidden_dims']
 cf_dims = config['cf_hidden_dims']
 max_constraint_val = config['max_constraint_val']
 bias_red_cost = config['bias_red_cost']
+# only used with --simulator vine
+n_rollout_states = config.get('n_rollout_states', 4)
+n_branches = config.get('n_branches', 4)
 device = get_device()
 
 N_LOCATIONS = 10
@@ -79,7 +82,9 @@ env_params = Params(
         extra_incident_prob=tuple(0. for _ in range(N_LOCATIONS)),
         dynamic_rate=DYNAMIC_RATE)
 
-simulator = SinglePathSimulator(env_name, policy, n_trajectories, trajectory_len, params=env_params)
+simulator_cls = VineSimulator if args.simulator_type == 'vine' else SinglePathSimulator
+simulator_args = dict(n_rollout_states=n_rollout_states, n_branches=n_branches) if args.simulator_type == 'vine' else {}
+simulator = simulator_cls(env_name, policy, n_trajectories, trajectory_len, params=env_params, **simulator_args)
 
 # print(simulator.env[0].observation_space.shape)
 # print(simulator.env[0].action_space.shape)
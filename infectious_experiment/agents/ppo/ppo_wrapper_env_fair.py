@@ -143,6 +143,9 @@ class PPOEnvWrapper_fair(gym.Wrapper):
         self.delta = self.reward_fn.calc_delta(num_vaccines_per_community=self.num_vaccines_per_community,
                                                num_newly_infected_per_community=self.num_newly_infected_per_community)
         self.delta_delta = self.delta - old_delta
+        # report them in the step result, so that vectorized envs do not need get_attr('delta')
+        info['delta'] = self.delta
+        info['delta_delta'] = self.delta_delta
         
         self.timestep += 1
         if self.timestep == self.ep_timesteps:
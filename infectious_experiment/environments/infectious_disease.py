@@ -35,11 +35,60 @@ import gin
 from gym import spaces
 import networkx as nx
 import numpy as np
+import scipy.sparse
 from six.moves import range
 
 from infectious_experiment.environments import core
 from infectious_experiment.environments.spaces import graph, multi_discrete_with_none
 
+# How InfectiousDiseaseEnv computes the disease progression of a step (see
+# InfectiousDiseaseEnv.set_step_engine):
+# - 'networkx': loops over the individuals, counts the infected neighbors of
+#   each one in the networkx graph and draws its transition with rng.choice.
+# - 'sparse': keeps the contact graph as a scipy CSR adjacency matrix and the
+#   health states as an int8 numpy array, counts the infected neighbors with one
+#   sparse matrix-vector product and draws all the transitions at once. It draws
+#   the same random numbers as 'networkx', so both give the same trajectories.
+STEP_ENGINES = ('networkx', 'sparse')
+
+
+def _adjacency_matrix(population_graph):
+  """Returns the contact graph as a scipy CSR matrix of zeros and ones.
+
+  Row j has ones at the neighbors of individual j (population_graph.neighbors(j))
+  so the nodes must be labelled 0 to number_of_nodes - 1.
+  """
+  population_size = population_graph.number_of_nodes()
+  edges = np.array(list(population_graph.edges()), dtype=np.int64).reshape(-1, 2)
+  rows, cols = edges[:, 0], edges[:, 1]
+  if not population_graph.is_directed():
+    rows, cols = np.concatenate([rows, cols]), np.concatenate([cols, rows])
+  adjacency = scipy.sparse.csr_matrix(
+      (np.ones(len(rows)), (rows, cols)),
+      shape=(population_size, population_size))
+  # Self-loops of undirected graphs were added twice.
+  adjacency.data[:] = 1.
+  return adjacency
+
+
+def _sample_categorical(rng, probs):
+  """Draws one index per row of probs.
+
+  Same draws as calling rng.choice(probs.shape[1], p=row) for each row in turn:
+  one uniform per row, compared with the normalized cumulative probabilities.
+
+  Args:
+    rng: A numpy RandomState() object acting as a random number generator.
+    probs: (n, k) array whose rows are probability distributions.
+
+  Returns:
+    A (n,) integer numpy array.
+  """
+  cdf = probs.cumsum(axis=1)
+  cdf /= cdf[:, -1:]
+  uniform_samples = rng.random_sample(len(probs))
+  return (cdf <= uniform_samples[:, None]).sum(axis=1)
+
 
 @attr.s(cmp=False)
 class Params(core.Params):
@@ -188,6 +237,17 @@ class InfectiousDiseaseEnv(core.FairnessEnv):
       values.
   """
 
+  # Only the health states change from step to step.
+  history_skip_vars = ('rng', 'params', 'population_graph')
+  snapshot_skip_vars = ('params', 'population_graph')
+
+  # One of STEP_ENGINES. With 'sparse', state.health_states is an int8 numpy
+  # array instead of a list.
+  step_engine = 'networkx'  # type: Text
+  # CSR adjacency matrix of the contact graph, built on the first 'sparse' step.
+  # The contact graph is assumed not to change.
+  _adjacency = None  # type: Optional[scipy.sparse.csr_matrix]
+
   def __init__(self, params):
     population_size = params.population_graph.number_of_nodes()
 
@@ -234,9 +294,28 @@ class InfectiousDiseaseEnv(core.FairnessEnv):
         'params.initial_health_state has length %d, expected %d.' % (
             len(params.initial_health_state), population_size))
     state.health_states = params.initial_health_state
+    if self.step_engine == 'sparse':
+      state.health_states = np.array(state.health_states, dtype=np.int8)
 
     return state
 
+  def set_step_engine(self, engine):
+    """Sets how the disease progression is computed.
+
+    Args:
+      engine: one of STEP_ENGINES.
+    """
+    if engine not in STEP_ENGINES:
+      raise ValueError('Unknown step engine %s, expected one of %s' %
+                       (engine, STEP_ENGINES))
+    self.step_engine = engine
+    self._adjacency = None
+    if engine == 'sparse':
+      self.state.health_states = np.array(
+          self.state.health_states, dtype=np.int8)
+    else:
+      self.state.health_states = list(self.state.health_states)
+
   def render(self,
              color_map,
              mode='human',
@@ -296,6 +375,10 @@ class InfectiousDiseaseEnv(core.FairnessEnv):
       state.health_states[idx] = state.rng.choice(
           len(params.state_names), p=transition_probs)
 
+    if self.step_engine == 'sparse':
+      self._progress_disease_sparse(state)
+      return state
+
     # Progress disease by tracking state transitions then applying them.
     transitions = []  # Tracks new states.
     for index, health_state in enumerate(state.health_states):
@@ -325,6 +408,32 @@ class InfectiousDiseaseEnv(core.FairnessEnv):
 
     return state
 
+  def _progress_disease_sparse(self, state):
+    """Applies the disease progression of a step with the 'sparse' engine."""
+    params = state.params
+    if self._adjacency is None:
+      self._adjacency = _adjacency_matrix(state.population_graph)
+    health_states = state.health_states
+
+    num_infected_neighbors = self._adjacency.dot(
+        (health_states == params.infectious_index).astype(np.float64))
+
+    transition_probs = np.asarray(
+        params.transition_matrix, dtype=np.float64)[health_states]
+    # Transitions from the healthy state (see the class-level docstring).
+    healthy = health_states == params.healthy_index
+    stay_healthy_probs = (
+        (1. - params.infection_probability) ** num_infected_neighbors[healthy])
+    healthy_transition_probs = np.zeros((len(stay_healthy_probs),
+                                         len(params.state_names)))
+    healthy_transition_probs[:, params.healthy_index] = stay_healthy_probs
+    healthy_transition_probs[:, params.healthy_exit_index] = (
+        1 - stay_healthy_probs)
+    transition_probs[healthy] = healthy_transition_probs
+
+    state.health_states = _sample_categorical(
+        state.rng, transition_probs).astype(np.int8)
+
   def reset(self):
     """Resets the environment."""
     self.state = self._create_initial_state(self.state.rng)
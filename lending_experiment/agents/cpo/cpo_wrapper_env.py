@@ -1,3 +1,5 @@
+import copy
+
 import gym
 import numpy as np
 import torch
@@ -7,6 +9,9 @@ from lending_experiment.config import EP_TIMESTEPS, ZETA_0, ZETA_1
 
 
 class CPOEnvWrapper(gym.Wrapper):
+  # Episode statistics of the wrapper, saved by snapshot() along with the env
+  SNAPSHOT_VARS = ('timestep', 'tp', 'fp', 'tn', 'fn', 'tpr', 'old_bank_cash', 'delta', 'delta_deltas')
+
   def __init__(self,
                env,
                reward_fn,
@@ -78,6 +83,18 @@ class CPOEnvWrapper(gym.Wrapper):
 
     return self.process_observation(self.env.reset())
 
+  def snapshot(self):
+    """
+    Mutable state of the wrapper and of the env (see core.FairnessEnv.snapshot), to be passed to restore()
+    """
+    return self.env.snapshot(), {name: copy.deepcopy(getattr(self, name)) for name in self.SNAPSHOT_VARS}
+
+  def restore(self, snapshot):
+    env_snapshot, wrapper_vars = snapshot
+    self.env.restore(env_snapshot)
+    for name, value in wrapper_vars.items():
+      setattr(self, name, copy.deepcopy(value))
+
   def step(self, action):
     if isinstance(action, list):
       action = action[0]
@@ -165,6 +165,10 @@ class PPOEnvWrapper_fair(gym.Wrapper):
                        zeta0=self.zeta_0,
                        zeta1=self.zeta_1)
 
+    # report the delta terms in the step result, so that vectorized envs do not need get_attr('delta')
+    info['delta'] = self.delta
+    info['delta_delta'] = self.delta_delta
+
     self.timestep += 1
     if self.timestep >= self.ep_timesteps:
       done = True  
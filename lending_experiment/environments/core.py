@@ -20,6 +20,7 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import collections
 import copy
 import enum
 from typing import Any, Callable, Dict, List, Mapping, Optional, Text, Tuple, TypeVar, Union
@@ -182,6 +183,32 @@ class HistoryItem(object):
 
 HistoryType = List[HistoryItem]
 
+# How FairnessEnv records its history (see FairnessEnv.set_history_mode):
+#   'full': every (state, action) pair, with a deep copy of the whole state.
+#   'ring': like 'full', but only the last `history_maxlen` pairs are kept.
+#   'deltas': every pair, but only the state attributes that change from step
+#     to step are copied; the ones in `history_skip_vars` are shared with the
+#     live state, so they show their current value.
+#   'off': nothing is recorded.
+HISTORY_MODES = ('full', 'ring', 'deltas', 'off')
+
+# When FairnessEnv.step checks that the action and the observation are in
+# their spaces (see FairnessEnv.set_validation_mode):
+#   'always': at every step.
+#   'first': during the first `validation_steps` steps of the environment.
+#   'every': once every `validation_steps` steps.
+#   'never': not at all.
+VALIDATION_MODES = ('always', 'first', 'every', 'never')
+
+
+@attr.s
+class EnvSnapshot(object):
+  """Mutable part of a FairnessEnv, see FairnessEnv.snapshot."""
+  state_vars = attr.ib()  # type: Dict[Text, Any]
+  rng_state = attr.ib()  # type: Tuple
+  # Environment-specific mutable data that is not a state attribute.
+  extra = attr.ib(factory=dict)  # type: Dict[Text, Any]
+
 
 @gin.configurable
 @attr.s
@@ -238,8 +265,14 @@ class FairnessEnv(gym.Env):
       render
       close
       seed
-  # TODO(): Add methods to save/restore state.
+
   Extends gym.Env:
+      snapshot, restore: Save and restore the mutable part of the state (e.g.
+        to run several rollouts from the same state).
+      set_history_mode: Chooses how much of the history of (state, action)
+        pairs is recorded.
+      set_validation_mode: Chooses at which steps actions and observations are
+        checked against their spaces.
       set_scalar_reward: Allows an agent to specify how the environment should
         translate state or changes in state to a scalar reward.
   Observations returned immediately after reset (initial observations) may not
@@ -259,6 +292,24 @@ class FairnessEnv(gym.Env):
   assert (not group_membership_var or
           (group_membership_var in observable_state_vars))
 
+  # One of HISTORY_MODES. Only Metric and render read the history, so training
+  # can turn it off with set_history_mode('off').
+  history_mode = 'full'  # type: Text
+  history_maxlen = None  # type: Optional[int]
+
+  # State attributes that are not copied in the 'deltas' history mode.
+  history_skip_vars = ('rng',)  # type: Tuple[Text, ...]
+
+  # State attributes that do not change once the state is created, so that
+  # snapshot() does not copy them (the rng is always saved by its state).
+  snapshot_skip_vars = ()  # type: Tuple[Text, ...]
+
+  # One of VALIDATION_MODES. The space checks are only there to catch bugs, and
+  # can be expensive (e.g. GraphSpace), so training can restrict them.
+  validation_mode = 'always'  # type: Text
+  validation_steps = None  # type: Optional[int]
+  _num_steps = 0  # Steps taken since the environment was created.
+
   def __init__(self,
                params = None,
                initialize_observation_space = True,
@@ -310,7 +361,8 @@ class FairnessEnv(gym.Env):
           'If using core.FairnessEnv, subclass and implement necessary methods.'
       )
 
-    if not self.action_space.contains(action):
+    validate = self._should_validate()
+    if validate and not self.action_space.contains(action):
       raise gym.error.InvalidAction('Invalid action: %s' % action)
 
     self._update_history(self.state, action)
@@ -320,7 +372,7 @@ class FairnessEnv(gym.Env):
     logging.debug('Observation: %s.', observation)
     logging.debug('Observation space: %s.', self.observation_space)
 
-    assert self.observation_space.contains(
+    assert not validate or self.observation_space.contains(
         observation
     ), 'Observation %s is not contained in self.observation_space' % observation
 
@@ -355,6 +407,67 @@ class FairnessEnv(gym.Env):
     """
     self.reward_fn = reward_fn
 
+  def snapshot(self):
+    """Captures the mutable part of the environment's state.
+
+    Cheaper than copy.deepcopy(env): the attributes in `snapshot_skip_vars`
+    are not copied, and the rng is saved through its get_state(). The history
+    is not part of the snapshot.
+
+    Returns:
+      An `EnvSnapshot` that can be passed to `restore`, any number of times.
+    """
+    state_vars = {
+        field.name: copy.deepcopy(getattr(self.state, field.name))
+        for field in attr.fields(type(self.state))
+        if field.name != 'rng' and field.name not in self.snapshot_skip_vars
+    }
+    return EnvSnapshot(state_vars=state_vars, rng_state=self.state.rng.get_state())
+
+  def restore(self, snapshot):
+    """Puts the environment back in the state captured by `snapshot`.
+
+    Args:
+      snapshot: an `EnvSnapshot` returned by `snapshot` on this environment (or
+        on a copy of it).
+    """
+    for name, value in snapshot.state_vars.items():
+      setattr(self.state, name, copy.deepcopy(value))
+    self.state.rng.set_state(snapshot.rng_state)
+
+  def set_history_mode(self, mode, maxlen = None):
+    """Sets how the environment records its history.
+
+    Args:
+      mode: one of HISTORY_MODES.
+      maxlen: number of (state, action) pairs kept in the 'ring' mode.
+    """
+    if mode not in HISTORY_MODES:
+      raise ValueError('Unknown history mode %s, expected one of %s' %
+                       (mode, HISTORY_MODES))
+    if mode == 'ring' and not maxlen:
+      raise ValueError('The ring history mode needs a positive maxlen')
+    self.history_mode = mode
+    self.history_maxlen = maxlen
+    self._reset_history()
+
+  def set_validation_mode(self, mode, steps = None):
+    """Sets at which steps actions and observations are validated.
+
+    Args:
+      mode: one of VALIDATION_MODES.
+      steps: number of validated steps in the 'first' mode, period in the
+        'every' mode.
+    """
+    if mode not in VALIDATION_MODES:
+      raise ValueError('Unknown validation mode %s, expected one of %s' %
+                       (mode, VALIDATION_MODES))
+    if mode in ('first', 'every') and not steps:
+      raise ValueError('The %s validation mode needs a positive number of '
+                       'steps' % mode)
+    self.validation_mode = mode
+    self.validation_steps = steps
+
   def serialize_history(self):
     """Serialize history to JSON.
     Returns:
@@ -422,16 +535,42 @@ class FairnessEnv(gym.Env):
   # Private convenience functions #
   #################################
 
+  def _should_validate(self):
+    """Returns whether the current step is validated, and counts the step."""
+    num_steps = self._num_steps
+    self._num_steps += 1
+    if self.validation_mode == 'always':
+      return True
+    if self.validation_mode == 'first':
+      return num_steps < self.validation_steps
+    if self.validation_mode == 'every':
+      return num_steps % self.validation_steps == 0
+    return False
+
   def _update_history(self, state, action):
     """Adds state and action to the environment's history."""
-    self.history.append(HistoryItem(state=copy.deepcopy(state), action=action))
+    if self.history_mode == 'off':
+      return
+    if self.history_mode == 'deltas':
+      state = attr.evolve(
+          state, **{
+              field.name: copy.deepcopy(getattr(state, field.name))
+              for field in attr.fields(type(state))
+              if field.name not in self.history_skip_vars
+          })
+    else:
+      state = copy.deepcopy(state)
+    self.history.append(HistoryItem(state=state, action=action))
 
   def _set_history(self, history):
     self.history = history
 
   def _reset_history(self):
     """Resets the environment's history."""
-    self.history = []
+    if self.history_mode == 'ring':
+      self.history = collections.deque(maxlen=self.history_maxlen)
+    else:
+      self.history = []
 
   def _set_state(self, state):
     """Sets the environment's state."""
@@ -113,6 +113,12 @@ class BaseLendingEnv(core.FairnessEnv):
   _cash_updater = _CashUpdater()
   _parameter_updater = core.NoUpdate()
   _applicant_updater = _ApplicantSampler()
+  # The credit-cluster weights in params can change (e.g. DelayedImpactEnv), but
+  # render only reads the bank cash and applicants from the history.
+  history_skip_vars = ('rng', 'params')
+  # Of the params, only the credit-cluster weights change; snapshot() saves
+  # them instead of copying the whole applicant distribution.
+  snapshot_skip_vars = ('params',)
 
   def __init__(self, params = None):
     params = (
@@ -157,6 +163,24 @@ class BaseLendingEnv(core.FairnessEnv):
     self._state_init(self.state.rng)
     return super(BaseLendingEnv, self).reset()
 
+  def snapshot(self):
+    """See core.FairnessEnv.snapshot."""
+    snapshot = super(BaseLendingEnv, self).snapshot()
+    snapshot.extra['cluster_weights'] = [
+        list(getattr(component, 'weights', ()))
+        for component in self.state.params.applicant_distribution.components
+    ]
+    return snapshot
+
+  def restore(self, snapshot):
+    """See core.FairnessEnv.restore."""
+    super(BaseLendingEnv, self).restore(snapshot)
+    for component, weights in zip(
+        self.state.params.applicant_distribution.components,
+        snapshot.extra['cluster_weights']):
+      if weights:
+        component.weights = list(weights)
+
   def _is_done(self):
     """Returns True if the bank cash is less than loan_amount."""
     return self.state.bank_cash < self.state.params.loan_amount
@@ -6,6 +6,9 @@ import pandas as pd
 # for smoothing
 from scipy.ndimage.filters import gaussian_filter1d
 
+sys.path.append('..')
+from sb3_ppo_fair.utils_fair import load_eval_fair
+
 
 def tikzplotlib_fix_ncols(obj):
     """
@@ -28,8 +31,7 @@ def collect_data_csv(exp_path,
     count = 0
     for seed in range(seeds):
         try:
-            data_pth  = os.path.join("%s_%s_%d" % (exp_path, seed_str, seed) ,'eval.csv')
-            data = pd.read_csv(data_pth, sep=',', header=0)
+            data = pd.DataFrame(load_eval_fair("%s_%s_%d" % (exp_path, seed_str, seed)))
             num_samples = data['num_timesteps'].to_numpy()
             return_arr = data['return'].to_numpy()
             bias = data['bias'].to_numpy()
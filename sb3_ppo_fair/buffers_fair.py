@@ -5,7 +5,7 @@ The buffer in the file is a standard RL buffer with two additional components
 '''
 import warnings
 from abc import ABC, abstractmethod
-from typing import Any, Dict, Generator, List, Optional, Union
+from typing import Any, Dict, Generator, List, Optional, Tuple, Union
 
 import numpy as np
 import torch as th
@@ -14,7 +14,7 @@ from gym import spaces
 from stable_baselines3.common.preprocessing import get_action_dim, get_obs_shape
 from stable_baselines3.common.vec_env import VecNormalize
 
-from .type_aliases import RolloutBufferSamples_fair
+from .type_aliases import RolloutBufferSamples_fair, RolloutBufferSamplesPacked_fair
 
 try:
     # Check memory used by replay buffer when possible
@@ -23,6 +23,99 @@ except ImportError:
     psutil = None
 
 
+def pack_fairness_np(arr: Union[np.ndarray, List[Union[np.ndarray, List[np.ndarray]]]]) -> np.ndarray:
+    """
+    Pack a "fairness list" [r, [r_U_0,..],[r_B_0,..]] into one array of shape (..., 1 + 2M),
+    where the last axis is ordered as [r, r_U_0,.., r_U_(M-1), r_B_0,.., r_B_(M-1)].
+    An array that is already packed is returned as is.
+    """
+    if isinstance(arr, np.ndarray):
+        return arr
+    assert len(arr) == 3, 'the input list should have length 3, and is of the form [r, [r_U_0,..],[r_B_0,..]]'
+    return np.stack([np.asarray(arr[0])] + [np.asarray(a) for a in arr[1]] + [np.asarray(a) for a in arr[2]], axis=-1)
+
+
+def pack_fairness_th(arr: Union[th.Tensor, List[Union[th.Tensor, List[th.Tensor]]]]) -> th.Tensor:
+    """
+    Same as pack_fairness_np() for torch tensors. Every element is flattened first, so the output
+    has shape (batch_size, 1 + 2M) for the (batch_size, 1) values predicted by ActorCriticPolicy_fair.
+    """
+    if isinstance(arr, th.Tensor):
+        return arr
+    assert len(arr) == 3, 'the input list should have length 3, and is of the form [r, [r_U_0,..],[r_B_0,..]]'
+    return th.stack([arr[0].flatten()] + [a.flatten() for a in arr[1]] + [a.flatten() for a in arr[2]], dim=-1)
+
+
+def unpack_fairness(packed: Union[np.ndarray, th.Tensor], num_groups: int) -> List[Union[np.ndarray, th.Tensor, list]]:
+    """
+    Inverse of pack_fairness_np/pack_fairness_th: return the "fairness list" [r, [r_U_0,..],[r_B_0,..]]
+    whose elements are views (no copy) into the last axis of ``packed``.
+    """
+    return [packed[..., 0], [packed[..., 1 + g] for g in range(num_groups)], [packed[..., 1 + num_groups + g] for g in range(num_groups)]]
+
+
+def compute_gae_fair(
+    rewards: th.Tensor,
+    values: th.Tensor,
+    episode_starts: th.Tensor,
+    last_values: th.Tensor,
+    dones: th.Tensor,
+    gamma: float,
+    gae_lambda: float,
+    chunk_size: int = 128,
+) -> Tuple[th.Tensor, th.Tensor]:
+    """
+    GAE(lambda) advantages and TD(lambda) returns for all 1 + 2M reward streams and all envs at once.
+
+    The backward recursion A_t = delta_t + gamma * lambda * non_terminal_t * A_(t+1) is unrolled as
+    A_t = sum_(s >= t) W[t, s] * delta_s, where W[t, s] = (gamma * lambda)^(s - t) if no episode starts in (t, s] and 0 otherwise.
+    The buffer is processed in chunks of ``chunk_size`` steps (from the last chunk to the first): inside a chunk the sum
+    is one batched matrix product, and the advantage of the first step of a chunk is carried to the previous chunk.
+    The result equals the step-by-step loop of RolloutBuffer_fair up to floating point rounding.
+
+    :param rewards: (buffer_size, n_envs, 1 + 2M) packed rewards (see pack_fairness_np)
+    :param values: (buffer_size, n_envs, 1 + 2M) packed value estimates
+    :param episode_starts: (buffer_size, n_envs), 1 at the first step of an episode
+    :param last_values: (n_envs, 1 + 2M) value estimates of the state after the last step
+    :param dones: (n_envs,) whether the last step was terminal
+    :param gamma: Discount factor
+    :param gae_lambda: Factor for trade-off of bias vs variance for Generalized Advantage Estimator
+    :param chunk_size: number of steps handled by one matrix product (memory is chunk_size^2 * n_envs)
+    :return: advantages and returns, both of shape (buffer_size, n_envs, 1 + 2M), on the device of ``values``
+    """
+    buffer_size, n_envs = values.shape[:2]
+    dtype, device = values.dtype, values.device
+    last_values = last_values.reshape(n_envs, -1).to(device=device, dtype=dtype)
+    dones = dones.reshape(1, n_envs).to(device=device, dtype=dtype)
+
+    # next_non_terminal[t] and next_values[t] refer to step t + 1, as in the step-by-step loop
+    next_non_terminal = th.cat([1.0 - episode_starts[1:].to(dtype), 1.0 - dones], dim=0)
+    next_values = th.cat([values[1:], last_values.unsqueeze(0)], dim=0)
+    deltas = rewards + gamma * next_values * next_non_terminal.unsqueeze(-1) - values
+
+    gl = gamma * gae_lambda
+    advantages = th.empty_like(values)
+    last_gae_lam = th.zeros_like(last_values)
+    for end in range(buffer_size, 0, -chunk_size):
+        start = max(0, end - chunk_size)
+        n = end - start
+        # num_terminal[k] = number of episode boundaries among the first k steps of the chunk
+        num_terminal = th.cat([th.zeros(1, n_envs, device=device), th.cumsum((next_non_terminal[start:end] == 0).float(), dim=0)], dim=0)
+        steps = th.arange(n, device=device)
+        gaps = steps.unsqueeze(0) - steps.unsqueeze(1) # gaps[t, s] = s - t
+        decay = th.pow(th.tensor(gl, dtype=th.float64, device=device), gaps.clamp(min=0)).to(dtype) * (gaps >= 0)
+        # weight[t, s, e]: contribution of delta_s to A_t within the chunk
+        weight = decay.unsqueeze(-1) * (num_terminal[:n].unsqueeze(0) == num_terminal[:n].unsqueeze(1))
+        # carry[t, e]: contribution of the advantage right after the chunk to A_t
+        carry = th.pow(th.tensor(gl, dtype=th.float64, device=device), n - steps).to(dtype).unsqueeze(-1) * (num_terminal[n] == num_terminal[:n])
+        advantages[start:end] = th.einsum('tse,sek->tek', weight, deltas[start:end]) + carry.unsqueeze(-1) * last_gae_lam
+        last_gae_lam = advantages[start]
+
+    # TD(lambda) estimator, see Github PR #375 or "Telescoping in TD(lambda)"
+    returns = advantages + values
+    return advantages, returns
+
+
 class BaseBuffer(ABC):
     """
     Base class that represent a buffer (rollout or replay)
@@ -179,12 +272,18 @@ class RolloutBuffer_fair(BaseBuffer):
         Equivalent to classic advantage when set to 1.
     :param gamma: Discount factor
     :param n_envs: Number of parallel environments
+    :param num_groups: Number of groups M
+    :param fairness_critics: If False (main-critic-only mode, for GPPO, RPPO and APPO), the policy only predicts the main value,
+        so values, returns and advantages only contain the main signal ([v, [], []]), while rewards keep all 2*M + 1 signals
 
     modification from the previous version:
     1. dealing with 2*M + 1 reward, which involves return, advantage. The order is: r_main, r_U: List, r_B: List
     We keep the "deltas = tpr difference" and delta_deltas in APPO's paper
     """
 
+    # whether the storage lives on self.device as torch tensors (see DeviceRolloutBuffer_fair)
+    on_device = False
+
     def __init__(
         self,
         buffer_size: int,
@@ -195,6 +294,7 @@ class RolloutBuffer_fair(BaseBuffer):
         gamma: float = 0.99,
         n_envs: int = 1,
         num_groups: int = 2,
+        fairness_critics: bool = True,
     ):
 
         super(RolloutBuffer_fair, self).__init__(buffer_size, observation_space, action_space, device, n_envs=n_envs)
@@ -204,18 +304,27 @@ class RolloutBuffer_fair(BaseBuffer):
         self.episode_starts, self.log_probs = None, None
 
         self.num_groups = num_groups
+        # number of groups whose U/B values are predicted (0 in main-critic-only mode)
+        self.num_critic_groups = num_groups if fairness_critics else 0
 
         # 1 + 2*M rewards: main reward, r_U, r_B
         self.rewards = [None, [None for i in range(self.num_groups)], [None for i in range(self.num_groups)]]
-        self.returns = [None, [None for i in range(self.num_groups)], [None for i in range(self.num_groups)]]
-        self.values = [None, [None for i in range(self.num_groups)], [None for i in range(self.num_groups)]]
-        self.advantages = [None, [None for i in range(self.num_groups)], [None for i in range(self.num_groups)]]
+        self.returns = [None, [None for i in range(self.num_critic_groups)], [None for i in range(self.num_critic_groups)]]
+        self.values = [None, [None for i in range(self.num_critic_groups)], [None for i in range(self.num_critic_groups)]]
+        self.advantages = [None, [None for i in range(self.num_critic_groups)], [None for i in range(self.num_critic_groups)]]
 
         self.generator_ready = False
 
         # Only for APPO
         self.deltas = None
         self.delta_deltas = None
+
+        # rollout-level fairness statistics, see compute_fairness_statistics()
+        self.num_episodes = None
+        self.value_U_estimate, self.value_B_estimate, self.ratio_fairness = None, None, None
+        # the same estimates for each env separately
+        self.num_episodes_per_env = None
+        self.value_U_estimate_per_env, self.value_B_estimate_per_env, self.ratio_fairness_per_env = None, None, None
         
         self.reset()
 
@@ -234,9 +343,9 @@ class RolloutBuffer_fair(BaseBuffer):
                 self.advantages[i] = np.zeros((self.buffer_size, self.n_envs), dtype=np.float32)
             else:
                 self.rewards[i] = [np.zeros((self.buffer_size, self.n_envs), dtype=np.float32) for g in range(self.num_groups)]
-                self.returns[i] = [np.zeros((self.buffer_size, self.n_envs), dtype=np.float32) for g in range(self.num_groups)]
-                self.values[i] = [np.zeros((self.buffer_size, self.n_envs), dtype=np.float32) for g in range(self.num_groups)]
-                self.advantages[i] = [np.zeros((self.buffer_size, self.n_envs), dtype=np.float32) for g in range(self.num_groups)]
+                self.returns[i] = [np.zeros((self.buffer_size, self.n_envs), dtype=np.float32) for g in range(self.num_critic_groups)]
+                self.values[i] = [np.zeros((self.buffer_size, self.n_envs), dtype=np.float32) for g in range(self.num_critic_groups)]
+                self.advantages[i] = [np.zeros((self.buffer_size, self.n_envs), dtype=np.float32) for g in range(self.num_critic_groups)]
         
         self.generator_ready = False
         
@@ -267,39 +376,76 @@ class RolloutBuffer_fair(BaseBuffer):
         :param last_values: state value estimation for the last step (one for each env), for 1 + 2*M rewards
         structure: [r, [r_U_0,...], [r_B_0,...]]
         """
-        # Convert to numpy
         assert len(last_values) == 3, 'Incorrect length of last_values, should be 3: [v,[v_U_0,...],[v_B_0,...]]'
-        last_values[0] = last_values[0].clone().cpu().numpy().flatten()
-        last_values[1] = [i.clone().cpu().numpy().flatten() for i in last_values[1]]
-        last_values[2] = [i.clone().cpu().numpy().flatten() for i in last_values[2]]
-
-        last_gae_lam = [0, [0 for i in range(self.num_groups)], [0 for i in range(self.num_groups)]]
-        for step in reversed(range(self.buffer_size)):
-            if step == self.buffer_size - 1:
-                next_non_terminal = 1.0 - dones
-                next_values = last_values
-            else:
-                next_non_terminal = 1.0 - self.episode_starts[step + 1]
-                next_values = [self.values[0][step + 1], [self.values[1][g][step + 1] for g in range(self.num_groups)], [self.values[2][g][step + 1] for g in range(self.num_groups)]]  
-            
-            for i in range(3):
-                if i == 0:
-                    delta = self.rewards[i][step] + self.gamma * next_values[i] * next_non_terminal - self.values[i][step]
-                    last_gae_lam[i] = delta + self.gamma * self.gae_lambda * next_non_terminal * last_gae_lam[i]
-                else:
-                    delta = [(self.rewards[i][g][step] + self.gamma * next_values[i][g] * next_non_terminal - self.values[i][g][step]) for g in range(self.num_groups)]
-                    last_gae_lam[i] = [(delta[g] + self.gamma * self.gae_lambda * next_non_terminal * last_gae_lam[i][g]) for g in range(self.num_groups)]
-            
-            self.advantages[0][step] = last_gae_lam[0]
-            for g in range(self.num_groups):
-                self.advantages[1][g][step] = last_gae_lam[1][g]
-                self.advantages[2][g][step] = last_gae_lam[2][g]
+        # all 1 + 2*M streams are computed at once in the packed layout, see compute_gae_fair()
+        advantages, returns = compute_gae_fair(
+            th.as_tensor(pack_fairness_np(self.rewards)[..., :1 + 2 * self.num_critic_groups]),
+            th.as_tensor(pack_fairness_np(self.values)),
+            th.as_tensor(self.episode_starts),
+            pack_fairness_th(last_values).detach().cpu(),
+            th.as_tensor(dones),
+            self.gamma,
+            self.gae_lambda,
+        )
+        self.advantages = unpack_fairness(advantages.numpy(), self.num_critic_groups)
+        self.returns = unpack_fairness(returns.numpy(), self.num_critic_groups)
+        self.compute_fairness_statistics()
 
-        # TD(lambda) estimator, see Github PR #375 or "Telescoping in TD(lambda)"
-        self.returns[0] = self.advantages[0] + self.values[0]        
-        for g in range(self.num_groups):
-            self.returns[1][g] = self.advantages[1][g] + self.values[1][g]   
-            self.returns[2][g] = self.advantages[2][g] + self.values[2][g]   
+    def _packed_rewards(self) -> Union[np.ndarray, th.Tensor]:
+        """
+        :return: the rewards of the buffer as one array of shape (..., 1 + 2M), see pack_fairness_np()
+        """
+        return pack_fairness_np(self.rewards)
+
+    def compute_fairness_statistics(self) -> None:
+        """
+        Estimate the fairness return signals of the current policy from the whole buffer.
+        Called once at the end of the rollout (by compute_returns_and_advantage()); the results are exposed as
+        self.num_episodes, self.value_U_estimate, self.value_B_estimate (torch tensors of shape (M,) on self.device)
+        and self.ratio_fairness = value_U_estimate / value_B_estimate, so that train() and logging can reuse them.
+
+        Method 1 (deprecated): Use the TD lambda return of the first state in each episode (buffer contain several episodes)
+        Method 2 (actually used): Use Monte Carlo with gamma = 1
+        when gae_lambda = 1 and gamma = 1, the two methods are the same
+
+        With n_envs > 1, the episodes of each env are counted separately (self.num_episodes_per_env, shape (n_envs,))
+        and give per-env estimates self.value_U_estimate_per_env, self.value_B_estimate_per_env and
+        self.ratio_fairness_per_env of shape (n_envs, M), whose spread is logged by PPO_fair.train().
+        The pooled estimates above are the total return over all envs divided by the total number of episodes.
+        """
+        episode_starts = th.as_tensor(self.episode_starts).to(self.device)
+        self.num_episodes_per_env = (episode_starts == 1).sum(dim=0)
+        self.num_episodes = int(self.num_episodes_per_env.sum())
+        rewards = th.as_tensor(self._packed_rewards()).to(self.device)
+        value_estimate = rewards.reshape(-1, 1 + 2 * self.num_groups).sum(dim=0) / self.num_episodes
+        self.value_U_estimate = value_estimate[1:1 + self.num_groups]
+        self.value_B_estimate = value_estimate[1 + self.num_groups:]
+        self.ratio_fairness = self.value_U_estimate / self.value_B_estimate
+
+        value_estimate_per_env = rewards.sum(dim=0) / self.num_episodes_per_env.unsqueeze(1)
+        self.value_U_estimate_per_env = value_estimate_per_env[:, 1:1 + self.num_groups]
+        self.value_B_estimate_per_env = value_estimate_per_env[:, 1 + self.num_groups:]
+        self.ratio_fairness_per_env = self.value_U_estimate_per_env / self.value_B_estimate_per_env
+
+    def check_episode_alignment(self, ep_timesteps: Union[int, List[int]]) -> None:
+        """
+        Check that, in every env, the buffer holds a whole number of episodes and the i-th one starts at step
+        i * ep_timesteps. This holds because collect_rollouts() resets the env at the start of every rollout
+        and n_steps is a multiple of ep_timesteps, and it is what the Monte Carlo estimates of
+        compute_fairness_statistics() rely on.
+
+        :param ep_timesteps: episode length, either shared by all envs or one per env
+        """
+        episode_starts = self.episode_starts.cpu().numpy() if isinstance(self.episode_starts, th.Tensor) else self.episode_starts
+        ep_timesteps = np.broadcast_to(ep_timesteps, (self.n_envs,))
+        for env_idx in range(self.n_envs):
+            assert self.buffer_size % ep_timesteps[env_idx] == 0, \
+                f"env {env_idx}: the rollout buffer ({self.buffer_size} steps) does not hold a whole number of episodes " \
+                f"of {ep_timesteps[env_idx]} steps"
+            num_eps = int((episode_starts[:, env_idx] == 1).sum())
+            for i in range(num_eps):
+                assert episode_starts[i * ep_timesteps[env_idx], env_idx] == 1, \
+                    f"env {env_idx}: episode {i} does not start at step {i * ep_timesteps[env_idx]} of the rollout buffer"
 
     def add(
         self,
@@ -309,19 +455,21 @@ class RolloutBuffer_fair(BaseBuffer):
         episode_start: np.ndarray,
         value: th.Tensor,
         log_prob: th.Tensor,
-        deltas: th.Tensor,
-        delta_deltas: th.Tensor
+        deltas: Optional[th.Tensor] = None,
+        delta_deltas: Optional[th.Tensor] = None
 
     ) -> None:
         """
         :param obs: Observation
         :param action: Action
-        :param reward:
+        :param reward: "fairness list" [r, [r_U_0,..],[r_B_0,..]] or packed array of shape (n_envs, 1 + 2M)
         :param episode_start: Start of episode signal.
         :param value: estimated value of the current state
             following the current policy.
         :param log_prob: log probability of the action
             following the current policy.
+        :param deltas: (only for APPO) delta of each env after the step, not stored if None
+        :param delta_deltas: (only for APPO) delta(s') - delta(s) of each env, not stored if None
         """
         if len(log_prob.shape) == 0:
             # Reshape 0-d tensor to avoid error
@@ -331,13 +479,16 @@ class RolloutBuffer_fair(BaseBuffer):
         # as numpy cannot broadcast (n_discrete,) to (n_discrete, 1)
         if isinstance(self.observation_space, spaces.Discrete):
             obs = obs.reshape((self.n_envs,) + self.obs_shape)
+
+        if isinstance(reward, np.ndarray):
+            reward = unpack_fairness(reward, self.num_groups)
         
         self.rewards[0][self.pos] = np.array(reward[0]).copy()
         self.values[0][self.pos] = value[0].clone().cpu().numpy().flatten()
         for g in range(self.num_groups):
             self.rewards[1][g][self.pos] = np.array(reward[1][g]).copy()
             self.rewards[2][g][self.pos] = np.array(reward[2][g]).copy()
-
+        for g in range(self.num_critic_groups):
             self.values[1][g][self.pos] = value[1][g].clone().cpu().numpy().flatten()
             self.values[2][g][self.pos] = value[2][g].clone().cpu().numpy().flatten()
 
@@ -346,8 +497,9 @@ class RolloutBuffer_fair(BaseBuffer):
         self.episode_starts[self.pos] = np.array(episode_start).copy()
         self.log_probs[self.pos] = log_prob.clone().cpu().numpy()        
         # only for APPO
-        self.deltas[self.pos] = deltas.clone().cpu().numpy()
-        self.delta_deltas[self.pos] = delta_deltas.clone().cpu().numpy()
+        if deltas is not None:
+            self.deltas[self.pos] = deltas.clone().cpu().numpy()
+            self.delta_deltas[self.pos] = delta_deltas.clone().cpu().numpy()
 
         self.pos += 1
 
@@ -389,10 +541,10 @@ class RolloutBuffer_fair(BaseBuffer):
         data = (
             self.observations[batch_inds],
             self.actions[batch_inds],
-            [self.values[0][batch_inds].flatten(), [self.values[1][g][batch_inds].flatten() for g in range(self.num_groups)], [self.values[2][g][batch_inds].flatten() for g in range(self.num_groups)]],
+            [self.values[0][batch_inds].flatten(), [self.values[1][g][batch_inds].flatten() for g in range(self.num_critic_groups)], [self.values[2][g][batch_inds].flatten() for g in range(self.num_critic_groups)]],
             self.log_probs[batch_inds].flatten(),
-            [self.advantages[0][batch_inds].flatten(), [self.advantages[1][g][batch_inds].flatten() for g in range(self.num_groups)], [self.advantages[2][g][batch_inds].flatten() for g in range(self.num_groups)]],
-            [self.returns[0][batch_inds].flatten(), [self.returns[1][g][batch_inds].flatten() for g in range(self.num_groups)], [self.returns[2][g][batch_inds].flatten() for g in range(self.num_groups)]],
+            [self.advantages[0][batch_inds].flatten(), [self.advantages[1][g][batch_inds].flatten() for g in range(self.num_critic_groups)], [self.advantages[2][g][batch_inds].flatten() for g in range(self.num_critic_groups)]],
+            [self.returns[0][batch_inds].flatten(), [self.returns[1][g][batch_inds].flatten() for g in range(self.num_critic_groups)], [self.returns[2][g][batch_inds].flatten() for g in range(self.num_critic_groups)]],
             # only for APPO
             self.deltas[batch_inds].flatten(),
             self.delta_deltas[batch_inds].flatten()
@@ -436,3 +588,307 @@ class RolloutBuffer_fair(BaseBuffer):
                         arr_return[i][g] = arr[i][g].swapaxes(0, 1).reshape(shape[0] * shape[1], *shape[2:])
 
             return arr_return
+
+
+class PackedRolloutBuffer_fair(RolloutBuffer_fair):
+    """
+    Same as RolloutBuffer_fair, but the 1 + 2M reward signals are stored in a structure-of-arrays layout:
+    rewards, values, returns and advantages are each ONE contiguous array of shape (buffer_size, n_envs, 1 + 2M)
+    with the last axis ordered as [r, r_U_0,.., r_U_(M-1), r_B_0,.., r_B_(M-1)] (see pack_fairness_np).
+    Therefore add(), swap_and_flatten_fair() and _get_samples() do not loop over groups,
+    and every minibatch contains a single packed tensor per quantity (RolloutBufferSamplesPacked_fair).
+
+    self.rewards, self.values, self.returns and self.advantages are still available as "fairness lists",
+    but their elements are views into the packed arrays (so they should be treated as read-only).
+    In main-critic-only mode, values, returns and advantages have a last axis of size 1.
+    """
+
+    _packed_names = ["rewards", "values", "returns", "advantages"]
+
+    def reset(self) -> None:
+
+        self.observations = np.zeros((self.buffer_size, self.n_envs) + self.obs_shape, dtype=np.float32)
+        self.actions = np.zeros((self.buffer_size, self.n_envs, self.action_dim), dtype=np.float32)
+        self.episode_starts = np.zeros((self.buffer_size, self.n_envs), dtype=np.float32)
+        self.log_probs = np.zeros((self.buffer_size, self.n_envs), dtype=np.float32)
+
+        for name in self._packed_names:
+            self.__dict__[name + "_packed"] = np.zeros((self.buffer_size, self.n_envs, 1 + 2 * self._packed_num_groups(name)), dtype=np.float32)
+        self._update_fairness_views()
+
+        self.generator_ready = False
+
+        # Only for APPO
+        self.deltas = np.zeros((self.buffer_size, self.n_envs), dtype=np.float32)
+        self.delta_deltas = np.zeros((self.buffer_size, self.n_envs), dtype=np.float32)
+
+        BaseBuffer.reset(self)
+
+    def _packed_num_groups(self, name: str) -> int:
+        # rewards always contain the U/B signals of all groups, values/returns/advantages only if they are predicted
+        return self.num_groups if name == "rewards" else self.num_critic_groups
+
+    def _update_fairness_views(self) -> None:
+        # expose the packed arrays as "fairness lists" for code that reads e.g. self.rewards[1][g]
+        for name in self._packed_names:
+            self.__dict__[name] = unpack_fairness(self.__dict__[name + "_packed"], self._packed_num_groups(name))
+
+    def compute_returns_and_advantage(self, last_values: Union[th.Tensor, List[th.Tensor]], dones: np.ndarray) -> None:
+        """
+        See RolloutBuffer_fair.compute_returns_and_advantage() and compute_gae_fair().
+        :param last_values: [v, [v_U_0,...], [v_B_0,...]] or an already packed tensor of shape (n_envs, 1 + 2M)
+        """
+        advantages, returns = compute_gae_fair(
+            th.as_tensor(self.rewards_packed[..., :1 + 2 * self.num_critic_groups]),
+            th.as_tensor(self.values_packed),
+            th.as_tensor(self.episode_starts),
+            pack_fairness_th(last_values).detach().cpu(),
+            th.as_tensor(dones),
+            self.gamma,
+            self.gae_lambda,
+        )
+        self.advantages_packed[:] = advantages.numpy()
+        self.returns_packed[:] = returns.numpy()
+        self.compute_fairness_statistics()
+
+    def _packed_rewards(self) -> Union[np.ndarray, th.Tensor]:
+        return self.rewards_packed
+
+    def add(
+        self,
+        obs: np.ndarray,
+        action: np.ndarray,
+        reward: Union[np.ndarray, list],
+        episode_start: np.ndarray,
+        value: Union[th.Tensor, List[th.Tensor]],
+        log_prob: th.Tensor,
+        deltas: Optional[th.Tensor] = None,
+        delta_deltas: Optional[th.Tensor] = None
+
+    ) -> None:
+        """
+        See RolloutBuffer_fair.add().
+        :param reward: "fairness list" [r, [r_U_0,..],[r_B_0,..]] or an already packed array of shape (n_envs, 1 + 2M)
+        :param value: "fairness list" [v, [v_U_0,..],[v_B_0,..]] or an already packed tensor of shape (n_envs, 1 + 2M)
+        """
+        if len(log_prob.shape) == 0:
+            # Reshape 0-d tensor to avoid error
+            log_prob = log_prob.reshape(-1, 1)
+
+        # Reshape needed when using multiple envs with discrete observations
+        # as numpy cannot broadcast (n_discrete,) to (n_discrete, 1)
+        if isinstance(self.observation_space, spaces.Discrete):
+            obs = obs.reshape((self.n_envs,) + self.obs_shape)
+
+        self.rewards_packed[self.pos] = pack_fairness_np(reward).reshape(self.n_envs, -1)
+        self.values_packed[self.pos] = pack_fairness_th(value).clone().cpu().numpy().reshape(self.n_envs, -1)
+
+        self.observations[self.pos] = np.array(obs).copy()
+        self.actions[self.pos] = np.array(action).copy()
+        self.episode_starts[self.pos] = np.array(episode_start).copy()
+        self.log_probs[self.pos] = log_prob.clone().cpu().numpy()
+        # only for APPO
+        if deltas is not None:
+            self.deltas[self.pos] = deltas.clone().cpu().numpy()
+            self.delta_deltas[self.pos] = delta_deltas.clone().cpu().numpy()
+
+        self.pos += 1
+
+        if self.pos == self.buffer_size:
+            self.full = True
+
+    def get(self, batch_size: Optional[int] = None) -> Generator[RolloutBufferSamplesPacked_fair, None, None]:
+        assert self.full, ""
+        indices = np.random.permutation(self.buffer_size * self.n_envs)
+        # Prepare the data
+        if not self.generator_ready:
+
+            _tensor_names = [
+                "observations",
+                "actions",
+                "values_packed",
+                "log_probs",
+                "advantages_packed",
+                "returns_packed",
+                "rewards_packed",
+
+                "deltas",
+                "delta_deltas",
+            ]
+
+            for tensor in _tensor_names:
+                self.__dict__[tensor] = self.swap_and_flatten_fair(self.__dict__[tensor])
+            self._update_fairness_views()
+            self.generator_ready = True
+
+        # Return everything, don't create minibatches
+        if batch_size is None:
+            batch_size = self.buffer_size * self.n_envs
+
+        start_idx = 0
+        while start_idx < self.buffer_size * self.n_envs:
+            yield self._get_samples(indices[start_idx : start_idx + batch_size])
+            start_idx += batch_size
+
+    def _get_samples(self, batch_inds: np.ndarray, env: Optional[VecNormalize] = None) -> RolloutBufferSamplesPacked_fair:
+        data = (
+            self.observations[batch_inds],
+            self.actions[batch_inds],
+            self.values_packed[batch_inds],
+            self.log_probs[batch_inds].flatten(),
+            self.advantages_packed[batch_inds],
+            self.returns_packed[batch_inds],
+            # only for APPO
+            self.deltas[batch_inds].flatten(),
+            self.delta_deltas[batch_inds].flatten()
+        )
+        return RolloutBufferSamplesPacked_fair(*tuple(map(self.to_torch, data)))
+
+
+class DeviceRolloutBuffer_fair(PackedRolloutBuffer_fair):
+    """
+    Same layout as PackedRolloutBuffer_fair, but every array is a preallocated torch tensor on ``device`` (the policy device).
+    add() writes the values, log probabilities and APPO terms computed by the policy in place without going through numpy,
+    compute_returns_and_advantage() runs compute_gae_fair() on the device, and get() slices the stored tensors directly,
+    so minibatches are not copied back to the device in every epoch.
+    The only host to device copies left are the observations, actions and rewards returned by the environment.
+    """
+
+    on_device = True
+
+    def reset(self) -> None:
+
+        self.observations = th.zeros((self.buffer_size, self.n_envs) + self.obs_shape, dtype=th.float32, device=self.device)
+        self.actions = th.zeros((self.buffer_size, self.n_envs, self.action_dim), dtype=th.float32, device=self.device)
+        self.episode_starts = th.zeros((self.buffer_size, self.n_envs), dtype=th.float32, device=self.device)
+        self.log_probs = th.zeros((self.buffer_size, self.n_envs), dtype=th.float32, device=self.device)
+
+        for name in self._packed_names:
+            self.__dict__[name + "_packed"] = th.zeros((self.buffer_size, self.n_envs, 1 + 2 * self._packed_num_groups(name)), dtype=th.float32, device=self.device)
+        self._update_fairness_views()
+
+        self.generator_ready = False
+
+        # Only for APPO
+        self.deltas = th.zeros((self.buffer_size, self.n_envs), dtype=th.float32, device=self.device)
+        self.delta_deltas = th.zeros((self.buffer_size, self.n_envs), dtype=th.float32, device=self.device)
+
+        BaseBuffer.reset(self)
+
+    def compute_returns_and_advantage(self, last_values: Union[th.Tensor, List[th.Tensor]], dones: np.ndarray) -> None:
+        """
+        See RolloutBuffer_fair.compute_returns_and_advantage() and compute_gae_fair().
+        """
+        self.advantages_packed[:], self.returns_packed[:] = compute_gae_fair(
+            self.rewards_packed[..., :1 + 2 * self.num_critic_groups],
+            self.values_packed,
+            self.episode_starts,
+            pack_fairness_th(last_values),
+            th.as_tensor(dones),
+            self.gamma,
+            self.gae_lambda,
+        )
+        self.compute_fairness_statistics()
+
+    def add(
+        self,
+        obs: Union[np.ndarray, th.Tensor],
+        action: Union[np.ndarray, th.Tensor],
+        reward: Union[np.ndarray, list],
+        episode_start: np.ndarray,
+        value: Union[th.Tensor, List[th.Tensor]],
+        log_prob: th.Tensor,
+        deltas: Optional[th.Tensor] = None,
+        delta_deltas: Optional[th.Tensor] = None
+
+    ) -> None:
+        """
+        See PackedRolloutBuffer_fair.add(). Tensors are written in place (no copy to the host),
+        numpy arrays (from the environment) are uploaded once.
+        """
+        if len(log_prob.shape) == 0:
+            # Reshape 0-d tensor to avoid error
+            log_prob = log_prob.reshape(-1, 1)
+
+        self.rewards_packed[self.pos] = th.as_tensor(pack_fairness_np(reward)).reshape(self.n_envs, -1)
+        self.values_packed[self.pos] = pack_fairness_th(value).reshape(self.n_envs, -1)
+
+        # reshape needed when using multiple envs with discrete observations
+        self.observations[self.pos] = th.as_tensor(obs).reshape((self.n_envs,) + self.obs_shape)
+        self.actions[self.pos] = th.as_tensor(action).reshape(self.n_envs, self.action_dim)
+        self.episode_starts[self.pos] = th.as_tensor(episode_start)
+        self.log_probs[self.pos] = log_prob
+        # only for APPO
+        if deltas is not None:
+            self.deltas[self.pos] = deltas
+            self.delta_deltas[self.pos] = delta_deltas
+
+        self.pos += 1
+
+        if self.pos == self.buffer_size:
+            self.full = True
+
+    def get(self, batch_size: Optional[int] = None) -> Generator[RolloutBufferSamplesPacked_fair, None, None]:
+        assert self.full, ""
+        indices = th.as_tensor(np.random.permutation(self.buffer_size * self.n_envs), device=self.device)
+        # Prepare the data
+        if not self.generator_ready:
+
+            _tensor_names = [
+                "observations",
+                "actions",
+                "values_packed",
+                "log_probs",
+                "advantages_packed",
+                "returns_packed",
+                "rewards_packed",
+
+                "deltas",
+                "delta_deltas",
+            ]
+
+            for tensor in _tensor_names:
+                self.__dict__[tensor] = self.swap_and_flatten_th(self.__dict__[tensor])
+            self._update_fairness_views()
+            self.generator_ready = True
+
+        # Return everything, don't create minibatches
+        if batch_size is None:
+            batch_size = self.buffer_size * self.n_envs
+
+        start_idx = 0
+        while start_idx < self.buffer_size * self.n_envs:
+            yield self._get_samples(indices[start_idx : start_idx + batch_size])
+            start_idx += batch_size
+
+    def _get_samples(self, batch_inds: th.Tensor, env: Optional[VecNormalize] = None) -> RolloutBufferSamplesPacked_fair:
+        # indexing with a tensor already returns new tensors on the device, so there is no to_torch() here
+        return RolloutBufferSamplesPacked_fair(
+            self.observations[batch_inds],
+            self.actions[batch_inds],
+            self.values_packed[batch_inds],
+            self.log_probs[batch_inds].flatten(),
+            self.advantages_packed[batch_inds],
+            self.returns_packed[batch_inds],
+            # only for APPO
+            self.deltas[batch_inds].flatten(),
+            self.delta_deltas[batch_inds].flatten()
+        )
+
+    @staticmethod
+    def swap_and_flatten_th(arr: th.Tensor) -> th.Tensor:
+        """
+        Same as swap_and_flatten_fair() for a torch tensor
+        """
+        shape = arr.shape
+        if len(shape) < 3:
+            shape = shape + (1,)
+        return arr.transpose(0, 1).reshape(shape[0] * shape[1], *shape[2:])
+
+
+# buffers that can be selected by name (e.g. from the command line of main.py)
+ROLLOUT_BUFFERS_fair = {
+    'list': RolloutBuffer_fair,
+    'packed': PackedRolloutBuffer_fair,
+    'device': DeviceRolloutBuffer_fair,
+}
@@ -3,9 +3,13 @@ The OnPolicyALgorithm_fair class here:
 1. the reward (also advantage, etc) is of the form  [r, [r_U_0,..],[r_B_0,..]]
 2. The policy is of the type ActorCriticPolicy_fair, which can predict the values of all fairness signals
 Note that APPO, GPPO, RPPO also use such architecture, although they do not need to predict fairness reward signals 
-(so they become unnecessarily more expensive)
+(so they become unnecessarily more expensive). With main_critic_only=True, the policy only builds the main value function
+and the buffer only computes the main return/advantage (the fairness rewards are still stored for logging)
 '''
 
+import copy
+import queue
+import threading
 import time
 from datetime import timedelta
 from typing import Any, Dict, List, Optional, Tuple, Type, Union
@@ -20,15 +24,13 @@ from stable_baselines3.common.type_aliases import GymEnv, MaybeCallback, Schedul
 from stable_baselines3.common.utils import obs_as_tensor, safe_mean
 from stable_baselines3.common.vec_env import VecEnv # though we use our own vec_env, here it is only for type checking
 
-# for writing evaluation results to disk
-import pandas as pd 
 import os
 
 # fairness specific
-from .buffers_fair import RolloutBuffer_fair
+from .buffers_fair import RolloutBuffer_fair, ROLLOUT_BUFFERS_fair, pack_fairness_th
 from .policies_fair import ActorCriticPolicy_fair, BasePolicy
 # for evaluation
-from .utils_fair import evaluate_fair
+from .utils_fair import EvalSink_fair, EvalWorker_fair, evaluate_fair, evaluate_fair_batched
 
 
 class OnPolicyAlgorithm_fair(BaseAlgorithm):
@@ -63,6 +65,16 @@ class OnPolicyAlgorithm_fair(BaseAlgorithm):
         Setting it to auto, the code will be run on the GPU if possible.
     :param _init_setup_model: Whether or not to build the network at the creation of the instance
     :param supported_action_spaces: The action spaces supported by the algorithm.
+    :param rollout_buffer_class: Rollout buffer class to use, RolloutBuffer_fair (default) or PackedRolloutBuffer_fair.
+        A key of buffers_fair.ROLLOUT_BUFFERS_fair ('list' or 'packed') is also accepted.
+    :param main_critic_only: If True, do not predict the values of the 2M fairness signals (for algorithms that do not use them)
+    :param store_deltas: If True, store the APPO terms delta and delta_delta (reported by the env in info["delta"]
+        and info["delta_delta"]) in the rollout buffer
+    :param async_rollouts: If True, the next rollouts are collected in a background thread (with a snapshot of the policy)
+        while train() runs on the current one, see AsyncRolloutCollector_fair. The env work only overlaps with training
+        when it runs outside the main process (SubprocVecEnv_fair)
+    :param max_policy_lag: (only if async_rollouts) maximum number of policy updates between the snapshot that collected
+        a rollout and the training on it. max_policy_lag + 1 rollout buffers are used; 0 gives back synchronous collection
 
     modification: deal with 2M+1 rewards (using "fairness list: [r,[r_U_0,...],[r_B_0,...]]")
     """
@@ -92,6 +104,11 @@ class OnPolicyAlgorithm_fair(BaseAlgorithm):
         supported_action_spaces: Optional[Tuple[gym.spaces.Space, ...]] = None,
 
         eval_kwargs: dict = None, # args for evaluation (env_eval,  eval_write_path, eval_interval, etc)
+        rollout_buffer_class: Union[str, Type[RolloutBuffer_fair]] = RolloutBuffer_fair,
+        main_critic_only: bool = False,
+        store_deltas: bool = False,
+        async_rollouts: bool = False,
+        max_policy_lag: int = 1,
     ):
         
         super(OnPolicyAlgorithm_fair, self).__init__(
@@ -120,6 +137,15 @@ class OnPolicyAlgorithm_fair(BaseAlgorithm):
         self.vf_coef = vf_coef
         self.max_grad_norm = max_grad_norm
         self.rollout_buffer = None
+        if isinstance(rollout_buffer_class, str):
+            rollout_buffer_class = ROLLOUT_BUFFERS_fair[rollout_buffer_class]
+        self.rollout_buffer_class = rollout_buffer_class
+        self.main_critic_only = main_critic_only
+        self.store_deltas = store_deltas
+        self.async_rollouts = async_rollouts
+        self.max_policy_lag = max_policy_lag
+        # all the rollout buffers (more than one only if async_rollouts); self.rollout_buffer is the one being trained on
+        self.rollout_buffers = []
         # for eval
         self.eval_kwargs = eval_kwargs
 
@@ -130,26 +156,34 @@ class OnPolicyAlgorithm_fair(BaseAlgorithm):
         self._setup_lr_schedule()
         self.set_random_seed(self.seed)
 
-        buffer_cls = RolloutBuffer_fair
+        buffer_cls = self.rollout_buffer_class
         if isinstance(self.observation_space, gym.spaces.Dict):
             raise ValueError('Using DictRolloutBuffer from sb3; Why? Then need to rewrite their buffer too?')
 
-        self.rollout_buffer = buffer_cls(
-            self.n_steps,
-            self.observation_space,
-            self.action_space,
-            device=self.device,
-            gamma=self.gamma,
-            gae_lambda=self.gae_lambda,
-            n_envs=self.n_envs,
-            num_groups = self.num_groups,
-        )
+        # one buffer per rollout that can be in flight (see AsyncRolloutCollector_fair)
+        num_buffers = self.max_policy_lag + 1 if self.async_rollouts else 1
+        self.rollout_buffers = [
+            buffer_cls(
+                self.n_steps,
+                self.observation_space,
+                self.action_space,
+                device=self.device,
+                gamma=self.gamma,
+                gae_lambda=self.gae_lambda,
+                n_envs=self.n_envs,
+                num_groups = self.num_groups,
+                fairness_critics = not self.main_critic_only,
+            )
+            for _ in range(num_buffers)
+        ]
+        self.rollout_buffer = self.rollout_buffers[0]
         self.policy = self.policy_class(  # pytype:disable=not-instantiable # in BaseAlgorithm, self.policy_class = policy in init(). 
             self.observation_space,
             self.action_space,
             self.lr_schedule,
             use_sde=self.use_sde,
             num_groups = self.num_groups,
+            fairness_critics = not self.main_critic_only,
             **self.policy_kwargs  # pytype:disable=not-instantiable
         )
         self.policy = self.policy.to(self.device)
@@ -160,6 +194,8 @@ class OnPolicyAlgorithm_fair(BaseAlgorithm):
         callback: BaseCallback,
         rollout_buffer: RolloutBuffer_fair,
         n_rollout_steps: int,               
+        policy: Optional[ActorCriticPolicy_fair] = None,
+        step_infos: Optional[List[List[Dict[str, Any]]]] = None,
     ) -> bool:
         """
         Collect experiences using the current policy and fill a ``RolloutBuffer``.
@@ -170,34 +206,43 @@ class OnPolicyAlgorithm_fair(BaseAlgorithm):
             (and at the beginning and end of the rollout)
         :param rollout_buffer: Buffer to fill with rollouts
         :param n_steps: Number of experiences to collect per environment
+        :param policy: Policy used to act (self.policy if None)
+        :param step_infos: If not None (asynchronous collection), the infos of every step are appended to this list
+            and the callback, self.num_timesteps and self.ep_info_buffer are left to the learner (see replay_rollout_steps()).
+            The callback can then be None.
         :return: True if function returned with at least `n_rollout_steps`
             collected, False if callback terminated rollout prematurely.
         """
         assert self._last_obs is not None, "No previous observation was provided"
+        if policy is None:
+            policy = self.policy
         # Switch to eval mode (this affects batch norm / dropout)
-        self.policy.set_training_mode(False)
+        policy.set_training_mode(False)
 
         n_steps = 0
         rollout_buffer.reset()
 
         # reset env (in previous version, env is not reset)
         self._last_obs = env.reset()
+        # every env starts a new episode, whether or not the previous rollout ended with done
+        self._last_episode_starts = np.ones((env.num_envs,), dtype=bool)
 
         # Sample new weights for the state dependent exploration
         if self.use_sde:
-            self.policy.reset_noise(env.num_envs)
+            policy.reset_noise(env.num_envs)
 
-        callback.on_rollout_start()
+        if step_infos is None:
+            callback.on_rollout_start()
 
         while n_steps < n_rollout_steps:
             if self.use_sde and self.sde_sample_freq > 0 and n_steps % self.sde_sample_freq == 0:
                 # Sample a new noise matrix
-                self.policy.reset_noise(env.num_envs)
+                policy.reset_noise(env.num_envs)
 
             with th.no_grad():
                 # Convert to pytorch tensor or to TensorDict
                 obs_tensor = obs_as_tensor(self._last_obs, self.device)
-                actions, values, log_probs = self.policy(obs_tensor) # values is a "fairness List"
+                actions, values, log_probs = policy(obs_tensor) # values is a "fairness List"
             actions = actions.cpu().numpy()
 
             # Rescale and perform action
@@ -208,15 +253,18 @@ class OnPolicyAlgorithm_fair(BaseAlgorithm):
 
             new_obs, rewards, dones, infos = env.step(clipped_actions) # rewards is a "fairness List"
 
-            self.num_timesteps += env.num_envs
+            if step_infos is None:
+                self.num_timesteps += env.num_envs
 
-            # Give access to local variables
-            callback.update_locals(locals())
-            if callback.on_step() is False:
-                raise ValueError('on_step() is False, why?')
-                return False
+                # Give access to local variables
+                callback.update_locals(locals())
+                if callback.on_step() is False:
+                    raise ValueError('on_step() is False, why?')
+                    return False
 
-            self._update_info_buffer(infos) # update self.ep_info_buffer, which is related to "rollout/ep_rew_mean"; see Monitor_fair in utils_fair.py
+                self._update_info_buffer(infos) # update self.ep_info_buffer, which is related to "rollout/ep_rew_mean"; see Monitor_fair in utils_fair.py
+            else:
+                step_infos.append(infos)
             n_steps += 1
 
             if isinstance(self.action_space, gym.spaces.Discrete):
@@ -231,32 +279,63 @@ class OnPolicyAlgorithm_fair(BaseAlgorithm):
                     and infos[idx].get("terminal_observation") is not None
                     and infos[idx].get("TimeLimit.truncated", False)
                 ):
-                    terminal_obs = self.policy.obs_to_tensor(infos[idx]["terminal_observation"])[0]
+                    terminal_obs = policy.obs_to_tensor(infos[idx]["terminal_observation"])[0]
                     with th.no_grad():
                         # TODO: check whether the following is correct
-                        predicted_values = self.policy.predict_values(terminal_obs)
-                        terminal_value = [predicted_values[0][0], [predicted_values[1][g][0] for g in range(self.num_groups)], [predicted_values[2][g][0] for g in range(self.num_groups)]]
-
-                    rewards[0][idx] += self.gamma * terminal_value[0]
-                    for g in range(self.num_groups):
-                        rewards[1][g][idx] += self.gamma * terminal_value[1][g]
-                        rewards[2][g][idx] += self.gamma * terminal_value[2][g]
-
-            # only for APPO
-            delta = th.tensor(env.get_attr('delta'))
-            delta_delta = th.tensor(env.get_attr('delta_delta'))
-            rollout_buffer.add(self._last_obs, actions, rewards, self._last_episode_starts, values, log_probs, delta, delta_delta)
+                        predicted_values = policy.predict_values(terminal_obs)
+                        # in main-critic-only mode, only the main reward is bootstrapped
+                        num_critic_groups = len(predicted_values[1])
+                        terminal_value = [predicted_values[0][0], [predicted_values[1][g][0] for g in range(num_critic_groups)], [predicted_values[2][g][0] for g in range(num_critic_groups)]]
+
+                    if isinstance(rewards, np.ndarray):
+                        # packed rewards of shape (n_envs, 1 + 2M), see DummyVecEnv_fair(packed_rewards=True)
+                        rewards[idx, :1 + 2 * num_critic_groups] += self.gamma * pack_fairness_th(terminal_value).cpu().numpy()[0]
+                    else:
+                        rewards[0][idx] += self.gamma * terminal_value[0]
+                        for g in range(num_critic_groups):
+                            rewards[1][g][idx] += self.gamma * terminal_value[1][g]
+                            rewards[2][g][idx] += self.gamma * terminal_value[2][g]
+
+            # only for APPO: the env reports delta and delta_delta after the step in its info dict
+            if self.store_deltas:
+                # (np.ravel since some envs keep delta as an array of shape (1,))
+                delta = th.as_tensor(np.concatenate([np.ravel(info["delta"]) for info in infos]).astype(np.float32))
+                delta_delta = th.as_tensor(np.concatenate([np.ravel(info["delta_delta"]) for info in infos]).astype(np.float32))
+            else:
+                delta, delta_delta = None, None
+            # a device-resident buffer stores the observation tensor already on the policy device
+            obs_to_store = obs_tensor if rollout_buffer.on_device else self._last_obs
+            rollout_buffer.add(obs_to_store, actions, rewards, self._last_episode_starts, values, log_probs, delta, delta_delta)
             self._last_obs = new_obs
             self._last_episode_starts = dones
 
         with th.no_grad():
             # Compute value for the last timestep
-            values = self.policy.predict_values(obs_as_tensor(new_obs, self.device)) # a fairness List
+            values = policy.predict_values(obs_as_tensor(new_obs, self.device)) # a fairness List
 
         rollout_buffer.compute_returns_and_advantage(last_values=values, dones=dones) 
 
-        callback.on_rollout_end()
+        if step_infos is None:
+            callback.on_rollout_end()
+
+        return True
 
+    def replay_rollout_steps(self, env: VecEnv, callback: BaseCallback, step_infos: List[List[Dict[str, Any]]]) -> bool:
+        """
+        Learner side of a rollout collected asynchronously (collect_rollouts(..., step_infos=step_infos)):
+        update self.num_timesteps and self.ep_info_buffer and call the callback as collect_rollouts() would have,
+        once per collected step, so that callbacks (e.g. CheckpointCallback) run in the learner thread.
+        :return: False if the callback asked to stop training
+        """
+        callback.on_rollout_start()
+        for infos in step_infos:
+            self.num_timesteps += env.num_envs
+            callback.update_locals({"infos": infos})
+            if callback.on_step() is False:
+                raise ValueError('on_step() is False, why?')
+                return False
+            self._update_info_buffer(infos)
+        callback.on_rollout_end()
         return True
 
     def train(self) -> None:
@@ -279,18 +358,24 @@ class OnPolicyAlgorithm_fair(BaseAlgorithm):
         reset_num_timesteps: bool = True,
     ) -> "OnPolicyAlgorithm_fair":
         '''
-        Assume num_envs = 1
-        total_timesteps: the total number of env.step() during the whole on policy training process (could be very large)
-        self.num_timesteps: the current number of env.step() so far. 
+        total_timesteps: the total number of env.step() during the whole on policy training process (could be very large), summed over the envs
+        self.num_timesteps: the current number of env.step() so far, summed over the envs
         For each call of collect_rollouts() 
-            self.num_timesteps += n_rollout_steps
+            self.num_timesteps += n_rollout_steps * n_envs
             self.train() is called once
         '''
         # args for eval
-        eval_write_path = os.path.join(self.eval_kwargs['eval_write_path'],'eval.csv')
+        # eval.csv, or npz chunks exported to eval.csv at the end if eval_kwargs['eval_columnar'] (see EvalSink_fair)
+        eval_sink = EvalSink_fair(self.eval_kwargs['eval_write_path'], columnar=self.eval_kwargs.get('eval_columnar', False),
+                                  flush_every=self.eval_kwargs.get('eval_flush_every', 10))
         eval_interval = self.eval_kwargs['eval_interval']
         env_eval = self.eval_kwargs['env_eval']
         num_eps_eval = self.eval_kwargs['num_eps_eval']
+        # play the evaluation episodes in lockstep (see evaluate_fair_batched)
+        eval_batched = self.eval_kwargs.get('eval_batched', False)
+        # keep running sums instead of the rewards of every step (see EvalAccumulator_fair)
+        eval_fn_kwargs = dict(streaming=self.eval_kwargs.get('eval_streaming', False),
+                              episode_totals=self.eval_kwargs.get('eval_episode_totals', False))
 
         iteration = 0
 
@@ -302,27 +387,53 @@ class OnPolicyAlgorithm_fair(BaseAlgorithm):
 
         eval_time_flag = None
 
+        # evaluations run in a background process if eval_kwargs['eval_async'] (see EvalWorker_fair)
+        eval_worker = None
+        if eval_interval is not None and self.eval_kwargs.get('eval_async', False):
+            eval_worker = EvalWorker_fair(env_eval, self.policy, num_eps_eval, eval_sink, seed=self.seed, batched=eval_batched,
+                                          eval_fn_kwargs=eval_fn_kwargs)
+
+        # read once: with async_rollouts, only the collector thread talks to self.env during the loop
+        ep_timesteps = self.env.get_attr('ep_timesteps') # works for DummyVecEnv_fair and SubprocVecEnv_fair
+        # every rollout starts with a reset of the envs, so it must hold a whole number of episodes of each env
+        for env_ep_timesteps in ep_timesteps:
+            assert self.n_steps % env_ep_timesteps == 0, \
+                f"n_steps ({self.n_steps}) must be a multiple of the episode length ({env_ep_timesteps}), " \
+                "otherwise the last episode of every rollout is cut and counted as a complete one"
+
+        if self.async_rollouts:
+            collector = AsyncRolloutCollector_fair(self, self.env, self.rollout_buffers, n_rollout_steps=self.n_steps,
+                                                   total_timesteps=total_timesteps)
+            collector.start()
+
         while self.num_timesteps < total_timesteps:
 
             ### evaluation
             if eval_interval is not None and (iteration) % eval_interval == 0:
-                self.policy.set_training_mode(False)
-                
-                # evaluate and write to disk
-                eval_data = evaluate_fair(env_eval, self.policy, num_eps=num_eps_eval)
-                eval_data['num_timesteps'] = self.num_timesteps
-                eval_data['time_elapsed'] = str(timedelta(seconds=time.time() - eval_time_flag)) if eval_time_flag is not None else str(0)
-                df_eval = pd.DataFrame([eval_data], columns=eval_data.keys())
-                df_eval.to_csv(eval_write_path , mode='a', header=not os.path.exists(eval_write_path))            
+                time_elapsed = str(timedelta(seconds=time.time() - eval_time_flag)) if eval_time_flag is not None else str(0)
+                if eval_worker is not None:
+                    eval_worker.submit(self.policy, num_timesteps=self.num_timesteps, time_elapsed=time_elapsed)
+                else:
+                    self.policy.set_training_mode(False)
+
+                    # evaluate and write to disk
+                    eval_fn = evaluate_fair_batched if eval_batched else evaluate_fair
+                    eval_data = eval_fn(env_eval, self.policy, num_eps=num_eps_eval, **eval_fn_kwargs)
+                    eval_data['num_timesteps'] = self.num_timesteps
+                    eval_data['time_elapsed'] = time_elapsed
+                    eval_sink.write_row(eval_data)
             
                 eval_time_flag = time.time()
 
-            continue_training = self.collect_rollouts(self.env, callback, self.rollout_buffer, n_rollout_steps=self.n_steps)
+            if self.async_rollouts:
+                # the rollout was collected in the background, possibly with older weights of the policy
+                self.rollout_buffer, step_infos, policy_lag = collector.get()
+                continue_training = self.replay_rollout_steps(self.env, callback, step_infos)
+            else:
+                continue_training = self.collect_rollouts(self.env, callback, self.rollout_buffer, n_rollout_steps=self.n_steps)
 
-            # check if episode_starts starts at the correct place in the buffer 
-            num_eps_ = (self.rollout_buffer.episode_starts==1).sum()
-            for i in range(num_eps_):
-                assert self.rollout_buffer.episode_starts[i * self.env.envs[0].env.ep_timesteps] == 1 
+            # check if episode_starts starts at the correct place in the buffer, for every env
+            self.rollout_buffer.check_episode_alignment(ep_timesteps)
 
             if continue_training is False:
                 break
@@ -334,6 +445,8 @@ class OnPolicyAlgorithm_fair(BaseAlgorithm):
             if log_interval is not None and iteration % log_interval == 0:
                 fps = int((self.num_timesteps - self._num_timesteps_at_start) / (time.time() - self.start_time))
                 self.logger.record("time/iterations", iteration, exclude="tensorboard")
+                if self.async_rollouts:
+                    self.logger.record("rollout/policy_lag", policy_lag)
                 # self.ep_info_buffer comes from Monitor_fair
                 if len(self.ep_info_buffer) > 0 and len(self.ep_info_buffer[0]) > 0:
                     # ep_info["r"] is the sum of raw reward
@@ -348,11 +461,125 @@ class OnPolicyAlgorithm_fair(BaseAlgorithm):
 
             self.train()
 
+            if self.async_rollouts:
+                # hand the buffer back to the collector, together with the updated weights
+                collector.release(self.rollout_buffer)
+
+        if self.async_rollouts:
+            collector.close()
+        if eval_worker is not None:
+            eval_worker.close()
+        else:
+            eval_sink.close()
+
         callback.on_training_end()
 
         return self
 
+    def _excluded_save_params(self) -> List[str]:
+        return super()._excluded_save_params() + ["rollout_buffers"]
+
     def _get_torch_save_params(self) -> Tuple[List[str], List[str]]:
         state_dicts = ["policy", "policy.optimizer"]
 
-        return state_dicts, []
\ No newline at end of file
+        return state_dicts, []
+
+
+class AsyncRolloutCollector_fair:
+    """
+    Collects rollouts in a background thread while the learner trains on the previous one (OnPolicyAlgorithm_fair
+    with async_rollouts=True). The collector acts with its own copy of the policy, whose weights are refreshed
+    from the ones published by the learner before every rollout.
+
+    The buffers circulate between the two sides: the collector takes a free buffer, fills it with
+    model.collect_rollouts(..., policy=snapshot, step_infos=...) and queues it; the learner takes it with get(),
+    trains on it and gives it back with release(), which also publishes the new weights. With B buffers,
+    a rollout is trained on at most B - 1 policy updates after the snapshot that collected it (the "policy lag").
+
+    :param model: the OnPolicyAlgorithm_fair being trained
+    :param env: the training env (only used by the collector thread once started)
+    :param rollout_buffers: the buffers to circulate (max_policy_lag + 1 of them)
+    :param n_rollout_steps: number of steps to collect per env and rollout
+    :param total_timesteps: the collector stops once its rollouts cover it, i.e. it collects exactly the rollouts
+        the learner will consume (model.num_timesteps is counted as already collected)
+    """
+
+    def __init__(self, model: OnPolicyAlgorithm_fair, env: VecEnv, rollout_buffers: List[RolloutBuffer_fair], n_rollout_steps: int,
+                 total_timesteps: int):
+        self.model = model
+        self.env = env
+        self.n_rollout_steps = n_rollout_steps
+        self.total_timesteps = total_timesteps
+        # timesteps of the rollouts collected or being collected, as model.num_timesteps will count them
+        self.collected_timesteps = model.num_timesteps
+        self.policy = copy.deepcopy(model.policy)
+
+        self.free_buffers = queue.Queue()
+        for rollout_buffer in rollout_buffers:
+            self.free_buffers.put(rollout_buffer)
+        self.ready_rollouts = queue.Queue()
+
+        # number of policy updates so far, and version of the weights held by the collector
+        self.policy_version = 0
+        self._snapshot_version = 0
+        self._state_dict = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def _run(self) -> None:
+        try:
+            while True:
+                if self.collected_timesteps >= self.total_timesteps:
+                    # the rollouts already queued or trained on are the last ones the learner needs
+                    break
+                rollout_buffer = self.free_buffers.get()
+                if rollout_buffer is None or self._stop.is_set():
+                    break
+                self.collected_timesteps += self.n_rollout_steps * self.env.num_envs
+                with self._lock:
+                    if self._state_dict is not None:
+                        self.policy.load_state_dict(self._state_dict)
+                        self._state_dict = None
+                    version = self._snapshot_version
+                step_infos = []
+                self.model.collect_rollouts(self.env, None, rollout_buffer, self.n_rollout_steps,
+                                            policy=self.policy, step_infos=step_infos)
+                self.ready_rollouts.put((rollout_buffer, step_infos, version))
+        except BaseException as e:
+            # re-raised by the learner in get()
+            self.ready_rollouts.put(e)
+
+    def get(self) -> Tuple[RolloutBuffer_fair, List[List[Dict[str, Any]]], int]:
+        """
+        Wait for the next collected rollout.
+        :return: the filled buffer, the infos of its steps (see OnPolicyAlgorithm_fair.replay_rollout_steps())
+            and the policy lag, i.e. the number of policy updates since the weights that collected it
+        """
+        item = self.ready_rollouts.get()
+        if isinstance(item, BaseException):
+            raise item
+        rollout_buffer, step_infos, version = item
+        return rollout_buffer, step_infos, self.policy_version - version
+
+    def release(self, rollout_buffer: RolloutBuffer_fair) -> None:
+        """
+        Give a buffer back to the collector after training on it, and publish the updated weights of model.policy.
+        """
+        state_dict = {key: value.detach().clone() for key, value in self.model.policy.state_dict().items()}
+        with self._lock:
+            self.policy_version += 1
+            self._state_dict = state_dict
+            self._snapshot_version = self.policy_version
+        self.free_buffers.put(rollout_buffer)
+
+    def close(self) -> None:
+        """
+        Stop the collector, after the rollout it may be collecting (none once total_timesteps are collected).
+        """
+        self._stop.set()
+        self.free_buffers.put(None)
+        self._thread.join()
\ No newline at end of file
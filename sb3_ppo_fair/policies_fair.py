@@ -307,6 +307,11 @@ class BasePolicy(BaseModel, ABC):
             nn.init.orthogonal_(module.weight, gain=gain)
             if module.bias is not None:
                 module.bias.data.fill_(0.0)
+        elif isinstance(module, StackedLinear_fair):
+            # one orthogonal matrix per stacked layer, as for separate nn.Linear layers
+            for weight in module.weight:
+                nn.init.orthogonal_(weight, gain=gain)
+            module.bias.data.fill_(0.0)
 
     @abstractmethod
     def _predict(self, observation: th.Tensor, deterministic: bool = False) -> th.Tensor:
@@ -419,6 +424,12 @@ class ActorCriticPolicy_fair(BasePolicy):
         ``th.optim.Adam`` by default
     :param optimizer_kwargs: Additional keyword arguments,
         excluding the learning rate, to pass to the optimizer
+    :param fused_critic: If True, the 2M+1 value networks are stored as stacked weight tensors (see StackedLinear_fair)
+        and evaluated together with one batched matmul per layer, instead of 2M+1 separate MLPs.
+        The parameterization (one independent MLP per value function) and the initialization are the same.
+        Only supported with share_features_extractor=True.
+    :param fairness_critics: If False (main-critic-only mode, used by GPPO, RPPO and APPO, which do not need
+        the fairness signals' values), only the main value function is built and the values are returned as [v, [], []]
 
         
     Modification (assuming M groups)
@@ -453,6 +464,8 @@ class ActorCriticPolicy_fair(BasePolicy):
         optimizer_kwargs: Optional[Dict[str, Any]] = None,
 
         num_groups: int = 2,
+        fused_critic: bool = False,
+        fairness_critics: bool = True,
     ):
         if optimizer_kwargs is None:
             optimizer_kwargs = {}
@@ -472,6 +485,12 @@ class ActorCriticPolicy_fair(BasePolicy):
         )
         
         self.num_groups = num_groups
+        self.fused_critic = fused_critic
+        self.fairness_critics = fairness_critics
+        # number of groups whose U/B values are predicted (0 in main-critic-only mode)
+        self.num_critic_groups = num_groups if fairness_critics else 0
+        if self.fused_critic:
+            assert share_features_extractor, 'fused_critic requires share_features_extractor=True'
 
         if isinstance(net_arch, list) and len(net_arch) > 0 and isinstance(net_arch[0], dict):
             warnings.warn(
@@ -504,14 +523,14 @@ class ActorCriticPolicy_fair(BasePolicy):
             self.pi_features_extractor = self.features_extractor
             
             self.vf_features_extractor = self.features_extractor
-            for _ in range(self.num_groups):
+            for _ in range(self.num_critic_groups):
                 self.vf_features_extractor_U.append(self.features_extractor)
                 self.vf_features_extractor_B.append(self.features_extractor)
         else:
             self.pi_features_extractor = self.features_extractor
 
             self.vf_features_extractor = self.make_features_extractor()
-            for _ in range(self.num_groups):
+            for _ in range(self.num_critic_groups):
                 self.vf_features_extractor_U.append(self.make_features_extractor())
                 self.vf_features_extractor_B.append(self.make_features_extractor())
             raise ValueError('Unshard Architecture has not been tested yet. But it has been implemented, so do the test if you want to use it')
@@ -558,6 +577,8 @@ class ActorCriticPolicy_fair(BasePolicy):
                 features_extractor_class=self.features_extractor_class,
                 features_extractor_kwargs=self.features_extractor_kwargs,
                 num_groups = self.num_groups,
+                fused_critic = self.fused_critic,
+                fairness_critics = self.fairness_critics,
             )
         )
         return data
@@ -592,7 +613,8 @@ class ActorCriticPolicy_fair(BasePolicy):
             net_arch=self.net_arch,
             activation_fn=self.activation_fn,
             device=self.device,
-            num_groups=self.num_groups,
+            num_groups=self.num_critic_groups,
+            fused_critic=self.fused_critic,
         )
 
     def _build(self, lr_schedule: Schedule) -> None:
@@ -624,13 +646,17 @@ class ActorCriticPolicy_fair(BasePolicy):
         else:
             raise NotImplementedError(f"Unsupported distribution '{self.action_dist}'.")
 
-        self.value_net = nn.Linear(self.mlp_extractor.latent_dim_vf, 1) 
-        self.value_net_U, self.value_net_B = [], []
-        for _ in range(self.num_groups):
-            self.value_net_U.append( nn.Linear(self.mlp_extractor.latent_dim_vf, 1) )
-            self.value_net_B.append( nn.Linear(self.mlp_extractor.latent_dim_vf, 1) )
-        self.value_net_U = nn.ModuleList(self.value_net_U)
-        self.value_net_B = nn.ModuleList(self.value_net_B)
+        if self.fused_critic:
+            # last layers of the 2M+1 value functions, ordered as [v, v_U_0,.., v_U_(M-1), v_B_0,.., v_B_(M-1)]
+            self.value_net_fused = StackedLinear_fair(1 + 2 * self.num_critic_groups, self.mlp_extractor.latent_dim_vf, 1)
+        else:
+            self.value_net = nn.Linear(self.mlp_extractor.latent_dim_vf, 1) 
+            self.value_net_U, self.value_net_B = [], []
+            for _ in range(self.num_critic_groups):
+                self.value_net_U.append( nn.Linear(self.mlp_extractor.latent_dim_vf, 1) )
+                self.value_net_B.append( nn.Linear(self.mlp_extractor.latent_dim_vf, 1) )
+            self.value_net_U = nn.ModuleList(self.value_net_U)
+            self.value_net_B = nn.ModuleList(self.value_net_B)
 
         # Init weights: use orthogonal initialization
         # with small initial weight for the output
@@ -643,11 +669,13 @@ class ActorCriticPolicy_fair(BasePolicy):
                 self.features_extractor: np.sqrt(2),
                 self.mlp_extractor: np.sqrt(2),
                 self.action_net: 0.01,
-                self.value_net: 1,
-
-                self.value_net_U: 1,
-                self.value_net_B: 1,
             }
+            if self.fused_critic:
+                module_gains[self.value_net_fused] = 1
+            else:
+                module_gains[self.value_net] = 1
+                module_gains[self.value_net_U] = 1
+                module_gains[self.value_net_B] = 1
             if not self.share_features_extractor:
                 # Note(antonin): this is to keep SB3 results
                 # consistent, see GH#1148
@@ -676,8 +704,26 @@ class ActorCriticPolicy_fair(BasePolicy):
         """
         # Preprocess the observation if needed
         features = self.extract_features(obs) # common features for actions and all value functions (if shared)                             
+        # Evaluate the values for the given observations
+        latent_pi, values = self._get_latent_pi_and_values(features)
+
+        distribution = self._get_action_dist_from_latent(latent_pi)
+        actions = distribution.get_actions(deterministic=deterministic)
+        log_prob = distribution.log_prob(actions)
+        actions = actions.reshape((-1, *self.action_space.shape))
+        return actions, values, log_prob
+
+    def _get_latent_pi_and_values(self, features: Union[th.Tensor, Tuple[th.Tensor, List[th.Tensor]]]) -> Tuple[th.Tensor, List[th.Tensor]]:
+        """
+        :param features: the output of self.extract_features(obs)
+        :return: the latent code of the actor and the values as a "fairness list" [v, [v_U_0,...], [v_B_0,...]],
+            every value being of shape (batch_size, 1)
+        """
         if self.share_features_extractor:
             latent_pi, latent_vf_all = self.mlp_extractor(features) 
+            if self.fused_critic:
+                values_fused = self.value_net_fused(latent_vf_all) # (1 + 2M, batch_size, 1)
+                return latent_pi, [values_fused[0], [values_fused[1 + g] for g in range(self.num_critic_groups)], [values_fused[1 + self.num_critic_groups + g] for g in range(self.num_critic_groups)]]
             latent_vf, latent_vf_U, latent_vf_B = tuple(latent_vf_all)
         else:
             pi_features, vf_features_all = features
@@ -685,19 +731,14 @@ class ActorCriticPolicy_fair(BasePolicy):
             latent_pi = self.mlp_extractor.forward_actor(pi_features)
             latent_vf = self.mlp_extractor.value_net(vf_features)
             
-            latent_vf_U = [self.mlp_extractor.value_net_U[i](vf_features_U[i]) for i in range(self.num_groups)]
-            latent_vf_B = [self.mlp_extractor.value_net_B[i](vf_features_B[i]) for i in range(self.num_groups)]
-        
-        # Evaluate the values for the given observations
+            latent_vf_U = [self.mlp_extractor.value_net_U[i](vf_features_U[i]) for i in range(self.num_critic_groups)]
+            latent_vf_B = [self.mlp_extractor.value_net_B[i](vf_features_B[i]) for i in range(self.num_critic_groups)]
+
         values = self.value_net(latent_vf)
-        values_U = [self.value_net_U[i](latent_vf_U[i]) for i in range(self.num_groups)]
-        values_B = [self.value_net_B[i](latent_vf_B[i]) for i in range(self.num_groups)]
+        values_U = [self.value_net_U[i](latent_vf_U[i]) for i in range(self.num_critic_groups)]
+        values_B = [self.value_net_B[i](latent_vf_B[i]) for i in range(self.num_critic_groups)]
 
-        distribution = self._get_action_dist_from_latent(latent_pi)
-        actions = distribution.get_actions(deterministic=deterministic)
-        log_prob = distribution.log_prob(actions)
-        actions = actions.reshape((-1, *self.action_space.shape))
-        return actions, [values, values_U, values_B], log_prob
+        return latent_pi, [values, values_U, values_B]
 
     def extract_features(self, obs: th.Tensor) -> Union[th.Tensor, Tuple[th.Tensor, List[th.Tensor]]]:
         """
@@ -715,7 +756,7 @@ class ActorCriticPolicy_fair(BasePolicy):
             vf_features_U = []
             vf_features_B = []
 
-            for i in range(self.num_groups):
+            for i in range(self.num_critic_groups):
                 vf_features_U.append( super().extract_features(obs, self.vf_features_extractor_U[i]) )
                 vf_features_B.append( super().extract_features(obs, self.vf_features_extractor_B[i]) )
 
@@ -768,28 +809,13 @@ class ActorCriticPolicy_fair(BasePolicy):
         """
         # Preprocess the observation if needed
         features = self.extract_features(obs) # common features for actions and all value functions (if shared)                             
-        if self.share_features_extractor:
-            latent_pi, latent_vf_all = self.mlp_extractor(features) 
-            latent_vf, latent_vf_U, latent_vf_B = tuple(latent_vf_all)
-        else:
-            pi_features, vf_features_all = features
-            vf_features,vf_features_U, vf_features_B = tuple(vf_features_all)
-            latent_pi = self.mlp_extractor.forward_actor(pi_features)
-            latent_vf = self.mlp_extractor.value_net(vf_features)
-            
-            latent_vf_U = [self.mlp_extractor.value_net_U[i](vf_features_U[i]) for i in range(self.num_groups)]
-            latent_vf_B = [self.mlp_extractor.value_net_B[i](vf_features_B[i]) for i in range(self.num_groups)]
-        
+        latent_pi, values = self._get_latent_pi_and_values(features)
 
         distribution = self._get_action_dist_from_latent(latent_pi)
         log_prob = distribution.log_prob(actions)
         entropy = distribution.entropy()
-
-        values = self.value_net(latent_vf)
-        values_U = [self.value_net_U[i](latent_vf_U[i]) for i in range(self.num_groups)]
-        values_B = [self.value_net_B[i](latent_vf_B[i]) for i in range(self.num_groups)]
         
-        return [values, values_U, values_B], log_prob, entropy
+        return values, log_prob, entropy
 
     def get_distribution(self, obs: th.Tensor) -> Distribution:
         """
@@ -811,24 +837,9 @@ class ActorCriticPolicy_fair(BasePolicy):
         """      
         # Preprocess the observation if needed
         features = self.extract_features(obs) # common features for actions and all value functions (if shared)                             
-        if self.share_features_extractor:
-            latent_pi, latent_vf_all = self.mlp_extractor(features) 
-            latent_vf, latent_vf_U, latent_vf_B = tuple(latent_vf_all)
-        else:
-            pi_features, vf_features_all = features
-            vf_features,vf_features_U, vf_features_B = tuple(vf_features_all)
-            latent_pi = self.mlp_extractor.forward_actor(pi_features)
-            latent_vf = self.mlp_extractor.value_net(vf_features)
-            
-            latent_vf_U = [self.mlp_extractor.value_net_U[i](vf_features_U[i]) for i in range(self.num_groups)]
-            latent_vf_B = [self.mlp_extractor.value_net_B[i](vf_features_B[i]) for i in range(self.num_groups)]
-
+        _, values = self._get_latent_pi_and_values(features)
 
-        values = self.value_net(latent_vf)
-        values_U = [self.value_net_U[i](latent_vf_U[i]) for i in range(self.num_groups)]
-        values_B = [self.value_net_B[i](latent_vf_B[i]) for i in range(self.num_groups)]
-
-        return [values, values_U, values_B]
+        return values
     
 
 class MlpExtractor_fair(nn.Module):
@@ -847,6 +858,8 @@ class MlpExtractor_fair(nn.Module):
         e.g. dict(pi=[32, 32], vf=[64, 64]) then all five value networks use the same vf=[64, 64]
     :param activation_fn: The activation function to use for the networks.
     :param device: PyTorch device.
+    :param fused_critic: If True, the hidden layers of the 2M+1 value networks are StackedLinear_fair layers
+        (self.value_net_fused) and forward_critic() returns one tensor of shape (1 + 2M, batch_size, latent_dim_vf)
     """
 
     def __init__(
@@ -856,9 +869,11 @@ class MlpExtractor_fair(nn.Module):
         activation_fn: Type[nn.Module],
         device: Union[th.device, str] = "auto",
         num_groups: int = 2,
+        fused_critic: bool = False,
     ) -> None:
         super().__init__()
         self.num_groups = num_groups
+        self.fused_critic = fused_critic
         device = get_device(device)
         policy_net: List[nn.Module] = []
 
@@ -884,6 +899,13 @@ class MlpExtractor_fair(nn.Module):
             policy_net.append(activation_fn())
             last_layer_dim_pi = curr_layer_dim
         # Iterate through the value layers and build the value net
+        if self.fused_critic:
+            value_net_fused: List[nn.Module] = []
+            for curr_layer_dim in vf_layers_dims:
+                value_net_fused.append(StackedLinear_fair(1 + 2 * self.num_groups, last_layer_dim_vf, curr_layer_dim))
+                value_net_fused.append(activation_fn())
+                last_layer_dim_vf = curr_layer_dim
+            vf_layers_dims = [] # the separate value networks below are left empty
         for curr_layer_dim in vf_layers_dims:
             value_net.append(nn.Linear(last_layer_dim_vf, curr_layer_dim))
             value_net.append(activation_fn())
@@ -913,6 +935,8 @@ class MlpExtractor_fair(nn.Module):
             self.value_net_B.append( nn.Sequential(*(value_net_B[i])).to(device) )
         self.value_net_U = nn.ModuleList(self.value_net_U)
         self.value_net_B = nn.ModuleList(self.value_net_B)
+        if self.fused_critic:
+            self.value_net_fused = nn.Sequential(*value_net_fused).to(device)
 
 
     def forward(self, features: th.Tensor) -> Tuple[th.Tensor, List[th.Tensor]]:
@@ -931,7 +955,11 @@ class MlpExtractor_fair(nn.Module):
         Otherwise, should use self.value_net(features), self.value_net_U_0(features_U_0), etc
 
         return type: [ main_value, [value_U_0,...], [value_B_0,...] ]
+        (or one tensor of shape (1 + 2M, batch_size, latent_dim_vf) if self.fused_critic)
         '''
+        if self.fused_critic:
+            return self.value_net_fused(features)
+
         V_U = []
         V_B = []
 
@@ -941,3 +969,37 @@ class MlpExtractor_fair(nn.Module):
 
         return [self.value_net(features), V_U, V_B]
 
+
+class StackedLinear_fair(nn.Module):
+    """
+    ``num_stacked`` independent linear layers (in_features -> out_features), stored as stacked weight tensors
+    and evaluated with one batched matmul. Used to fuse the 2M+1 value networks (see MlpExtractor_fair).
+    Each slice is initialized like nn.Linear (and like the orthogonal init of BasePolicy.init_weights if applied).
+
+    Input: (batch_size, in_features), shared by all layers, or (num_stacked, batch_size, in_features)
+    Output: (num_stacked, batch_size, out_features)
+    """
+
+    def __init__(self, num_stacked: int, in_features: int, out_features: int) -> None:
+        super().__init__()
+        self.num_stacked = num_stacked
+        self.in_features = in_features
+        self.out_features = out_features
+        self.weight = nn.Parameter(th.empty(num_stacked, out_features, in_features))
+        self.bias = nn.Parameter(th.empty(num_stacked, out_features))
+        self.reset_parameters()
+
+    def reset_parameters(self) -> None:
+        # same as nn.Linear.reset_parameters(), for every stacked layer
+        bound = 1 / np.sqrt(self.in_features) if self.in_features > 0 else 0
+        for weight in self.weight:
+            nn.init.kaiming_uniform_(weight, a=np.sqrt(5))
+        nn.init.uniform_(self.bias, -bound, bound)
+
+    def forward(self, x: th.Tensor) -> th.Tensor:
+        if x.dim() == 2:
+            return th.matmul(x, self.weight.transpose(1, 2)) + self.bias.unsqueeze(1)
+        return th.baddbmm(self.bias.unsqueeze(1), x, self.weight.transpose(1, 2))
+
+    def extra_repr(self) -> str:
+        return f"num_stacked={self.num_stacked}, in_features={self.in_features}, out_features={self.out_features}"
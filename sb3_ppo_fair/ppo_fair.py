@@ -15,13 +15,13 @@ import torch
 import torch as th
 from gym import spaces
 from torch.nn import functional as F
-import copy
 
             
 from stable_baselines3.common.type_aliases import GymEnv, MaybeCallback, Schedule
 from stable_baselines3.common.utils import explained_variance, get_schedule_fn
 
 from .policies_fair import ActorCriticPolicy_fair
+from .buffers_fair import RolloutBuffer_fair, pack_fairness_th
 from .on_policy_algorithm_fair import OnPolicyAlgorithm_fair
 
 class PPO_fair(OnPolicyAlgorithm_fair):
@@ -68,6 +68,11 @@ class PPO_fair(OnPolicyAlgorithm_fair):
     :param device: Device (cpu, cuda, ...) on which the code should be run.
         Setting it to auto, the code will be run on the GPU if possible.
     :param _init_setup_model: Whether or not to build the network at the creation of the instance
+    :param rollout_buffer_class: Rollout buffer class (or its name in buffers_fair.ROLLOUT_BUFFERS_fair, 'list' or 'packed')
+    :param main_critic_only: If True, only the main value function is learned (the 2M value functions of the fairness signals
+        are only needed by ELBERT). If None (default), it is True iff baselines_params['method'] is not 'ELBERT'
+    :param async_rollouts: If True, collect the next rollouts in the background while training (see OnPolicyAlgorithm_fair)
+    :param max_policy_lag: (only if async_rollouts) maximum number of policy updates between collecting a rollout and training on it
 
     Modification
     1. deal with 2M + 1 rewards
@@ -106,8 +111,16 @@ class PPO_fair(OnPolicyAlgorithm_fair):
             mitigation_params: dict = None, # hyperparam of our method ELBERT, including bias_coef, beta_smooth (for soft bias) & main_reward_coef
             baselines_params: dict = None, # hyperparam for GPPO, RPPO and APPO (mainly for APPO)
             eval_kwargs: dict = None, # args for evaluation (env_eval,  eval_write_path, eval_interval, etc)
+            rollout_buffer_class: Union[str, Type[RolloutBuffer_fair]] = RolloutBuffer_fair,
+            main_critic_only: Optional[bool] = None,
+            async_rollouts: bool = False,
+            max_policy_lag: int = 1,
     ):
 
+        if main_critic_only is None:
+            main_critic_only = baselines_params.get('method', 'ELBERT') != 'ELBERT'
+        assert not (main_critic_only and mitigation_params['bias_coef'] != 0), 'ELBERT (bias_coef != 0) needs the values of the fairness signals'
+
         super(PPO_fair, self).__init__(
             policy,
             env,
@@ -134,6 +147,11 @@ class PPO_fair(OnPolicyAlgorithm_fair):
                 spaces.MultiBinary,
             ),
             eval_kwargs = eval_kwargs,
+            rollout_buffer_class = rollout_buffer_class,
+            main_critic_only = main_critic_only,
+            store_deltas = baselines_params['APPO'],
+            async_rollouts = async_rollouts,
+            max_policy_lag = max_policy_lag,
         )
 
         # Sanity check, otherwise it will lead to noisy gradient and NaN
@@ -206,11 +224,22 @@ class PPO_fair(OnPolicyAlgorithm_fair):
 
         # for logs
         entropy_losses = []
-        pg_losses, value_losses = [], [[], [[] for i in range(self.num_groups)], [[] for i in range(self.num_groups)]]
+        pg_losses, value_losses = [], [] # value_losses: one array of 1 + 2M losses per minibatch
         clip_fractions = []
 
         continue_training = True
 
+        # Fairness return signals are estimated using the whole buffer (not minibatch), see RolloutBuffer_fair.compute_fairness_statistics()
+        # They do not change during one call of train(), so the soft bias and its gradient are computed once here
+        value_U_estimate = self.rollout_buffer.value_U_estimate
+        value_B_estimate = self.rollout_buffer.value_B_estimate
+        ratio_fairness = self.rollout_buffer.ratio_fairness
+
+        # soft_bias_grad: gradient of soft bias w.r.t the ratio 
+        soft_bias, soft_bias_grad = soft_bias_value_and_gradient(ratio_fairness,self.beta_smooth)
+        # In the paper, h = soft_bias**2, so partial_h/partial_z = 2 * soft_bias * soft_bias_grad 
+        grad_h = 2 * soft_bias * soft_bias_grad
+
         # train for n_epochs epochs
         for epoch in range(self.n_epochs):
             approx_kl_divs = [] # for log
@@ -227,12 +256,13 @@ class PPO_fair(OnPolicyAlgorithm_fair):
 
                 values, log_prob, entropy = self.policy.evaluate_actions(rollout_data.observations, actions) # values is a "Fairness List"
 
-                values[0] = values[0].flatten()
-                values[1] = [i.flatten() for i in values[1]]
-                values[2] = [i.flatten() for i in values[2]]
-        
-                # Advantages shape: (batch_size,)
-                advantages = rollout_data.advantages # a "Fairness List"
+                # All 1 + 2M signals are handled at once in the packed layout (batch_size, 1 + 2M),
+                # whose columns are ordered as [r, r_U_0,.., r_U_(M-1), r_B_0,.., r_B_(M-1)]
+                values = pack_fairness_th(values)
+                old_values = pack_fairness_th(rollout_data.old_values)
+                returns = pack_fairness_th(rollout_data.returns)
+                # Advantages shape: (batch_size, 1 + 2M). Clone since the columns are modified in place below
+                advantages = pack_fairness_th(rollout_data.advantages).clone()
 
                 if self.baselines_params['APPO']:
                     # https://arxiv.org/abs/2210.12546
@@ -249,59 +279,30 @@ class PPO_fair(OnPolicyAlgorithm_fair):
                                          -div_cond * rollout_data.delta_deltas)
 
                     # Bring the 3 terms to scale for numerical stability
-                    advantages[0] = (advantages[0] - torch.min(advantages[0])) / (torch.max(advantages[0]) - torch.min(advantages[0]) + 1e-8)
+                    advantages_main = advantages[:, 0]
+                    advantages_main = (advantages_main - torch.min(advantages_main)) / (torch.max(advantages_main) - torch.min(advantages_main) + 1e-8)
                     vt_term = (vt_term - torch.min(vt_term)) / (torch.max(vt_term) - torch.min(vt_term) + 1e-8)
                     div_term = (div_term - torch.min(div_term)) / (torch.max(div_term) - torch.min(div_term) + 1e-8)
 
                     # Add terms to advantages
-                    advantages[0] = (self.baselines_params['BETA_0_APPO'] * advantages[0] + \
+                    advantages[:, 0] = (self.baselines_params['BETA_0_APPO'] * advantages_main + \
                                   self.baselines_params['BETA_1_APPO'] * vt_term + \
                                   self.baselines_params['BETA_2_APPO'] * div_term)
 
-                # Normalize advantage
+                # Normalize advantage (every column separately)
                 if self.normalize_advantage:
-                    advantages[0] = (advantages[0] - advantages[0].mean()) / (advantages[0].std() + 1e-8)
-                    for g in range(self.num_groups):
-                        advantages[1][g] = (advantages[1][g] - advantages[1][g].mean()) / (advantages[1][g].std() + 1e-8)
-                        advantages[2][g] = (advantages[2][g] - advantages[2][g].mean()) / (advantages[2][g].std() + 1e-8)
-
-                # Estimate fairness return signals using the whole buffer (not minibatch)
-                # since rollout_buffer.returns does not change during one call of train(), these estimate will be the same in every for-loop
-                # Method 1 (deprecated): Use the TD lambda return of the first state in each episode (buffer contain several episodes)
-                # Method 2 (actually used): Use Monte Carlo with gamma = 1
-                # when gae_lambda = 1 and gamma = 1, the two methods are the same
-                value_U_estimate = torch.zeros(self.num_groups, device=self.device)   
-                value_B_estimate = torch.zeros(self.num_groups, device=self.device)  
-
-                if False:
-                    # Method 1 (deprecated)
-                    for g in range(self.num_groups):                   
-                            value_U_estimate[g] = (th.tensor(self.rollout_buffer.returns[1][g][self.rollout_buffer.episode_starts==1]).to(self.device)).mean()
-                            value_B_estimate[g] = (th.tensor(self.rollout_buffer.returns[2][g][self.rollout_buffer.episode_starts==1]).to(self.device)).mean()
-                    raise ValueError('This way of computing fairness return signals is deprecated. We keep the code here only for reference')
-                else:
-                    # Method 2 (Monte Carlo with gamma = 1)
-                    num_episode_this_buffer = (self.rollout_buffer.episode_starts==1).sum()
-                    for g in range(self.num_groups):
-                     value_U_estimate[g] = (th.tensor(self.rollout_buffer.rewards[1][g]).to(self.device)).sum()/num_episode_this_buffer
-                     value_B_estimate[g] = (th.tensor(self.rollout_buffer.rewards[2][g]).to(self.device)).sum()/num_episode_this_buffer
-                
-                ratio_fairness = value_U_estimate / value_B_estimate 
-
+                    advantages = (advantages - advantages.mean(dim=0)) / (advantages.std(dim=0) + 1e-8)
 
-                # soft_bias_grad: gradient of soft bias w.r.t the ratio 
-                soft_bias, soft_bias_grad = soft_bias_value_and_gradient(copy.deepcopy(ratio_fairness),self.beta_smooth)
-                # In the paper, h = soft_bias**2, so partial_h/partial_z = 2 * soft_bias * soft_bias_grad 
-                grad_h = 2 * soft_bias * soft_bias_grad
-
-                # advantage version of gradient of U/B (using chain rule formula of grad_U/B)
-                advantages_grad_ratio_U_B = torch.zeros(self.num_groups, advantages[0].size(0), device=self.device)
-                for g in range(self.num_groups):
-                    advantages_grad_ratio_U_B[g] = (1/value_B_estimate[g]) * advantages[1][g] - \
-                        (value_U_estimate[g]/(value_B_estimate[g]**2)) * advantages[2][g]
+                if self.main_critic_only:
+                    # no advantages of the fairness signals (bias_coef = 0)
+                    advantages_fair = self.main_reward_coef * advantages[:, 0]
+                else:
+                    # advantage version of gradient of U/B (using chain rule formula of grad_U/B), shape (batch_size, M)
+                    advantages_grad_ratio_U_B = (1/value_B_estimate) * advantages[:, 1:1 + self.num_groups] - \
+                        (value_U_estimate/(value_B_estimate**2)) * advantages[:, 1 + self.num_groups:]
 
-                # advantage fair = adv_main_reward - alpha * sum_g (grad_h_g * adv_grad_ratio_U_B_g )
-                advantages_fair = self.main_reward_coef * advantages[0] + torch.matmul(advantages_grad_ratio_U_B.t(), grad_h.float()) * (- self.bias_coef)
+                    # advantage fair = adv_main_reward - alpha * sum_g (grad_h_g * adv_grad_ratio_U_B_g )
+                    advantages_fair = self.main_reward_coef * advantages[:, 0] + torch.matmul(advantages_grad_ratio_U_B, grad_h.float()) * (- self.bias_coef)
 
                 # ratio between old and new policy, should be one at the first iteration
                 ratio = th.exp(log_prob - rollout_data.old_log_prob)
@@ -324,29 +325,12 @@ class PPO_fair(OnPolicyAlgorithm_fair):
                     # Clip the different between old and new value
                     # NOTE: this depends on the reward scaling
                     # old_values is in type_aliases.RolloutBufferSamples_fair, meaning the current value estimate
-                    values_pred = [None, [None for i in range(self.num_groups)], [None for i in range(self.num_groups)]]
-                    for i in range(3):
-                        if i == 0:
-                            values_pred[i] = rollout_data.old_values[i] + th.clamp(
-                                values[i] - rollout_data.old_values[i], -clip_range_vf, clip_range_vf
-                            )
-                        else:
-                            for g in range(self.num_groups):
-                                values_pred[i][g] = rollout_data.old_values[i][g] + th.clamp(
-                                    values[i][g] - rollout_data.old_values[i][g], -clip_range_vf, clip_range_vf
-                                )
-
-                # Value loss using the TD(gae_lambda) target, for 2M+1 rewards
-                value_loss = [None, [None for i in range(self.num_groups)], [None for i in range(self.num_groups)]]
-                for i in range(3):
-                    if i == 0:
-                        value_loss[i] = F.mse_loss(rollout_data.returns[i], values_pred[i])
-                        value_losses[i].append(value_loss[i].item())
-                    else:
-                        for g in range(self.num_groups):
-                            value_loss[i][g] = F.mse_loss(rollout_data.returns[i][g], values_pred[i][g])
-                            value_losses[i][g].append(value_loss[i][g].item())
-                value_loss = value_loss[0] + sum(value_loss[1]) + sum(value_loss[2])
+                    values_pred = old_values + th.clamp(values - old_values, -clip_range_vf, clip_range_vf)
+
+                # Value loss using the TD(gae_lambda) target, for 2M+1 rewards (one mse per column; only the main one in main-critic-only mode)
+                value_loss = ((returns - values_pred) ** 2).mean(dim=0)
+                value_losses.append(value_loss.detach().cpu().numpy())
+                value_loss = value_loss.sum()
 
                 # Entropy loss favor exploration
                 if entropy is None:
@@ -389,12 +373,17 @@ class PPO_fair(OnPolicyAlgorithm_fair):
         
 
         # Logs
-        explained_var = explained_variance(self.rollout_buffer.values[0].flatten(), self.rollout_buffer.returns[0].flatten())
+        values_main, returns_main = self.rollout_buffer.values[0], self.rollout_buffer.returns[0]
+        if self.rollout_buffer.on_device:
+            values_main, returns_main = values_main.cpu().numpy(), returns_main.cpu().numpy()
+        explained_var = explained_variance(values_main.flatten(), returns_main.flatten())
         self.logger.record("train/entropy_loss", np.mean(entropy_losses))
         self.logger.record("train/policy_gradient_loss", np.mean(pg_losses)) 
-        self.logger.record("train/value_loss", np.mean(value_losses[0])) 
-        self.logger.record("train/value_loss_U", np.array([np.mean(array_g) for array_g in value_losses[1]]).mean()) # loss of value_U average acrossed all groups
-        self.logger.record("train/value_loss_B", np.array([np.mean(array_g) for array_g in value_losses[2]]).mean()) 
+        value_losses = np.mean(value_losses, axis=0)
+        self.logger.record("train/value_loss", value_losses[0]) 
+        if not self.main_critic_only:
+            self.logger.record("train/value_loss_U", value_losses[1:1 + self.num_groups].mean()) # loss of value_U average acrossed all groups
+            self.logger.record("train/value_loss_B", value_losses[1 + self.num_groups:].mean()) 
 
         self.logger.record("train/approx_kl", np.mean(approx_kl_divs))
         self.logger.record("train/clip_fraction", np.mean(clip_fractions))
@@ -407,6 +396,12 @@ class PPO_fair(OnPolicyAlgorithm_fair):
         self.logger.record("rollout_fair/hard_bias_estimate", (ratio_fairness.max() - ratio_fairness.min()).item()) 
         self.logger.record("rollout_fair/benefit_max", ratio_fairness.max().item()) 
         self.logger.record("rollout_fair/benefit_min", ratio_fairness.min().item()) 
+        if self.rollout_buffer.n_envs > 1:
+            # per-env Monte Carlo estimates, from the episodes of each env only
+            ratio_fairness_per_env = self.rollout_buffer.ratio_fairness_per_env
+            hard_bias_per_env = (ratio_fairness_per_env.max(dim=1).values - ratio_fairness_per_env.min(dim=1).values).cpu().numpy()
+            for env_idx, hard_bias in enumerate(hard_bias_per_env):
+                self.logger.record("rollout_fair/hard_bias_estimate_env{}".format(env_idx), hard_bias.item())
 
         if hasattr(self.policy, "log_std"):
             self.logger.record("train/std", th.exp(self.policy.log_std).mean().item())
@@ -467,32 +462,54 @@ def soft_bias_value_and_gradient(x,beta):
     assert isinstance(x, torch.Tensor), 'the type of input should be torch.Tensor'
     num_groups = x.size(0)
     assert num_groups > 1, 'There should be at least two groups in the environment'
-    
-    if num_groups == 2:
-        bias = x.max() - x.min()
-        bias_grad = torch.ones(2, device = x.device)
-        bias_grad[torch.argmin(x)] = -1
-        return bias, bias_grad
 
-    # following: num_groups > 2
-    assert num_groups > 2, 'When there are only two groups, do not need to use soft_bias!'
+    return soft_bias_value_and_gradient_batched(x, beta)
 
-    x.requires_grad = True
+def soft_bias_value_and_gradient_batched(x,beta):
+    '''
+    Analytic (no autograd) and batched version of soft_bias_value_and_gradient()
+    Since d smooth_max(x,beta) / dx = softmax(beta * x), the gradient of the soft bias is
+    softmax(beta * x) - softmax(-beta * x)
 
-    soft_max = smooth_max(x,beta)
-    soft_min = smooth_max(x,-beta)
+    x: (..., num_groups), e.g. several ratio vectors
+    beta: float or tensor of shape (...) (broadcast against the batch dimensions of x), e.g. several smoothing parameters
+    return: soft_bias of shape (...) and its gradient w.r.t. x of shape (..., num_groups)
 
-    soft_bias = soft_max - soft_min
-    soft_bias_grad = torch.autograd.grad(outputs=soft_bias, inputs=x)[0].detach()
-    x.requires_grad = False
+    If num_group == 2, use hard bias instead (gradient +1 for the max and -1 for the min)
+    '''
+    assert beta is not None, 'beta for computing the soft bias is None. Please specify it'
+    num_groups = x.size(-1)
+    assert num_groups > 1, 'There should be at least two groups in the environment'
 
-    ### a test using finite difference:
-    # print('by auto grad, the first element of the gradient is ',soft_bias_grad[0] )
-    # eps = 1e-3
-    # x[0] += eps
-    # soft_max = smooth_max(x,beta)
-    # soft_min = smooth_max(x,-beta)
-    # print('by finite difference, it is ', (soft_max-soft_min -soft_bias)/eps)
-    ### test ends
+    if num_groups == 2:
+        bias = x.max(dim=-1)[0] - x.min(dim=-1)[0]
+        bias_grad = torch.ones_like(x)
+        bias_grad.scatter_(-1, torch.argmin(x, dim=-1, keepdim=True), -1)
+        return bias, bias_grad
+
+    beta = torch.as_tensor(beta, dtype=x.dtype, device=x.device).unsqueeze(-1)
+    y_max = x * beta
+    y_min = x * (-beta)
+    soft_bias = torch.logsumexp(y_max, dim=-1) / beta.squeeze(-1) + torch.logsumexp(y_min, dim=-1) / beta.squeeze(-1)
+    soft_bias_grad = torch.softmax(y_max, dim=-1) - torch.softmax(y_min, dim=-1)
+
+    return soft_bias, soft_bias_grad
 
-    return (soft_bias).detach(), soft_bias_grad
\ No newline at end of file
+def check_soft_bias_gradient(x,beta,eps=1e-4):
+    '''
+    Compare the analytic gradient of soft_bias_value_and_gradient_batched() with a central finite difference
+    (computed in float64 with smooth_max), for a single ratio vector x of shape (num_groups,) with num_groups > 2
+    return: the maximum absolute difference between the two gradients
+    '''
+    x = x.detach().double()
+    _, soft_bias_grad = soft_bias_value_and_gradient_batched(x, beta)
+    grad_fd = torch.zeros_like(x)
+    for g in range(x.size(0)):
+        x_plus, x_minus = x.clone(), x.clone()
+        x_plus[g] += eps
+        x_minus[g] -= eps
+        bias_plus = smooth_max(x_plus, beta) - smooth_max(x_plus, -beta)
+        bias_minus = smooth_max(x_minus, beta) - smooth_max(x_minus, -beta)
+        grad_fd[g] = (bias_plus - bias_minus) / (2 * eps)
+
+    return (soft_bias_grad - grad_fd).abs().max().item()
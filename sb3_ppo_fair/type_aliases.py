@@ -31,6 +31,17 @@ class RolloutBufferSamples_fair(NamedTuple):
     deltas: th.Tensor   # only used by APPO
     delta_deltas: th.Tensor # only used by APPO
 
+class RolloutBufferSamplesPacked_fair(NamedTuple):
+    observations: th.Tensor
+    actions: th.Tensor
+    old_values: th.Tensor # (batch_size, 1 + 2M), columns ordered as [r, r_U_0,.., r_B_0,..]
+    old_log_prob: th.Tensor
+    advantages: th.Tensor # (batch_size, 1 + 2M)
+    returns: th.Tensor # (batch_size, 1 + 2M)
+
+    deltas: th.Tensor   # only used by APPO
+    delta_deltas: th.Tensor # only used by APPO
+
 # below are from APPO's paper
 
 # class RolloutBufferSamples(NamedTuple):
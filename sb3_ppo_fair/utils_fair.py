@@ -1,12 +1,15 @@
 '''
 1. Modify the sb3 dummy_vec_env to deal with multiple rewards
 original code: https://github.com/DLR-RM/stable-baselines3/blob/master/stable_baselines3/common/vec_env/dummy_vec_env.py
+   and the sb3 subproc_vec_env (SubprocVecEnv_fair), where the rewards are returned through shared memory
+original code: https://github.com/DLR-RM/stable-baselines3/blob/master/stable_baselines3/common/vec_env/subproc_vec_env.py
 
 2. Modify the sb3 Monitor to deal with multiple rewards
 original code: https://github.com/DLR-RM/stable-baselines3/blob/master/stable_baselines3/common/monitor.py
 
 3. evaluation
-evaluate the model during training (instead of saving checkpoints as done in APPO's code)
+evaluate the model during training (instead of saving checkpoints as done in APPO's code),
+either in the training process or in a background process (EvalWorker_fair)
 '''
 import time
 
@@ -16,43 +19,208 @@ from typing import Dict, List, Tuple
 from stable_baselines3.common.monitor import * 
 from stable_baselines3.common.type_aliases import GymObs
 
+import multiprocessing as mp
+from stable_baselines3.common.vec_env.base_vec_env import CloudpickleWrapper
+from stable_baselines3.common.vec_env.subproc_vec_env import SubprocVecEnv, _flatten_obs
+
 import numpy as np
 import torch
 import random
 import copy
 
+# for writing evaluation results to disk
+import pandas as pd
+import os
+
+from stable_baselines3.common.distributions import Distribution
+
+from .buffers_fair import pack_fairness_np, unpack_fairness
+
 class DummyVecEnv_fair(DummyVecEnv):
-    def __init__(self, env_fns: List[Callable[[], gym.Env]]):
+    """
+    DummyVecEnv whose rewards are "fairness lists" [r, [r_U_0,..],[r_B_0,..]].
+
+    The rewards of all envs are written into one preallocated float32 array self.buf_rews of shape (n_envs, 1 + 2M),
+    ordered as [r, r_U_0,.., r_U_(M-1), r_B_0,.., r_B_(M-1)] (see buffers_fair.pack_fairness_np).
+    step_wait() returns this array without copy if packed_rewards=True, and otherwise a "fairness list" of views into it,
+    so the returned rewards are only valid until the next step (the rollout buffers copy them in add()).
+    Info dicts are only deep-copied when they contain a terminal observation.
+
+    :param env_fns: a list of functions that return environments to vectorize
+    :param packed_rewards: whether step_wait() returns the packed (n_envs, 1 + 2M) array instead of a "fairness list"
+    """
+    def __init__(self, env_fns: List[Callable[[], gym.Env]], packed_rewards: bool = False):
         super().__init__(env_fns)
         
         self.num_groups = env_fns[0]().env.num_groups
-        self.buf_rews = [np.zeros((self.num_envs,), dtype=np.float32),[np.zeros((self.num_envs,), dtype=np.float32) for g in range(self.num_groups)],[np.zeros((self.num_envs,), dtype=np.float32) for g in range(self.num_groups)]]
+        self.packed_rewards = packed_rewards
+        self.buf_rews = np.zeros((self.num_envs, 1 + 2 * self.num_groups), dtype=np.float32)
+        self.buf_rews_list = unpack_fairness(self.buf_rews, self.num_groups)
 
-    def step_wait(self) -> Tuple[VecEnvObs, List[np.ndarray], np.ndarray, List[Dict]]:
+    def step_wait(self) -> Tuple[VecEnvObs, Union[np.ndarray, List[np.ndarray]], np.ndarray, List[Dict]]:
+        M = self.num_groups
         for env_idx in range(self.num_envs):
-            obs, buf_rews_list_env_idx, self.buf_dones[env_idx], self.buf_infos[env_idx] = self.envs[env_idx].step(
+            obs, rew, self.buf_dones[env_idx], self.buf_infos[env_idx] = self.envs[env_idx].step(
                 self.actions[env_idx]
             )
-            self.buf_rews[0][env_idx] = buf_rews_list_env_idx[0]
-            for g in range(self.num_groups):
-                self.buf_rews[1][g][env_idx] = buf_rews_list_env_idx[1][g]
-                self.buf_rews[2][g][env_idx] = buf_rews_list_env_idx[2][g]
+            self.buf_rews[env_idx, 0] = rew[0]
+            self.buf_rews[env_idx, 1:1 + M] = rew[1]
+            self.buf_rews[env_idx, 1 + M:] = rew[2]
 
             if self.buf_dones[env_idx]:
                 # save final observation where user can get it, then reset
                 self.buf_infos[env_idx]["terminal_observation"] = obs
                 obs = self.envs[env_idx].reset()
             self._save_obs(env_idx, obs)
-        return (self._obs_from_buf(), copy.deepcopy(self.buf_rews), np.copy(self.buf_dones), deepcopy(self.buf_infos))
+        # every env returns a new info dict at each step, so only the ones holding a terminal observation are copied
+        infos = [deepcopy(info) if "terminal_observation" in info else info for info in self.buf_infos]
+        rews = self.buf_rews if self.packed_rewards else self.buf_rews_list
+        return (self._obs_from_buf(), rews, np.copy(self.buf_dones), infos)
     
+def _worker_fair(
+    remote: mp.connection.Connection, parent_remote: mp.connection.Connection, env_fn_wrapper: CloudpickleWrapper,
+    env_idx: int, shared_rews: mp.Array, num_groups: int,
+) -> None:
+    """
+    Same as the worker of sb3's SubprocVecEnv, except that the "fairness list" reward [r, [r_U_0,..],[r_B_0,..]]
+    is written into row env_idx of the shared array shared_rews (shape (n_envs, 1 + 2M)) instead of being sent through the pipe
+    """
+    # Import here to avoid a circular import
+    from stable_baselines3.common.env_util import is_wrapped
+
+    parent_remote.close()
+    env = env_fn_wrapper.var()
+    rews = np.frombuffer(shared_rews, dtype=np.float32).reshape(-1, 1 + 2 * num_groups)
+
+    while True:
+        try:
+            cmd, data = remote.recv()
+            if cmd == "step":
+                observation, reward, done, info = env.step(data)
+                rews[env_idx] = pack_fairness_np(reward)
+                if done:
+                    # save final observation where user can get it, then reset
+                    info["terminal_observation"] = observation
+                    observation = env.reset()
+                remote.send((observation, done, info))
+            elif cmd == "seed":
+                remote.send(env.seed(data))
+            elif cmd == "reset":
+                observation = env.reset()
+                remote.send(observation)
+            elif cmd == "render":
+                remote.send(env.render(data))
+            elif cmd == "close":
+                env.close()
+                remote.close()
+                break
+            elif cmd == "get_spaces":
+                remote.send((env.observation_space, env.action_space))
+            elif cmd == "env_method":
+                method = getattr(env, data[0])
+                remote.send(method(*data[1], **data[2]))
+            elif cmd == "get_attr":
+                remote.send(getattr(env, data))
+            elif cmd == "set_attr":
+                remote.send(setattr(env, data[0], data[1]))
+            elif cmd == "is_wrapped":
+                remote.send(is_wrapped(env, data))
+            else:
+                raise NotImplementedError(f"`{cmd}` is not implemented in the worker")
+        except EOFError:
+            break
+
+class SubprocVecEnv_fair(SubprocVecEnv):
+    """
+    Counterpart of DummyVecEnv_fair running every environment (e.g. Monitor_fair(PPOEnvWrapper_fair(...))) in its own process.
+    step_wait() returns the rewards as a "fairness list" [r, [r_U_0,..],[r_B_0,..]] (each of shape (n_envs,)),
+    read from a shared-memory array written by the workers; infos (including "terminal_observation"
+    and the APPO terms "delta" and "delta_delta") go through the pipes.
+
+    :param env_fns: Environments to run in subprocesses
+    :param num_groups: number of groups M of the environments. It sizes the shared reward array, which the workers
+        need when they start, and is passed in so that the parent process never builds an environment to read it
+    :param start_method: method used to start the subprocesses (see sb3's SubprocVecEnv)
+    :param packed_rewards: whether step_wait() returns the rewards as one array of shape (n_envs, 1 + 2M) (see DummyVecEnv_fair)
+    """
+
+    def __init__(self, env_fns: List[Callable[[], gym.Env]], num_groups: int, start_method: Optional[str] = None,
+                 packed_rewards: bool = False):
+        self.waiting = False
+        self.closed = False
+        self.packed_rewards = packed_rewards
+        n_envs = len(env_fns)
+
+        self.num_groups = num_groups
+
+        if start_method is None:
+            # Fork is not a thread safe method (see issue #217)
+            # but is more user friendly (does not require to wrap the code in
+            # a `if __name__ == "__main__":`)
+            forkserver_available = "forkserver" in mp.get_all_start_methods()
+            start_method = "forkserver" if forkserver_available else "spawn"
+        ctx = mp.get_context(start_method)
+
+        # shared memory written by the workers
+        self._shared_rews = ctx.RawArray('f', n_envs * (1 + 2 * self.num_groups))
+        self.buf_rews = np.frombuffer(self._shared_rews, dtype=np.float32).reshape(n_envs, 1 + 2 * self.num_groups)
+
+        self.remotes, self.work_remotes = zip(*[ctx.Pipe() for _ in range(n_envs)])
+        self.processes = []
+        for env_idx, (work_remote, remote, env_fn) in enumerate(zip(self.work_remotes, self.remotes, env_fns)):
+            args = (work_remote, remote, CloudpickleWrapper(env_fn), env_idx, self._shared_rews, self.num_groups)
+            # daemon=True: if the main process crashes, we should not cause things to hang
+            process = ctx.Process(target=_worker_fair, args=args, daemon=True)  # pytype:disable=attribute-error
+            process.start()
+            self.processes.append(process)
+            work_remote.close()
+
+        self.remotes[0].send(("get_spaces", None))
+        observation_space, action_space = self.remotes[0].recv()
+        VecEnv.__init__(self, len(env_fns), observation_space, action_space)
+
+    def step_wait(self) -> Tuple[VecEnvObs, List[np.ndarray], np.ndarray, List[Dict]]:
+        # the rewards are in shared memory once every worker has answered
+        results = [remote.recv() for remote in self.remotes]
+        self.waiting = False
+        obs, dones, infos = zip(*results)
+        rews = self.buf_rews.copy()
+        if not self.packed_rewards:
+            rews = unpack_fairness(rews, self.num_groups)
+        return _flatten_obs(obs, self.observation_space), rews, np.stack(dones), list(infos)
+
 class Monitor_fair(Monitor):
-    def __init__(self, env: gym.Env, filename: Optional[str] = None, allow_early_resets: bool = True, reset_keywords: Tuple[str, ...] = (), info_keywords: Tuple[str, ...] = ()):
+    """
+    Monitor whose rewards are "fairness lists" [r, [r_U_0,..],[r_B_0,..]].
+    The rewards of the current episode are kept as running sums (no per-step lists).
+
+    :param episode_log_path: if not None, csv file where one row per episode is appended
+        (return "r", length "l", time "t", and the totals "U_g", "B_g" of each group).
+        The rows are kept column by column in memory and written every log_flush_episodes episodes (and on close()),
+        as are the rows of the sb3 monitor file (filename).
+    :param log_flush_episodes: number of episodes between two writes of the episode logs
+    """
+    def __init__(self, env: gym.Env, filename: Optional[str] = None, allow_early_resets: bool = True, reset_keywords: Tuple[str, ...] = (), info_keywords: Tuple[str, ...] = (),
+                 episode_log_path: Optional[str] = None, log_flush_episodes: int = 100):
         super().__init__(env, filename, allow_early_resets, reset_keywords, info_keywords)
 
         self.num_groups = env.num_groups
+        # running sums of the current episode: main reward, supply (U) and demand (B) of each group
+        self.ep_reward = 0.
+        self.ep_U = np.zeros(self.num_groups)
+        self.ep_B = np.zeros(self.num_groups)
+        self.ep_length = 0
         # e.g.: [ [], [[],[],[]], [[],[],[]] ]
-        self.rewards: List[Union[List[float],List[List[float]]]] = [[],[[] for g in range(self.num_groups)], [[] for g in range(self.num_groups)]] 
         self.episode_returns: List[Union[List[float],List[List[float]]]] = [[],[[] for g in range(self.num_groups)], [[] for g in range(self.num_groups)]]
+
+        self.episode_log_path = episode_log_path
+        self.log_flush_episodes = log_flush_episodes
+        self.episode_log = self._empty_episode_log()
+        self.pending_rows = [] # rows of the sb3 monitor file that are not written yet
+
+    def _empty_episode_log(self) -> Dict[str, List[float]]:
+        columns = ["r", "l", "t"] + ["U_{}".format(g) for g in range(self.num_groups)] + ["B_{}".format(g) for g in range(self.num_groups)]
+        return {column: [] for column in columns}
     
     def reset(self, **kwargs) -> GymObs:
         if not self.allow_early_resets and not self.needs_reset:
@@ -60,7 +228,10 @@ class Monitor_fair(Monitor):
                 "Tried to reset an environment before done. If you want to allow early resets, "
                 "wrap your env with Monitor(env, path, allow_early_resets=True)"
             )
-        self.rewards = [[],[[] for g in range(self.num_groups)], [[] for g in range(self.num_groups)]] 
+        self.ep_reward = 0.
+        self.ep_U[:] = 0
+        self.ep_B[:] = 0
+        self.ep_length = 0
         self.needs_reset = False
         for key in self.reset_keywords:
             value = kwargs.get(key)
@@ -79,32 +250,56 @@ class Monitor_fair(Monitor):
             raise RuntimeError("Tried to step environment that needs reset")
         observation, reward, done, info = self.env.step(action)
 
-        self.rewards[0].append(reward[0])
-        for g in range(self.num_groups):
-            self.rewards[1][g].append(reward[1][g])
-            self.rewards[2][g].append(reward[2][g])
+        self.ep_reward += reward[0]
+        self.ep_U += reward[1]
+        self.ep_B += reward[2]
+        self.ep_length += 1
 
         if done:
             self.needs_reset = True
-            ep_rew = [sum(self.rewards[0]), [sum(self.rewards[1][g]) for g in range(self.num_groups)], [sum(self.rewards[2][g]) for g in range(self.num_groups)]]
-            ep_len = len(self.rewards[0])
-            assert ep_len == len(self.rewards[1][0]), 'reward lengths are different'
-            ep_info = {"r": round(ep_rew[0], 6), "l": ep_len, "t": round(time.time() - self.t_start, 6)}
+            ep_time = time.time() - self.t_start
+            ep_info = {"r": round(self.ep_reward, 6), "l": self.ep_length, "t": round(ep_time, 6)}
             for key in self.info_keywords:
                 ep_info[key] = info[key]
 
-            self.episode_returns[0].append(ep_rew[0])
+            self.episode_returns[0].append(self.ep_reward)
             for g in range(self.num_groups):
-                self.episode_returns[1][g].append(ep_rew[1][g])
-                self.episode_returns[2][g].append(ep_rew[2][g])
-            self.episode_lengths.append(ep_len)
-            self.episode_times.append(time.time() - self.t_start)
+                self.episode_returns[1][g].append(self.ep_U[g])
+                self.episode_returns[2][g].append(self.ep_B[g])
+            self.episode_lengths.append(self.ep_length)
+            self.episode_times.append(ep_time)
             ep_info.update(self.current_reset_info)
             if self.results_writer:
-                self.results_writer.write_row(ep_info)
+                self.pending_rows.append(ep_info)
+            if self.episode_log_path is not None:
+                self.episode_log["r"].append(self.ep_reward)
+                self.episode_log["l"].append(self.ep_length)
+                self.episode_log["t"].append(ep_time)
+                for g in range(self.num_groups):
+                    self.episode_log["U_{}".format(g)].append(self.ep_U[g])
+                    self.episode_log["B_{}".format(g)].append(self.ep_B[g])
+            if len(self.pending_rows) >= self.log_flush_episodes or len(self.episode_log["r"]) >= self.log_flush_episodes:
+                self.flush()
             info["episode"] = ep_info
         self.total_steps += 1
         return observation, reward, done, info
+
+    def flush(self) -> None:
+        """
+        Write the episodes logged since the last flush
+        """
+        if self.results_writer and len(self.pending_rows) > 0:
+            self.results_writer.logger.writerows(self.pending_rows)
+            self.results_writer.file_handler.flush()
+            self.pending_rows = []
+        if self.episode_log_path is not None and len(self.episode_log["r"]) > 0:
+            df_log = pd.DataFrame(self.episode_log)
+            df_log.to_csv(self.episode_log_path, mode='a', index=False, header=not os.path.exists(self.episode_log_path))
+            self.episode_log = self._empty_episode_log()
+
+    def close(self) -> None:
+        self.flush()
+        super().close()
     
     def get_episode_rewards(self) -> List[List[float]]:
         """
@@ -113,11 +308,13 @@ class Monitor_fair(Monitor):
         """
         return self.episode_returns
 
-def evaluate_fair(env, agent, num_eps):
+def evaluate_fair(env, agent, num_eps, streaming=False, episode_totals=False):
     '''
     A general function to evaluate the reward and fairness of a policy
     env: should be the one with fairness reward signals (supply and demand)
     num_eps: number of episodes
+    streaming: if True, only keep running sums (see EvalAccumulator_fair) instead of the rewards of every step
+    episode_totals: (only if streaming) also keep the totals of each episode, and add their standard errors to the results
 
     Note that bias is computed using the supply and demand of the env, not using specific env's states (such as "incident_seen")
 
@@ -134,9 +331,12 @@ def evaluate_fair(env, agent, num_eps):
 
     agent.set_training_mode(False)
 
-    rewards_all = np.zeros((num_eps, num_timesteps))
-    U_all = np.zeros((num_eps, num_groups, num_timesteps))
-    B_all = np.zeros((num_eps, num_groups, num_timesteps))
+    if streaming:
+        accumulator = EvalAccumulator_fair(num_groups, num_eps, episode_totals=episode_totals)
+    else:
+        rewards_all = np.zeros((num_eps, num_timesteps))
+        U_all = np.zeros((num_eps, num_groups, num_timesteps))
+        B_all = np.zeros((num_eps, num_groups, num_timesteps))
 
 
     for ep in range(num_eps):
@@ -153,20 +353,84 @@ def evaluate_fair(env, agent, num_eps):
 
             obs, r, done, _ = env.step(action) # reward is a "Fairness List"
 
-            rewards_all[ep][t] = r[0]
-            for g in range(num_groups):
-                U_all[ep][g][t] = r[1][g]
-                B_all[ep][g][t] = r[2][g]
+            if streaming:
+                accumulator.add(ep, r)
+            else:
+                rewards_all[ep][t] = r[0]
+                for g in range(num_groups):
+                    U_all[ep][g][t] = r[1][g]
+                    B_all[ep][g][t] = r[2][g]
 
             if done:
                 break
 
+    if streaming:
+        return accumulator.eval_data(num_timesteps)
+
     U = np.sum(U_all,axis=(0,2))
-    B = np.sum(B_all,axis=(0,2)) + 1 * num_eps # 1 * num_eps is according to the formula in APPO's paper
+    B = np.sum(B_all,axis=(0,2))
+
+    return _eval_data_fair(rewards_all.sum(), U, B, num_eps, num_timesteps)
+
+class EvalAccumulator_fair:
+    '''
+    Running totals of an evaluation (streaming mode of evaluate_fair and evaluate_fair_batched):
+    the main reward and the supply U / demand B of each group, summed over episodes and timesteps.
+    Memory is O(num_groups), or O(num_eps * num_groups) if the totals of each episode are also kept
+    (episode_totals=True, used for the standard errors of the results).
+    '''
+    def __init__(self, num_groups: int, num_eps: int, episode_totals: bool = False):
+        self.num_groups = num_groups
+        self.num_eps = num_eps
+        self.reward_sum = 0.
+        self.U = np.zeros(num_groups)
+        self.B = np.zeros(num_groups)
+        self.num_steps = 0
+        self.episode_totals = episode_totals
+        if episode_totals:
+            self.ep_rewards = np.zeros(num_eps)
+            self.ep_U = np.zeros((num_eps, num_groups))
+            self.ep_B = np.zeros((num_eps, num_groups))
+
+    def add(self, ep: int, reward: List[Union[float, List[float]]]) -> None:
+        '''
+        Add the "fairness list" reward [r, [r_U_0,..],[r_B_0,..]] of one step of episode ep
+        '''
+        self.reward_sum += reward[0]
+        self.U += reward[1]
+        self.B += reward[2]
+        self.num_steps += 1
+        if self.episode_totals:
+            self.ep_rewards[ep] += reward[0]
+            self.ep_U[ep] += reward[1]
+            self.ep_B[ep] += reward[2]
+
+    def eval_data(self, num_timesteps: int) -> Dict[str, float]:
+        '''
+        The results of _eval_data_fair, plus (if episode_totals) the standard errors across episodes
+        of the return and of the supply and demand of each group
+        '''
+        eval_data = _eval_data_fair(self.reward_sum, self.U, self.B, self.num_eps, num_timesteps)
+        if self.episode_totals:
+            def standard_error(x):
+                return np.std(x, ddof=1) / np.sqrt(len(x)) if len(x) > 1 else np.nan
+            eval_data['return_se'] = standard_error(self.ep_rewards / num_timesteps)
+            for g in range(self.num_groups):
+                eval_data['demand_{}_se'.format(g)] = standard_error(self.ep_B[:, g] / num_timesteps)
+                eval_data['supply_{}_se'.format(g)] = standard_error(self.ep_U[:, g] / num_timesteps)
+        return eval_data
+
+def _eval_data_fair(reward_sum: float, U: np.ndarray, B: np.ndarray, num_eps: int, num_timesteps: int) -> Dict[str, float]:
+    '''
+    The evaluation results written to disk, from the totals (over episodes and timesteps) of the main reward
+    and of the supply U and demand B of each group
+    '''
+    num_groups = len(U)
+    B = B + 1 * num_eps # 1 * num_eps is according to the formula in APPO's paper
 
     # essential (only write these to disk): average across episodes and timesteps
     eval_data_essential = {}
-    eval_data_essential['return'] = rewards_all.mean() # average across episodes and timesteps
+    eval_data_essential['return'] = reward_sum / (num_eps * num_timesteps) # average across episodes and timesteps
     ratio_list = []
     for g in range(num_groups):
         eval_data_essential['ratio_{}'.format(g)] = U[g]/B[g]
@@ -183,4 +447,247 @@ def evaluate_fair(env, agent, num_eps):
     eval_data_essential['supply_max'] = U[max_group]/(num_eps*num_timesteps)
     eval_data_essential['supply_min'] = U[min_group]/(num_eps*num_timesteps)
 
-    return eval_data_essential
\ No newline at end of file
+    return eval_data_essential
+
+def _sample_actions_per_episode(distribution: Distribution, generators: List[torch.Generator]) -> torch.Tensor:
+    '''
+    Sample one action per row of a batched action distribution, row i using generators[i],
+    so that the actions of an episode do not depend on the other episodes of the batch
+    '''
+    dist = distribution.distribution
+    if isinstance(dist, torch.distributions.Normal):
+        noise = torch.stack([torch.randn(dist.loc.shape[1:], generator=g, device=dist.loc.device) for g in generators])
+        return dist.loc + dist.scale * noise
+    if isinstance(dist, torch.distributions.Categorical):
+        return torch.cat([torch.multinomial(probs, 1, generator=g) for probs, g in zip(dist.probs, generators)])
+    raise NotImplementedError(f'per-episode sampling is not implemented for {type(dist)}')
+
+def evaluate_fair_batched(env, agent, num_eps, deterministic=False, streaming=False, episode_totals=False):
+    '''
+    Same as evaluate_fair (including the streaming mode), but the num_eps episodes are played in lockstep on copies of env,
+    with one policy forward per timestep for all the episodes that are not done.
+
+    Each episode is still determined by its own seed: copy ep of env is seeded with seeds[ep],
+    and its actions are sampled with a torch.Generator seeded with seeds[ep].
+    (evaluate_fair instead reseeds the global random generators before each episode, while the env keeps
+    its own random generator across episodes, so the two functions give different samples of the same quantities.)
+    '''
+    assert str('ActorCriticPolicy_fair') in str(type(agent)), 'evaluate_fair only works for ActorCriticPolicy_fair policy'
+    assert str('PPOEnvWrapper_fair') in str(type(env)), 'env should be of type: PPOEnvWrapper_fair and should not be vectorized here'
+
+    num_groups = env.num_groups
+    seeds = [random.randint(0, 10000) for _ in range(num_eps)]
+    num_timesteps = env.ep_timesteps # number of steps per episodes (unless done=True) 
+
+    agent.set_training_mode(False)
+
+    if streaming:
+        accumulator = EvalAccumulator_fair(num_groups, num_eps, episode_totals=episode_totals)
+    else:
+        rewards_all = np.zeros((num_eps, num_timesteps))
+        U_all = np.zeros((num_eps, num_groups, num_timesteps))
+        B_all = np.zeros((num_eps, num_groups, num_timesteps))
+
+    envs = [copy.deepcopy(env) for _ in range(num_eps)]
+    generators = []
+    for ep in range(num_eps):
+        envs[ep].seed(seeds[ep])
+        generators.append(torch.Generator(device=agent.device))
+        generators[ep].manual_seed(seeds[ep])
+
+    obs = [envs[ep].reset() for ep in range(num_eps)]
+    active = list(range(num_eps)) # episodes that are not done
+
+    for t in range(num_timesteps):
+        with torch.no_grad():
+            obs_tensor = agent.obs_to_tensor(np.stack([obs[ep] for ep in active]))[0]
+            distribution = agent.get_distribution(obs_tensor)
+            if deterministic:
+                actions = distribution.get_actions(deterministic=True)
+            else:
+                actions = _sample_actions_per_episode(distribution, [generators[ep] for ep in active])
+        actions = actions.cpu().numpy().reshape((-1, *agent.action_space.shape))
+        if isinstance(agent.action_space, gym.spaces.Box):
+            actions = np.clip(actions, agent.action_space.low, agent.action_space.high)
+
+        still_active = []
+        for i, ep in enumerate(active):
+            obs[ep], r, done, _ = envs[ep].step(actions[i]) # reward is a "Fairness List"
+
+            if streaming:
+                accumulator.add(ep, r)
+            else:
+                rewards_all[ep][t] = r[0]
+                U_all[ep, :, t] = r[1]
+                B_all[ep, :, t] = r[2]
+
+            if not done:
+                still_active.append(ep)
+        active = still_active
+        if len(active) == 0:
+            break
+
+    if streaming:
+        return accumulator.eval_data(num_timesteps)
+
+    U = np.sum(U_all,axis=(0,2))
+    B = np.sum(B_all,axis=(0,2))
+
+    return _eval_data_fair(rewards_all.sum(), U, B, num_eps, num_timesteps)
+
+def write_eval_row(eval_data: Dict[str, Any], eval_write_path: str) -> None:
+    '''
+    Append one evaluation result (one row, see evaluate_fair) to the csv file eval_write_path
+    '''
+    df_eval = pd.DataFrame([eval_data], columns=eval_data.keys())
+    df_eval.to_csv(eval_write_path , mode='a', header=not os.path.exists(eval_write_path))
+
+class EvalSink_fair:
+    """
+    Destination of the evaluation results (one row per evaluation) of a run, in the directory eval_dir.
+
+    If columnar=False, every row is appended to eval_dir/eval.csv right away (write_eval_row).
+    If columnar=True, the rows are kept in memory and written every flush_every rows (and on close()) as one chunk
+    eval_dir/eval_chunks/chunk_<k>.npz holding one array per column; on close(), eval.csv is also exported from all
+    the chunks, so that tools reading eval.csv (e.g. plot.py) keep working. load_eval_fair() reads either format.
+
+    :param eval_dir: directory of the run
+    :param columnar: whether to buffer the rows and write them as npz chunks
+    :param flush_every: (only if columnar) number of rows per chunk
+    """
+    CHUNK_DIR = 'eval_chunks'
+
+    def __init__(self, eval_dir: str, columnar: bool = False, flush_every: int = 10):
+        self.eval_dir = eval_dir
+        self.csv_path = os.path.join(eval_dir, 'eval.csv')
+        self.columnar = columnar
+        self.flush_every = flush_every
+        self.rows = []
+        self.chunk_dir = os.path.join(eval_dir, self.CHUNK_DIR)
+        self.num_chunks = len(_eval_chunk_paths(self.chunk_dir))
+
+    def write_row(self, eval_data: Dict[str, Any]) -> None:
+        if not self.columnar:
+            write_eval_row(eval_data, self.csv_path)
+            return
+        self.rows.append(eval_data)
+        if len(self.rows) >= self.flush_every:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Write the buffered rows as a new chunk
+        """
+        if len(self.rows) == 0:
+            return
+        os.makedirs(self.chunk_dir, exist_ok=True)
+        columns = {key: np.array([row[key] for row in self.rows]) for key in self.rows[0].keys()}
+        np.savez(os.path.join(self.chunk_dir, 'chunk_{:05d}.npz'.format(self.num_chunks)), **columns)
+        self.num_chunks += 1
+        self.rows = []
+
+    def close(self) -> None:
+        """
+        Write the remaining rows and (if columnar) export eval.csv
+        """
+        if self.columnar:
+            self.flush()
+            self.export_csv()
+
+    def export_csv(self) -> None:
+        """
+        (Re)write eval.csv from the chunks
+        """
+        pd.DataFrame(load_eval_fair(self.eval_dir)).to_csv(self.csv_path)
+
+def _eval_chunk_paths(chunk_dir: str) -> List[str]:
+    if not os.path.isdir(chunk_dir):
+        return []
+    return sorted(os.path.join(chunk_dir, f) for f in os.listdir(chunk_dir) if f.startswith('chunk_') and f.endswith('.npz'))
+
+def load_eval_fair(eval_dir: str) -> Dict[str, np.ndarray]:
+    '''
+    Read the evaluation results of a run as one array per column,
+    from the npz chunks of EvalSink_fair if there are any, and from eval.csv otherwise
+    '''
+    chunk_paths = _eval_chunk_paths(os.path.join(eval_dir, EvalSink_fair.CHUNK_DIR))
+    if len(chunk_paths) == 0:
+        data = pd.read_csv(os.path.join(eval_dir, 'eval.csv'), sep=',', header=0, index_col=0)
+        return {column: data[column].to_numpy() for column in data.columns}
+    chunks = []
+    for chunk_path in chunk_paths:
+        with np.load(chunk_path) as chunk:
+            chunks.append({key: chunk[key] for key in chunk.files})
+    return {key: np.concatenate([chunk[key] for chunk in chunks]) for key in chunks[0].keys()}
+
+def _eval_worker_fair(requests: mp.Queue, env_and_policy: CloudpickleWrapper, num_eps: int, eval_sink: EvalSink_fair, seed: Optional[int],
+                      batched: bool, eval_fn_kwargs: Dict[str, Any]) -> None:
+    '''
+    Process run by EvalWorker_fair: evaluate every (state_dict, extra columns) request in order and write it to eval_sink
+    '''
+    env, policy = env_and_policy.var
+    if seed is not None:
+        random.seed(seed)
+        np.random.seed(seed)
+        torch.manual_seed(seed)
+
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        state_dict, extra = request
+        policy.load_state_dict(state_dict)
+        eval_fn = evaluate_fair_batched if batched else evaluate_fair
+        eval_data = eval_fn(env, policy, num_eps=num_eps, **eval_fn_kwargs)
+        eval_data.update(extra)
+        eval_sink.write_row(eval_data)
+    eval_sink.close()
+
+class EvalWorker_fair:
+    """
+    Runs evaluate_fair in a separate process, so that training does not wait for the evaluations.
+    The learner submits snapshots of the policy weights tagged with extra columns (e.g. num_timesteps);
+    they are evaluated one after the other, and their rows are written to eval_sink in the order of submission.
+
+    :param env: the evaluation env (a PPOEnvWrapper_fair), copied into the worker
+    :param policy: the policy being trained; a copy on the cpu is made for the worker, which then only receives state_dicts
+    :param num_eps: number of evaluation episodes
+    :param eval_sink: where the results are written (an EvalSink_fair, used by the worker only, which closes it when stopped)
+    :param seed: seed of the random generators of the worker (the per-episode seeds of evaluate_fair are drawn from them)
+    :param batched: whether to use evaluate_fair_batched instead of evaluate_fair
+    :param eval_fn_kwargs: other keyword arguments of the evaluation function (streaming, episode_totals)
+    :param start_method: method used to start the process (see SubprocVecEnv_fair)
+    """
+
+    def __init__(self, env: gym.Env, policy: torch.nn.Module, num_eps: int, eval_sink: EvalSink_fair,
+                 seed: Optional[int] = None, batched: bool = False, eval_fn_kwargs: Optional[Dict[str, Any]] = None,
+                 start_method: Optional[str] = None):
+        if start_method is None:
+            forkserver_available = "forkserver" in mp.get_all_start_methods()
+            start_method = "forkserver" if forkserver_available else "spawn"
+        ctx = mp.get_context(start_method)
+
+        self.requests = ctx.Queue()
+        policy_cpu = copy.deepcopy(policy).to('cpu')
+        args = (self.requests, CloudpickleWrapper((env, policy_cpu)), num_eps, eval_sink, seed, batched, eval_fn_kwargs or {})
+        # daemon=True: if the main process crashes, we should not cause things to hang
+        self.process = ctx.Process(target=_eval_worker_fair, args=args, daemon=True)
+        self.process.start()
+
+    def submit(self, policy: torch.nn.Module, **extra: Any) -> None:
+        """
+        Queue the evaluation of the current weights of policy; extra are written as additional columns of its row
+        """
+        if not self.process.is_alive():
+            raise RuntimeError(f'the evaluation worker exited with code {self.process.exitcode}')
+        state_dict = {key: value.detach().cpu().clone() for key, value in policy.state_dict().items()}
+        self.requests.put((state_dict, extra))
+
+    def close(self) -> None:
+        """
+        Wait until all submitted evaluations are written, then stop the worker
+        """
+        self.requests.put(None)
+        self.process.join()
+        if self.process.exitcode != 0:
+            raise RuntimeError(f'the evaluation worker exited with code {self.process.exitcode}')